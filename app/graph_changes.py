@@ -0,0 +1,94 @@
+# Graph version and change log, so clients can refresh only what changed.
+# Every write made through app.models sends one of the blinker signals in app.signals (entity_created, entity_updated,
+# entity_deleted; relationships are sent as entity_created with entity_type="relationship"). The ChangeFeed below
+# listens to them and gives each change the next graph version. On top of it, views.py serves:
+# - an ETag on /get-graph-data (and the scoped graph reads), so an unchanged graph costs a 304,
+# - /graph/changes?since=<version>, the changes after a version, and
+# - /graph/events, the same changes pushed as Server-Sent Events.
+# Versions start at the process start time in milliseconds, so they keep increasing across restarts. Only the last
+# GRAPH_CHANGES_RETAIN changes are kept; a client further behind than that (or from before a restart or a database
+# switch) gets "reset": true and reloads the graph. The feed is per process: with several worker processes, or with
+# writes made to the database outside this app, clients only see the changes made through their own process.
+# Two processes can hand out the same version number for different graphs, so ETags also carry a feed ID unique to
+# the process (its PID and a random suffix); an ETag from another worker never matches.
+
+import collections
+import os
+import threading
+import time
+import uuid
+
+from .signals import entity_created, entity_updated, entity_deleted
+
+GRAPH_CHANGES_RETAIN = int(os.environ.get("GRAPH_CHANGES_RETAIN", 10000))
+# Seconds between keepalive comments on an idle /graph/events stream
+GRAPH_EVENTS_KEEPALIVE = float(os.environ.get("GRAPH_EVENTS_KEEPALIVE", 15))
+
+
+class ChangeFeed:
+
+  def __init__(self, retain=GRAPH_CHANGES_RETAIN):
+    self.version = int(time.time() * 1000)
+    self.feed_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+    self._changes = collections.deque(maxlen=retain)
+    self._changed = threading.Condition()
+
+  def record(self, event, entity_type=None, entity_id=None, data=None):
+    with self._changed:
+      self.version += 1
+      self._changes.append({
+          "version": self.version,
+          "event": event,
+          "entity_type": entity_type,
+          "entity_id": entity_id,
+          "data": data,
+      })
+      self._changed.notify_all()
+      return self.version
+
+  def reset(self):
+    # The whole graph changed (e.g. another database was selected): drop the log so every client reloads
+    with self._changed:
+      self.version += 1
+      self._changes.clear()
+      self._changed.notify_all()
+      return self.version
+
+  def etag(self, version=None):
+    return f"graph-{self.feed_id}-{self.version if version is None else version}"
+
+  def changes_since(self, since):
+    # {"version", "changes", "reset"}; reset means the changes after `since` are no longer all known
+    with self._changed:
+      first = self._changes[0]["version"] if self._changes else self.version + 1
+      if since > self.version or since < first - 1:
+        return {"version": self.version, "changes": [], "reset": True}
+      changes = [change for change in self._changes if change["version"] > since]
+      return {"version": self.version, "changes": changes, "reset": False}
+
+  def wait(self, since, timeout):
+    # Block until the version moves past `since` or the timeout expires; returns the current version
+    with self._changed:
+      self._changed.wait_for(lambda: self.version != since, timeout)
+      return self.version
+
+
+graph_changes = ChangeFeed()
+
+
+def on_entity_created(sender, entity_type=None, entity_id=None, data=None, **extra):
+  graph_changes.record("created", entity_type, entity_id, data)
+
+
+def on_entity_updated(sender, entity_type=None, entity_id=None, data=None, **extra):
+  graph_changes.record("updated", entity_type, entity_id, data)
+
+
+def on_entity_deleted(sender, entity_type=None, entity_id=None, **extra):
+  graph_changes.record("deleted", entity_type, entity_id)
+
+
+# Connected for every sender (blinker holds these module-level functions weakly, which is fine: the module keeps them)
+entity_created.connect(on_entity_created)
+entity_updated.connect(on_entity_updated)
+entity_deleted.connect(on_entity_deleted)
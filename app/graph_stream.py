@@ -0,0 +1,77 @@
+# Streams a full graph as JSON without building it in memory first.
+# Database integrations that support it expose iter_full_graph(), a generator of records:
+# - ("entity", entity_type, entity_id, entity) for every entity, grouped by entity type, then
+# - ("relationship", relationship) for every relationship.
+# stream_graph_json turns those records into the same document get_full_graph() would serialize to,
+# {"entities": {type: {id: entity}}, "relationships": [...]}, emitted in chunks of about GRAPH_STREAM_CHUNK_BYTES so the
+# response can start as soon as the first records arrive and memory stays flat however large the graph is.
+# None entities and relationships are skipped, as /get-graph-data always did.
+
+import json
+import os
+
+GRAPH_STREAM_CHUNK_BYTES = int(os.environ.get("GRAPH_STREAM_CHUNK_BYTES", 64 * 1024))
+
+
+def iter_graph_dict(graph):
+  # Records for a graph that is already a dict, for integrations without a native iter_full_graph
+  for entity_type, entities in graph["entities"].items():
+    for entity_id, entity in entities.items():
+      yield "entity", entity_type, entity_id, entity
+  for relationship in graph["relationships"]:
+    yield "relationship", relationship
+
+
+def json_key(key):
+  # Object keys the way json.dumps writes them (it stringifies ints, floats, booleans and None)
+  if isinstance(key, str):
+    return key
+  if key is None:
+    return "null"
+  if isinstance(key, bool):
+    return "true" if key else "false"
+  return str(key)
+
+
+def stream_graph_json(records, encoder=None, chunk_bytes=GRAPH_STREAM_CHUNK_BYTES):
+  encode = (encoder or json.JSONEncoder()).encode
+  parts = ['{"entities": {']
+  size = 0
+  current_type = None
+  in_type = False  # an entity type object is open
+  in_relationships = False
+  first_relationship = True
+
+  for record in records:
+    if record[0] == "entity":
+      _, entity_type, entity_id, entity = record
+      if entity is None:
+        continue
+      if not in_type or entity_type != current_type:
+        parts.append(("}, " if in_type else "") + encode(json_key(entity_type)) + ": {")
+        current_type = entity_type
+        in_type = True
+        first_entity = True
+      part = ("" if first_entity else ", ") + encode(json_key(entity_id)) + ": " + encode(entity)
+      first_entity = False
+    else:
+      relationship = record[1]
+      if relationship is None:
+        continue
+      if not in_relationships:
+        parts.append(("}" if in_type else "") + '}, "relationships": [')
+        in_relationships = True
+      part = ("" if first_relationship else ", ") + encode(relationship)
+      first_relationship = False
+
+    parts.append(part)
+    size += len(part)
+    if size >= chunk_bytes:
+      yield "".join(parts)
+      parts = []
+      size = 0
+
+  if not in_relationships:
+    parts.append(("}" if in_type else "") + '}, "relationships": [')
+  parts.append("]}")
+  yield "".join(parts)
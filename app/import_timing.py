@@ -0,0 +1,30 @@
+# Imports that happen on demand (database backends in integrations/database/__init__.py, integrations in
+# integration_manager.py) go through timed_import, which records how long each first import took, including the
+# third-party packages it pulled in (neo4j, nebula3, openai, bs4, ...). report_import_costs prints them at startup, so
+# the cost of each enabled backend and integration is visible per worker process.
+
+import importlib
+import sys
+import threading
+import time
+
+import_costs = {}  # module path -> seconds its first import took
+_lock = threading.RLock()
+
+
+def timed_import(module_path):
+  module = sys.modules.get(module_path)
+  if module is not None:
+    return module
+  with _lock:
+    started = time.perf_counter()
+    module = importlib.import_module(module_path)
+    import_costs.setdefault(module_path, time.perf_counter() - started)
+  return module
+
+
+def report_import_costs(title="Import costs"):
+  total = sum(import_costs.values())
+  print(f"{title}: {len(import_costs)} modules imported on demand in {total * 1000:.0f}ms")
+  for module_path, seconds in sorted(import_costs.items(), key=lambda cost: cost[1], reverse=True):
+    print(f"  {seconds * 1000:8.1f}ms  {module_path}")
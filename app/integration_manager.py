@@ -12,20 +12,25 @@
 # with their corresponding callable functions, effectively making them available application-wide.
 
 # The `get_integration_function` function retrieves a callable integration function by its name from the Flask app's 
-# `integration_manager`, allowing for easy access to integration functionalities throughout the app.
+# `integration_manager`, allowing for easy access to integration functionalities throughout the app. Inside a background
+# job (see jobs.py) the function it returns also records the call as one of the job's stages.
 
 # The `initialize_integrations` function is responsible for initializing the `IntegrationManager` with the Flask app 
 # and dynamically loading integration modules from a specified directory. It checks the `INTEGRATIONS` dictionary to 
 # determine if an integration is active, and if so, it imports the module, checks for a `register` function, and 
 # executes it to register the integration. This dynamic loading mechanism allows for flexible integration management, 
-# enabling or disabling integrations as needed without modifying the core application code.
+# enabling or disabling integrations as needed without modifying the core application code. Modules are imported
+# lazily: startup only records which enabled integrations exist, and `get_integration_function` imports one the first
+# time it is asked for.
 
 
 
 # app/integration_manager.py
 import os
-import importlib
+import threading
 from flask import Flask, current_app
+from .import_timing import report_import_costs, timed_import
+from .jobs import tracked
 
 # Dictionary to hold the status of integrations
 INTEGRATIONS = {
@@ -44,22 +49,44 @@ INTEGRATIONS = {
     'ai_search' : True
 }
 
+# Enabled integrations are imported the first time they are triggered (or called by another integration), so a process
+# only pays for the modules, and the packages they pull in (openai, bs4, requests, numpy, ...), that it actually uses.
+# Integrations whose register() changes the app itself (wrapping views, starting work) are imported at startup, as
+# are all of them when INTEGRATIONS_LAZY is false.
+INTEGRATIONS_LAZY = os.environ.get("INTEGRATIONS_LAZY", "true").lower() == "true"
+EAGER_INTEGRATIONS = {'auto_add_person', 'auto_tag_person'}
+
 # This dictionary will hold callable integration functions
 INTEGRATION_FUNCTIONS = {}
 
 class IntegrationManager:
-    def __init__(self, app):
+    def __init__(self, app, package='app.integrations'):
         self.app = app
+        self.package = package
         self.integration_functions = {}
+        self.available = set()  # enabled integrations with a module, imported or not
+        self._lock = threading.RLock()
 
     def register(self, integration_name, integration_function):
         # Register the callable function for the integration
         self.integration_functions[integration_name] = integration_function
         #self.app.before_request_funcs.setdefault(None, []).append(integration_function)
 
+    def load(self, integration_name):
+        # The integration's function, importing (and registering) its module on first use; None if it is not available
+        integration_function = self.integration_functions.get(integration_name)
+        if integration_function is not None or integration_name not in self.available:
+            return integration_function
+        with self._lock:
+            if integration_name not in self.integration_functions:
+                mod = timed_import(f'{self.package}.{integration_name}')
+                if hasattr(mod, 'register'):
+                    mod.register(self)
+        return self.integration_functions.get(integration_name)
+
 def get_integration_function(integration_name):
-  # Retrieve a callable integration function by name
-  return current_app.integration_manager.integration_functions.get(integration_name)
+  # Retrieve a callable integration function by name (inside a job, wrapped to record the call as a stage)
+  return tracked(integration_name, current_app.integration_manager.load(integration_name))
 
 def initialize_integrations(app):
   app.integration_manager = IntegrationManager(app)
@@ -70,7 +97,9 @@ def initialize_integrations(app):
           continue
       integration_name = module_name[:-3]
       if INTEGRATIONS.get(integration_name):
-          module_path = f'app.integrations.{integration_name}'
-          mod = importlib.import_module(module_path)
-          if hasattr(mod, 'register'):
-              mod.register(app.integration_manager)
+          app.integration_manager.available.add(integration_name)
+          if not INTEGRATIONS_LAZY or integration_name in EAGER_INTEGRATIONS:
+              app.integration_manager.load(integration_name)
+
+  # What the database backend and the integrations loaded so far cost to import, in this process
+  report_import_costs("Startup imports")
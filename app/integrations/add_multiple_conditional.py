@@ -1,16 +1,20 @@
 # This Flask application integration, `add_multiple_conditional`, dynamically adds multiple entities and relationships
 # to a knowledge graph, leveraging other integrations `conditional_entity_addition` and `conditional_relationship_addition`.
 
-# It starts by attempting to load these integrations using `get_integration_function`, to conditionally add entities
-# and their relationships. The data processed includes entities (`nodes`) and relationships, with entities addressed first.
+# The data processed includes entities (`nodes`) and relationships, with entities addressed first.
 
-# Entities are added through `conditional_entity_add_function`, with a payload prepared for each entity containing its type
-# and data. The response updates a mapping of temporary IDs to actual system-assigned IDs, essential for linking entities
-# in relationships accurately.
+# `find_entity_matches` (from `conditional_entity_addition`) decides for all entities at once whether they already exist,
+# in concurrent batched model requests, so the time this takes barely grows with the number of entities. The new
+# entities of each type are then written with a single bulk `add_entities` call, and a mapping of temporary IDs to actual
+# system-assigned IDs (matched or created) is kept, essential for linking entities in relationships accurately.
 
 # Post entities addition, it iterates over the `relationships` data, using the entity ID mapping to construct a payload
-# for each relationship. This payload is then passed to `conditional_relationship_add_function`, which decides on the
-# relationship's addition based on internal logic.
+# for each relationship. All of them are written with a single bulk `merge_relationships` call, which skips those whose
+# (from_id, to_id, relationship) already exists, so a whole extracted graph takes a few database round trips instead of
+# one per node and edge. With RELATIONSHIP_FUZZY_MATCH, `find_relationship_match` (from
+# `conditional_relationship_addition`) first asks the model about near-duplicates. The database is then marked for
+# re-summarization (`schedule_summary` in `kg_selection`) with what was added, so the summary is updated from those
+# changes on a background worker, not in the request.
 
 # The function prints outcomes (e.g., entity added, relationship exists) and handles errors gracefully, returning a JSON
 # response with the operation's status and details on created or matched entities and relationships.
@@ -23,8 +27,10 @@
 
 # app/integrations/add_multiple_nodes_and_relationships.py
 from flask import jsonify
-from app.integration_manager import get_integration_function
-from kg_selection import summarize_and_store_graph
+from app.models import add_entities, merge_relationships
+from app.integrations.conditional_entity_addition import find_entity_matches
+from app.integrations.conditional_relationship_addition import RELATIONSHIP_FUZZY_MATCH, find_relationship_match
+from kg_selection import schedule_summary
 
 
 def add_multiple_conditional(app, data):
@@ -34,18 +40,18 @@ def add_multiple_conditional(app, data):
       print("ADD MULTIPLE NODES AND RELATIONSHIP INTEGRATION STARTED")
       created_entities = {}
       entity_names = {}
+      changes = []  # one line per entity or relationship added, for the graph summary
 
-      # Retrieve the callable functions for the conditional additions
-      conditional_entity_add_function = get_integration_function(
-          "conditional_entity_addition")
-      conditional_relationship_add_function = get_integration_function(
-          "conditional_relationship_addition")
-
-      if (not conditional_entity_add_function
-          or not conditional_relationship_add_function):
-        raise ValueError("Integration function(s) not found")
+      # Decide which entities already exist, all of them at once
+      payloads = [
+          # Prepare the payload as expected by the conditional_entity_addition
+          {"entity_type": entity_type, "data": entity_data}
+          for entity_type, entities in data["nodes"].items()
+          for entity_data in entities
+      ]
+      matches = iter(find_entity_matches(payloads))
 
-      # Handle entity additions
+      # Handle entity additions: write each type's new entities in one batch
       for entity_type, entities in data["nodes"].items():
         created_entities[entity_type] = {}
 
@@ -55,42 +61,49 @@ def add_multiple_conditional(app, data):
           entity_names[temp_id] = name
           print(f"\nEntity {temp_id} with name {name} added\n")
 
+        new_payloads = []
+        new_temp_ids = {}  # temp_id -> position in new_payloads
+        pending_by_name = {}  # lowercased name -> position, so a batch does not create the same entity twice
         for entity_data in entities:
-          # Prepare the payload as expected by the conditional_entity_addition
+          temp_id = entity_data.get("temp_id")
           payload = {"entity_type": entity_type, "data": entity_data}
-          # Use conditional_entity_addition to add the entity
-          response, status_code = conditional_entity_add_function(app, payload)
-
-          if status_code != 200:
-            # Handle non-OK responses accordingly
-            print(f"Error while adding entity: {response}")
+          match_id = next(matches)
+          if isinstance(match_id, Exception):
+            # Handle failed matches accordingly
+            print(f"Error while adding entity: {match_id}")
             continue
 
-          response_data = response.get_json()
-          print(response_data)
-
-          if not response_data["success"]:
+          if match_id is not None:
             # Handle the case where the entity already exists
-            print(
-                f"Match found, using existing {entity_type} with data: {response_data.get('match_data')}"
-            )
-          else:
-            # Handle the case where a new entity is created
-            print(
-                f"New {entity_type} added with data: {response_data.get('created_data')}"
-            )
+            print(f"Match found, using existing {entity_type} with id: {match_id}")
+            created_entities[entity_type][temp_id] = match_id
+            continue
 
+          name_key = str(entity_data.get("name", "")).strip().lower()
+          if name_key and name_key in pending_by_name:
+            print(f"Duplicate {entity_type} {entity_data.get('name')} in batch, reusing it")
+            new_temp_ids[temp_id] = pending_by_name[name_key]
+            continue
+          new_temp_ids[temp_id] = len(new_payloads)
+          if name_key:
+            pending_by_name[name_key] = len(new_payloads)
+          new_payloads.append(payload)
+
+        entity_ids = add_entities(entity_type, new_payloads)
+        changes.extend(f"{entity_type} {payload['data']}" for payload in new_payloads)
+        for temp_id, position in new_temp_ids.items():
           # Map temp_id to the actual entity identifier
-          created_entities[entity_type][entity_data.get("temp_id")] = (
-              response_data.get("entity_id", response_data.get("match_id")))
+          created_entities[entity_type][temp_id] = entity_ids[position]
+        print(f"{len(new_payloads)} new {entity_type} entities added")
 
-          print(f"\n\nEntity Names: {entity_names}\n\n")
+        print(f"\n\nEntity Names: {entity_names}\n\n")
 
-      # Handle relationship additions
+      # Handle relationship additions: write them in one batch that skips the ones already there
+      new_relationships = []
+      pending_relationships = set()  # (from_id, to_id, relationship) already queued in this batch
       for relationship in data["relationships"]:
         from_temp_id = relationship["from_temp_id"]
         to_temp_id = relationship["to_temp_id"]
-        relationship_data = relationship["data"]
 
         from_id = created_entities[relationship["from_type"]][
             relationship["from_temp_id"]]
@@ -107,31 +120,40 @@ def add_multiple_conditional(app, data):
             "relationship",
             "associated")  # Default to 'associated' if no type provided
 
-        # Use conditional_relationship_addition to add the relationship
-        response, status_code = conditional_relationship_add_function(
-            app, relationship_data)
-
-        if status_code != 200:
-          # Handle non-OK responses accordingly
-          print(f"Error while adding relationship: {response}")
+        relationship_key = (str(from_id), str(to_id), relationship_data.get("relationship"))
+        if relationship_key in pending_relationships:
+          print(f"Duplicate relationship in batch: {relationship_key}")
           continue
 
-        response_data = response.get_json()
-
-        if not response_data["success"]:
-          # Handle the case where the relationship already exists
-          print(
-              f"Match found, relationship already exists with data: {response_data.get('match_data')}"
-          )
-        else:
-          # Handle the case where a new relationship is created
-          print(f"New relationship added with data: {relationship_data}")
-          # Summarize and store the updated graph
-          database_name = app.config["SELECTED_DB"]
-          print(database_name)
-          print("444444444444444")
-          summarize_and_store_graph(app, database_name)
-          
+        if RELATIONSHIP_FUZZY_MATCH:
+          try:
+            match = find_relationship_match(relationship_data)
+          except Exception as e:
+            # Handle failed matches accordingly
+            print(f"Error while adding relationship: {e}")
+            continue
+
+          if match is not None:
+            # Handle the case where the relationship already exists
+            print(f"Match found, relationship already exists with data: {match}")
+            continue
+
+        new_relationships.append(relationship_data)
+        pending_relationships.add(relationship_key)
+
+      merged = merge_relationships(new_relationships)
+      created = 0
+      for relationship_data, (_, was_created) in zip(new_relationships, merged):
+        if was_created:
+          created += 1
+          changes.append(f"{relationship_data['from_entity']} -[{relationship_data.get('relationship')}]-> "
+                         f"{relationship_data['to_entity']}")
+      print(f"{created} new relationships added, {len(new_relationships) - created} already existed")
+      if changes:
+        # The graph summary is refreshed in the background, coalesced with other writes to this database
+        database_name = app.config["SELECTED_DB"]
+        print(database_name)
+        schedule_summary(app, database_name, changes)
 
       return jsonify({
           "success": True,
@@ -3,9 +3,8 @@ import openai
 from flask import jsonify, current_app
 import json
 from app.models import get_full_graph, search_entities, search_relationships
-from kg_selection import load_graph_summaries
-from sklearn.metrics.pairwise import cosine_similarity
-from openai.embeddings_utils import get_embedding
+from kg_selection import SUMMARY_EMBEDDING_MODEL, load_graph_summaries
+from app.llm_cache import chat_completion, embedding
 
 openai.api_key = os.getenv('OPENAI_API_KEY')
 
@@ -34,17 +33,27 @@ def collect_connections(nodes, edges):
         triplets.append(triplet)
 
     # Find all additional triplets for each node in the input list
+    relationships_by_node = index_relationships(graph['relationships'])
     for node in nodes:
         if 'temp_id' in node:
             node_temp_id = node['temp_id']
-            additional_triplets = find_connected_triplets(node_temp_id, graph, node_id_to_name)
+            additional_triplets = find_connected_triplets(node_temp_id, relationships_by_node, node_id_to_name)
             triplets.extend(additional_triplets)
 
     return triplets
 
-def find_connected_triplets(node_id, graph, node_id_to_name, exclude_id=None):
+def index_relationships(relationships):
+    # Map each node ID to the relationships touching it, so connected triplets are found in O(degree) per node
+    relationships_by_node = {}
+    for relationship in relationships:
+        relationships_by_node.setdefault(relationship['from_id'], []).append(relationship)
+        if relationship['to_id'] != relationship['from_id']:
+            relationships_by_node.setdefault(relationship['to_id'], []).append(relationship)
+    return relationships_by_node
+
+def find_connected_triplets(node_id, relationships_by_node, node_id_to_name, exclude_id=None):
     connected_triplets = []
-    for relationship in graph['relationships']:
+    for relationship in relationships_by_node.get(node_id, []):
         if (relationship['from_id'] == node_id and relationship['to_id'] != exclude_id) or (relationship['to_id'] == node_id and relationship['from_id'] != exclude_id):
             from_node_name = node_id_to_name.get(relationship['from_id'], 'Unknown')
             to_node_name = node_id_to_name.get(relationship['to_id'], 'Unknown')
@@ -58,7 +67,7 @@ def find_connected_triplets(node_id, graph, node_id_to_name, exclude_id=None):
 
 def generate_search_parameters(input_text):
   try:
-      response = openai.ChatCompletion.create(
+      response = chat_completion(
           model="gpt-3.5-turbo",
           messages=[
               {"role": "system", "content": """You are a helpful assistant expected to generate search parameters in an array format for entities and relationships based on the given user input. Output should be in array format that looks like this with "name" as the key for every parameter. User: Did Johnny Appleseed plant apple seeds? Assistant:{"name":"John","name":"Appleseed","name":"Apple","name":"Seed"}."""},
@@ -87,19 +96,12 @@ def ai_search(app, input_text):
         print(app.config["GRAPH_SUMMARIES"])
 
         # Get the embedding of the user's search query
-        query_embedding = get_embedding(input_text, engine="text-embedding-ada-002")
-
-        # Calculate the cosine similarity between the search query and each graph summary
-        max_similarity = -1
-        selected_db = None
-        for db_name, summary in app.config["GRAPH_SUMMARIES"].items():
-            summary_embedding = get_embedding(summary, engine="text-embedding-ada-002")
-            similarity = cosine_similarity([query_embedding], [summary_embedding])[0][0]
-            if similarity > max_similarity:
-                max_similarity = similarity
-                selected_db = db_name
-
-        print("Selected Database:", selected_db)
+        query_embedding = embedding(input_text, model=SUMMARY_EMBEDDING_MODEL)
+
+        # Pick the graph whose summary is most similar to the query (one product with the precomputed summary vectors)
+        selected_db, similarity = app.config["GRAPH_SUMMARY_INDEX"].best_match(query_embedding)
+
+        print("Selected Database:", selected_db, "similarity:", similarity)
         
         if selected_db is None:
             return jsonify({"error": "No suitable database found for the search query"}), 400
@@ -141,7 +143,7 @@ def ai_search(app, input_text):
         print("message: ", message)
 
         try:
-            response = openai.ChatCompletion.create(
+            response = chat_completion(
                 model="gpt-3.5-turbo",
                 messages=[
                     {"role": "system", "content": "You're an assistant that generates a concise answer to the uer input based on the data provided following the user input."},
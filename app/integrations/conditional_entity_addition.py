@@ -22,6 +22,17 @@
 
 # Error handling is included to catch and report issues during the OpenAI API call process.
 
+# Callers deduplicating many entities at once (such as `add_multiple_conditional`) use `find_entity_matches` instead: it
+# searches for every entity's candidates concurrently, then sends up to DEDUP_BATCH_SIZE entities with their candidates
+# in one JSON-mode request, running up to DEDUP_MAX_WORKERS requests at a time. Entities whose batch answer is missing or
+# unusable fall back to one model request each, on the same bounded executor. DEDUP_BATCH_SIZE=1 keeps one request per
+# entity (still concurrent). Executor threads do not inherit the caller's Flask app context, so every call submitted to
+# the executor runs inside an app context of its own for the same app (the backends read current_app.config).
+
+# Before any of that, the deterministic matchers in `entity_matchers` settle the obvious cases locally: no candidates
+# means a new entity, a single candidate with the same normalized name is a match. Only the ambiguous rest reaches the
+# model; `matcher_stats` counts both.
+
 # Finally, a `register` function is provided to make `conditional_entity_addition` available within the application's 
 # integration manager, allowing it to be dynamically loaded and invoked as part of the application's integration ecosystem.
 
@@ -30,10 +41,15 @@
 
 
 # app/integrations/conditional_entity_addition.py
+import json
 import os
+from concurrent.futures import ThreadPoolExecutor
+
 import openai
-from flask import jsonify
+from flask import current_app, has_app_context, jsonify
 from app.models import search_entities_with_type, add_entity
+from app.integrations.entity_matchers import MATCH, matcher_stats, prefilter
+from app.llm_cache import chat_completion
 
 # Your OpenAI API key should be securely stored and accessed. Hardcoding is not recommended for production systems.
 openai.api_key = os.environ['OPENAI_API_KEY']
@@ -41,6 +57,170 @@ openai.base_url = os.environ.get('OPENAI_BASE_URL', 'https://api.openai.com/v1')
 
 OPENAI_MODEL_NAME = "gpt-4-turbo-preview"
 
+DEDUP_BATCH_SIZE = int(os.environ.get('DEDUP_BATCH_SIZE', 20))
+DEDUP_MAX_WORKERS = int(os.environ.get('DEDUP_MAX_WORKERS', 8))
+
+SYSTEM_PROMPT = "You are a helpful assistant who's specialty is to decide if new input data matches data already in our database. Review the search results provided, compare against the input data, and if there's a match respond with the ID number of the match, and only the ID number. If there are no matches, respond with 'No Matches'. Your response is ALWAYS an ID number alone, or 'No Matches'. When reviewing whether a match existings in our search results to our new input, take into account that the name may not match perfectly (for example, one might have just a first name, or a nick name, while the other has a full name), in which case look at the additional information about the user to determine if there's a strong likelihood they are the same person. For companies, you should consider different names of the same company as the same, such as EA and Electronic Arts (make your best guess). If the likelihood is strong, respond with and only with the ID number. If likelihood is low, respond with 'No Matches'."
+
+BATCH_SYSTEM_PROMPT = "You are a helpful assistant who's specialty is to decide if new input data matches data already in our database. You are given a numbered list of inputs, each with the search results found for it. For each input, decide whether one of its own search results is the same entity. Take into account that the name may not match perfectly (for example, one might have just a first name, or a nick name, while the other has a full name), in which case look at the additional information to determine if there's a strong likelihood they are the same. For companies, consider different names of the same company as the same, such as EA and Electronic Arts (make your best guess). Only answer with a match when the likelihood is strong. Respond with JSON only, in the form {\"matches\": [{\"index\": <input number>, \"match_id\": <ID of the matching search result, or null>}]}, with one entry for every input."
+
+def search_candidates(entity_type, data):
+    # Existing entities of entity_type sharing any string value with data, deduplicated by ID
+    # Adjusted to access nested 'data'
+    entity_data = data.get('data', {})
+    search_results = []
+
+    # Run a search for each parameter in the input data
+    for key, value in entity_data.items():
+        # Ensure only strings are searched with a partial match
+        if isinstance(value, str):
+            search_params = {key: value}
+            print(f"Search parameters: {search_params}")
+            print("entity type: ", entity_type)
+            results = search_entities_with_type(entity_type, search_params)
+            print(f"Search results: {results}")
+            search_results.extend(results)
+
+    # Combine all search results
+    combined_results = list({result['id']: result for result in search_results}.values())
+    print(f"Combined results: {combined_results}")
+    return combined_results
+
+def find_entity_match(entity_type, data):
+    # Search for candidates and decide whether one of them is the entity in data, locally if the matchers can,
+    # otherwise by asking the model. Returns the matching ID, or None when there is no match. OpenAI errors propagate.
+    combined_results = search_candidates(entity_type, data)
+    decision = prefilter(data, combined_results)
+    if decision is not None:
+        print(f"Settled without the model: {decision}")
+        return decision[1] if decision[0] == MATCH else None
+    return ask_model(data, combined_results)
+
+def ask_model(data, combined_results):
+    # Prepare the message for OpenAI API
+    messages = [
+        {"role": "system", "content": SYSTEM_PROMPT},
+      {"role": "user", "content": f"Here are the search results: {combined_results}. Does any entry match the input data: {data}?"}
+    ]
+
+    # Make a call to OpenAI API
+    response = chat_completion(
+        model=os.environ.get('OPENAI_MODEL_NAME', OPENAI_MODEL_NAME),
+        messages=messages
+    )
+    ai_response = response.choices[0].message.content.strip()
+    print(f"AI response: {ai_response}")
+
+    if "no matches" in ai_response.lower():
+        return None
+    return ai_response
+
+def match_batch(batch):
+    # One JSON-mode request for a list of (payload, candidates); returns {position in batch: match ID or None} for the
+    # entities the model answered for. A match must be one of that entity's own candidates.
+    inputs = "\n".join(
+        f"{index}. Input: {payload}\n   Search results: {candidates}"
+        for index, (payload, candidates) in enumerate(batch)
+    )
+    response = chat_completion(
+        model=os.environ.get('OPENAI_MODEL_NAME', OPENAI_MODEL_NAME),
+        messages=[
+            {"role": "system", "content": BATCH_SYSTEM_PROMPT},
+            {"role": "user", "content": inputs},
+        ],
+        response_format={"type": "json_object"},
+    )
+    ai_response = response.choices[0].message.content.strip()
+    print(f"AI batch response: {ai_response}")
+
+    answers = {}
+    try:
+        matches = json.loads(ai_response).get("matches", [])
+    except (ValueError, AttributeError):
+        return answers
+    for match in matches:
+        if not isinstance(match, dict) or not isinstance(match.get("index"), int):
+            continue
+        index = match["index"]
+        if not 0 <= index < len(batch):
+            continue
+        match_id = match.get("match_id")
+        candidate_ids = {str(candidate['id']): candidate['id'] for candidate in batch[index][1]}
+        answers[index] = candidate_ids.get(str(match_id)) if match_id is not None else None
+    return answers
+
+def in_app_context(function):
+    # function, run inside an app context for the current app when called from another thread
+    if not has_app_context():
+        return function
+    app = current_app._get_current_object()
+
+    def run(*args, **kwargs):
+        with app.app_context():
+            return function(*args, **kwargs)
+
+    return run
+
+def find_entity_matches(payloads):
+    # find_entity_match for many {"entity_type", "data"} payloads at once, in their order. An entry is the matching
+    # ID, None for a new entity, or the exception raised while deciding (so one failure does not lose the rest).
+    results = [None] * len(payloads)
+    if not payloads:
+        return results
+
+    with ThreadPoolExecutor(max_workers=DEDUP_MAX_WORKERS) as executor:
+        searches = [executor.submit(in_app_context(search_candidates), payload['entity_type'], payload) for payload in payloads]
+        pending = []  # positions of the entities the matchers could not settle
+        candidates = {}
+        for position, search in enumerate(searches):
+            try:
+                candidates[position] = search.result()
+            except Exception as e:
+                results[position] = e
+                continue
+            decision = prefilter(payloads[position], candidates[position])
+            if decision is None:
+                pending.append(position)
+            elif decision[0] == MATCH:
+                results[position] = decision[1]
+
+        # One request per batch of entities, all batches at once
+        batches = [pending[start:start + DEDUP_BATCH_SIZE] for start in range(0, len(pending), DEDUP_BATCH_SIZE)]
+        if DEDUP_BATCH_SIZE > 1:
+            futures = [
+                (batch, executor.submit(in_app_context(match_batch), [(payloads[position], candidates[position]) for position in batch]))
+                for batch in batches
+            ]
+            unanswered = []
+            for batch, future in futures:
+                try:
+                    answers = future.result()
+                except Exception as e:
+                    print(f"Error calling OpenAI for a batch of {len(batch)}: {e}")
+                    answers = {}
+                for index, position in enumerate(batch):
+                    if index in answers:
+                        results[position] = answers[index]
+                    else:
+                        unanswered.append(position)
+        else:
+            unanswered = pending
+
+        # Whatever the batches did not settle is asked one entity per request
+        singles = [
+            (position, executor.submit(in_app_context(ask_model), payloads[position], candidates[position]))
+            for position in unanswered
+        ]
+        for position, future in singles:
+            try:
+                results[position] = future.result()
+            except Exception as e:
+                results[position] = e
+
+    print(f"Entity matching: {len(candidates) - len(pending)} of {len(payloads)} settled without the model; "
+          f"totals so far: {matcher_stats.snapshot()}")
+    return results
+
 def conditional_entity_addition(app, data):
     with app.app_context():
         # Retrieve the entity type from the data
@@ -48,49 +228,17 @@ def conditional_entity_addition(app, data):
         # If no entity type is provided, return an error
         if not entity_type:
             return jsonify({"error": "Entity type is required."}), 400
-  
-        # Adjusted to access nested 'data'
-        entity_data = data.get('data', {})
-        search_results = []
-  
-        # Run a search for each parameter in the input data
-        for key, value in entity_data.items():
-            # Ensure only strings are searched with a partial match
-            if isinstance(value, str):
-                search_params = {key: value}
-                print(f"Search parameters: {search_params}")
-                print("entity type: ", entity_type)
-                results = search_entities_with_type(entity_type, search_params)
-                print(f"Search results: {results}")
-                search_results.extend(results)
-  
-        # Combine all search results
-        combined_results = {result['id']: result for result in search_results}.values()
-        print(f"Combined results: {list(combined_results)}")
-
-        # Prepare the message for OpenAI API
-        messages = [
-            {"role": "system", "content": "You are a helpful assistant who's specialty is to decide if new input data matches data already in our database. Review the search results provided, compare against the input data, and if there's a match respond with the ID number of the match, and only the ID number. If there are no matches, respond with 'No Matches'. Your response is ALWAYS an ID number alone, or 'No Matches'. When reviewing whether a match existings in our search results to our new input, take into account that the name may not match perfectly (for example, one might have just a first name, or a nick name, while the other has a full name), in which case look at the additional information about the user to determine if there's a strong likelihood they are the same person. For companies, you should consider different names of the same company as the same, such as EA and Electronic Arts (make your best guess). If the likelihood is strong, respond with and only with the ID number. If likelihood is low, respond with 'No Matches'."},
-          {"role": "user", "content": f"Here are the search results: {list(combined_results)}. Does any entry match the input data: {data}?"}
-        ]
 
-        # Make a call to OpenAI API
         try:
-            response = openai.ChatCompletion.create(
-                model=os.environ.get('OPENAI_MODEL_NAME', OPENAI_MODEL_NAME),
-                messages=messages
-            )
-            ai_response = response.choices[0].message.content.strip()
-            print(f"AI response: {ai_response}")
+            match_id = find_entity_match(entity_type, data)
 
             # Process the AI's response
-            if "no matches" in ai_response.lower():
+            if match_id is None:
                 # If no match found, add the new entity
                 entity_id = add_entity(entity_type, data)
                 return jsonify({"success": True, "entity_id": entity_id}), 200
             else:
                 # If a match is found, return the match details
-                match_id = ai_response
                 return jsonify({"success": False, "message": "Match found", "match_id": match_id}), 200
 
         except Exception as e:
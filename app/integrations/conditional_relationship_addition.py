@@ -23,6 +23,12 @@
 # within the application's integration manager. This allows for dynamic loading and invocation within the application's 
 # integration framework.
 
+# A relationship is identified exactly by (from_id, to_id, relationship), so deduplication no longer needs the model:
+# new relationships are written with `merge_relationship`, which the database backends implement as an index lookup or
+# a MERGE, adding the relationship only if that key is not there yet, in a single round trip. The model comparison
+# described above is kept as an optional fuzzy fallback for near-duplicates (e.g. differently worded relationship types),
+# enabled with RELATIONSHIP_FUZZY_MATCH=true.
+
 # This integration showcases an advanced application of AI to enhance data integrity within web applications, enabling 
 # precise and automated management of relationships in a knowledge graph, and preventing the duplication of relationship data.
 
@@ -32,7 +38,8 @@
 import os
 import openai
 from flask import jsonify
-from app.models import search_relationships, add_relationship
+from app.models import search_relationships, find_relationship, merge_relationship
+from app.llm_cache import chat_completion
 
 # Your OpenAI API key should be securely stored and accessed. Hardcoding is not recommended for production systems.
 openai.api_key = os.environ['OPENAI_API_KEY']
@@ -40,42 +47,60 @@ openai.base_url = os.environ.get('OPENAI_BASE_URL', 'https://api.openai.com/v1')
 
 OPENAI_MODEL_NAME = "gpt-4-turbo-preview"
 
+REQUIRED_FIELDS = ['from_id', 'from_type', 'to_id', 'to_type']
+
+RELATIONSHIP_FUZZY_MATCH = os.environ.get('RELATIONSHIP_FUZZY_MATCH', 'false').lower() == 'true'
+
+def find_relationship_match(data):
+    # The existing relationship with the same key, or (with RELATIONSHIP_FUZZY_MATCH) the model's description of a
+    # near-duplicate between the same endpoints. Returns None when there is no match. OpenAI errors propagate.
+    match = find_relationship(data)
+    if match is not None or not RELATIONSHIP_FUZZY_MATCH:
+        return match
+
+    # Prepare search parameters, excluding 'relationship_type' if not provided
+    search_params = {key: data[key] for key in REQUIRED_FIELDS}
+
+    print(f"Search parameters: {search_params}")
+    search_results = search_relationships(search_params)
+
+    # Prepare the message for OpenAI API
+    messages = [
+        {"role": "system", "content": "You are a helpful assistant. Your task is to determine whether a proposed new relationship between two nodes already exists in the database. You should only consider a relationship a match if all the search parameters correspond exactly to an existing relationship. If you find a match, your response should be the full details of the matching relationship, and only the full details as JSON. If there is no match, respond with 'No Matches'. Your response should always be either just JSON response or 'No Matches'."},
+        {"role": "user", "content": f"Existing relationships: {search_results}. Do any of these match the proposed relationship details: {data}?"}
+    ]
+
+    # Make a call to OpenAI API
+    response = chat_completion(
+        model=os.environ.get('OPENAI_MODEL_NAME', OPENAI_MODEL_NAME),
+        messages=messages
+    )
+    ai_response = response.choices[0].message.content.strip()
+
+    if "No Matches" in ai_response:
+        return None
+    return ai_response
+
 def conditional_relationship_addition(app, data):
     with app.app_context():
         # Validate that we have all necessary identifiers for a relationship
-        required_fields = ['from_id', 'from_type', 'to_id', 'to_type']
-        for field in required_fields:
+        for field in REQUIRED_FIELDS:
             if field not in data:
                 return jsonify({"error": f"'{field}' is required."}), 400
 
-        # Prepare search parameters, excluding 'relationship_type' if not provided
-        search_params = {key: data[key] for key in required_fields}
-
-        print(f"Search parameters: {search_params}")
-        search_results = search_relationships(search_params)
-
-        # Prepare the message for OpenAI API
-        messages = [
-            {"role": "system", "content": "You are a helpful assistant. Your task is to determine whether a proposed new relationship between two nodes already exists in the database. You should only consider a relationship a match if all the search parameters correspond exactly to an existing relationship. If you find a match, your response should be the full details of the matching relationship, and only the full details as JSON. If there is no match, respond with 'No Matches'. Your response should always be either just JSON response or 'No Matches'."},
-            {"role": "user", "content": f"Existing relationships: {search_results}. Do any of these match the proposed relationship details: {data}?"}
-        ]
-
-        # Make a call to OpenAI API
         try:
-            response = openai.ChatCompletion.create(
-                model=os.environ.get('OPENAI_MODEL_NAME', OPENAI_MODEL_NAME),
-                messages=messages
-            )
-            ai_response = response.choices[0].message.content.strip()
-
-            # Process the AI's response
-            if "No Matches" in ai_response:
-                # If no match found, add the new relationship
-                relationship_id = add_relationship(data)
-                return jsonify({"success": True, "relationship": data}), 200
-            else:
-                # If a match is found, return the matched relationship data
-                return jsonify({"success": False, "message": "Match found", "matching_relationship": ai_response}), 200
+            if RELATIONSHIP_FUZZY_MATCH:
+                match = find_relationship_match(data)
+                if match is not None:
+                    # If a match is found, return the matched relationship data
+                    return jsonify({"success": False, "message": "Match found", "matching_relationship": match}), 200
+
+            # Add the relationship unless the same one exists, in one round trip
+            relationship_id, created = merge_relationship(data)
+            if not created:
+                return jsonify({"success": False, "message": "Match found",
+                                "matching_relationship": {**data, "id": relationship_id}}), 200
+            return jsonify({"success": True, "relationship": data}), 200
 
         except Exception as e:
             print(f"Error calling OpenAI: {e}")
@@ -1,10 +1,30 @@
 import os
 
-from .memory import InMemoryDatabase
-from .nexus import NexusDBIntegration
-from .nebulagraph import NebulaGraphIntegration
-from .falkordb import FalkorDBIntegration
-from .neo4j import Neo4jDBIntegration
+from ...import_timing import timed_import
+
+# DATABASE_TYPE -> (module, integration class). Only the selected backend's module (and its driver: neo4j, falkordb,
+# nebula3, nexus_python) is imported; load_backend imports any other one the first time it is asked for, and the
+# classes can still be imported from this package by name.
+BACKENDS = {
+    "memory": ("memory", "InMemoryDatabase"),
+    "nexusdb": ("nexus", "NexusDBIntegration"),
+    "nebulagraph": ("nebulagraph", "NebulaGraphIntegration"),
+    "falkordb": ("falkordb", "FalkorDBIntegration"),
+    "neo4j": ("neo4j", "Neo4jDBIntegration"),
+}
+
+
+def load_backend(backend):
+  module_name, class_name = BACKENDS[backend]
+  return getattr(timed_import(f"{__name__}.{module_name}"), class_name)
+
+
+def __getattr__(name):
+  for backend, (_, class_name) in BACKENDS.items():
+    if class_name == name:
+      return load_backend(backend)
+  raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 db_type = os.getenv("DATABASE_TYPE", "memory").lower()
 
@@ -12,12 +32,12 @@ NEO4J_DATABASE = os.getenv("NEO4J_DATABASE", "")
 CurrentDBIntegration = None
 
 if db_type == "nexusdb":
-  CurrentDBIntegration = NexusDBIntegration
+  CurrentDBIntegration = load_backend("nexusdb")
 elif db_type == "nebulagraph":
-  CurrentDBIntegration = NebulaGraphIntegration
+  CurrentDBIntegration = load_backend("nebulagraph")
 elif db_type == "falkordb":
-  CurrentDBIntegration = FalkorDBIntegration
+  CurrentDBIntegration = load_backend("falkordb")
 elif db_type == "neo4j":
-  CurrentDBIntegration = Neo4jDBIntegration(database=os.getenv("NEO4J_DATABASE", "neo4j"))
+  CurrentDBIntegration = load_backend("neo4j")(database=os.getenv("NEO4J_DATABASE", "neo4j"))
 else:
-  CurrentDBIntegration = InMemoryDatabase
+  CurrentDBIntegration = load_backend("memory")
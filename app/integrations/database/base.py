@@ -1,5 +1,12 @@
 from abc import ABC, abstractmethod
 
+from . import subgraphs
+
+
+def relationship_key(data):
+    # Endpoint IDs compare as strings (they may arrive as query-string values); types ignore surrounding whitespace
+    return str(data.get("from_id")), str(data.get("to_id")), str(data.get("relationship", "")).strip()
+
 
 class DatabaseIntegration(ABC):
 
@@ -31,6 +38,38 @@ class DatabaseIntegration(ABC):
     def add_relationship(self, data):
         pass
 
+    def add_entities(self, entity_type, entities):
+        # Bulk version of add_entity for entities of one type; returns their IDs in order.
+        # Backends that can write many rows per round trip override this.
+        return [self.add_entity(entity_type, data) for data in entities]
+
+    def add_relationships(self, relationships):
+        # Bulk version of add_relationship; returns one result per relationship, in order
+        return [self.add_relationship(data) for data in relationships]
+
+    # Relationships are identified by (from_id, to_id, relationship type). find_relationship looks one up by that key;
+    # merge_relationship adds it only if it is not there yet and returns (relationship ID, created). The defaults below
+    # check and then add, scanning get_full_graph; backends override them with an index lookup or a MERGE that does
+    # both in one round trip.
+
+    def find_relationship(self, data):
+        # The existing relationship with data's key (with its "id" if the backend has one), or None
+        key = relationship_key(data)
+        for relationship in self.get_full_graph()["relationships"]:
+            if relationship is not None and relationship_key(relationship) == key:
+                return relationship
+        return None
+
+    def merge_relationship(self, data):
+        existing = self.find_relationship(data)
+        if existing is not None:
+            return existing.get("id"), False
+        return self.add_relationship(data), True
+
+    def merge_relationships(self, relationships):
+        # Bulk version of merge_relationship; relationships repeating a key earlier in the list are not created twice
+        return [self.merge_relationship(data) for data in relationships]
+
     @abstractmethod
     def search_entities(self, entity_type, search_params):
         pass
@@ -42,3 +81,15 @@ class DatabaseIntegration(ABC):
     @abstractmethod
     def search_relationships(self, search_params):
         pass
+
+    # Scoped reads (see subgraphs.py). These defaults work from get_full_graph; backends override them with queries
+    # that only touch the requested part of the graph.
+
+    def get_graph_page(self, cursor=None, limit=subgraphs.GRAPH_PAGE_SIZE, entity_type=None):
+        return subgraphs.graph_page(self.get_full_graph(), cursor, limit, entity_type)
+
+    def get_subgraph(self, entity_id, hops=1, max_nodes=subgraphs.GRAPH_MAX_NODES):
+        return subgraphs.subgraph(self.get_full_graph(), entity_id, hops, max_nodes)
+
+    def get_top_entities(self, limit=subgraphs.GRAPH_PAGE_SIZE, entity_type=None):
+        return subgraphs.top_entities(self.get_full_graph(), limit, entity_type)
@@ -2,6 +2,8 @@ import os
 from falkordb import FalkorDB
 
 from .base import DatabaseIntegration
+from .subgraphs import (GRAPH_MAX_NODES, GRAPH_PAGE_SIZE, add_to_graph, cypher_label, decode_cursor, empty_graph,
+                        encode_cursor, neighbourhood_ids)
 
 FALKOR_HOST     = os.environ.get("FALKOR_HOST", "127.0.0.1")
 FALKOR_PORT     = os.environ.get("FALKOR_PORT", 6379)
@@ -59,26 +61,82 @@ class FalkorDBIntegration(DatabaseIntegration):
         # get edges
         results = self.g.query("MATCH (src)-[e]->(dest) RETURN src, e, dest").result_set
         for row in results:
-            src  = row[0]
-            e    = row[1]
-            dest = row[2]
-
-            desc = {
-                    "relationship": e.relation,
-                    "snippet": e.relation,
-                    "from_id": src.id,
-                    "to_id": dest.id,
-                    "from_type": src.labels[0],
-                    "to_type": dest.labels[0],
-                    "from_entity": '',
-                    "to_entity": '',
-                    "relationship_type": e.relation
-                    }
-
-            graph['relationships'].append(desc)
+            graph['relationships'].append(self._relationship_desc(row))
 
         return graph
 
+    def _relationship_desc(self, row):
+        src  = row[0]
+        e    = row[1]
+        dest = row[2]
+
+        return {
+                "relationship": e.relation,
+                "snippet": e.relation,
+                "from_id": src.id,
+                "to_id": dest.id,
+                "from_type": src.labels[0],
+                "to_type": dest.labels[0],
+                "from_entity": '',
+                "to_entity": '',
+                "relationship_type": e.relation
+                }
+
+    def _scoped_graph(self, nodes, edge_query, ids):
+        # Build a graph from nodes and the edges returned by edge_query for the given node IDs
+        graph = empty_graph()
+        for node in nodes:
+            lbl = node.labels[0]
+            add_to_graph(graph, lbl, node.id, {'entity_type': lbl, 'data': node.properties})
+
+        results = self.g.query(edge_query, {'ids': ids}).result_set
+        graph['relationships'] = [self._relationship_desc(row) for row in results]
+        return graph
+
+    def get_graph_page(self, cursor=None, limit=GRAPH_PAGE_SIZE, entity_type=None):
+        # Keyset pagination on the node ID; each page carries the relationships starting at its nodes
+        q = f"""MATCH (n{cypher_label(entity_type)})
+                WHERE ID(n) > $after
+                RETURN n
+                ORDER BY ID(n)
+                LIMIT $limit"""
+
+        after = decode_cursor(cursor)
+        nodes = [row[0] for row in self.g.query(q, {'after': -1 if after is None else after, 'limit': limit + 1}).result_set]
+        page = nodes[:limit]
+        graph = self._scoped_graph(
+            page, "MATCH (src)-[e]->(dest) WHERE ID(src) IN $ids RETURN src, e, dest", [n.id for n in page]
+        )
+        graph['next_cursor'] = encode_cursor(page[-1].id) if len(nodes) > limit else None
+        return graph
+
+    def get_subgraph(self, entity_id, hops=1, max_nodes=GRAPH_MAX_NODES):
+        def neighbours(frontier):
+            q = """MATCH (n)--(m)
+                    WHERE ID(n) IN $ids
+                    RETURN DISTINCT ID(m)"""
+            return [row[0] for row in self.g.query(q, {'ids': [int(i) for i in frontier]}).result_set]
+
+        ids = [int(i) for i in neighbourhood_ids(entity_id, neighbours, hops, max_nodes)]
+        nodes = [row[0] for row in self.g.query("MATCH (n) WHERE ID(n) IN $ids RETURN n", {'ids': ids}).result_set]
+        return self._scoped_graph(
+            nodes, "MATCH (src)-[e]->(dest) WHERE ID(src) IN $ids AND ID(dest) IN $ids RETURN src, e, dest", ids
+        )
+
+    def get_top_entities(self, limit=GRAPH_PAGE_SIZE, entity_type=None):
+        q = f"""MATCH (n{cypher_label(entity_type)})
+                OPTIONAL MATCH (n)-[e]-()
+                RETURN n, count(e) AS degree
+                ORDER BY degree DESC
+                LIMIT $limit"""
+
+        nodes = [row[0] for row in self.g.query(q, {'limit': limit}).result_set]
+        return self._scoped_graph(
+            nodes,
+            "MATCH (src)-[e]->(dest) WHERE ID(src) IN $ids AND ID(dest) IN $ids RETURN src, e, dest",
+            [n.id for n in nodes],
+        )
+
     def get_entity(self, entity_type, entity_id):
         q = f"""MATCH (n:{entity_type})
                 WHERE ID(n) = $id
@@ -138,6 +196,35 @@ class FalkorDBIntegration(DatabaseIntegration):
 
         return result.relationships_created == 1
 
+    def find_relationship(self, data):
+        edge_type = data["relationship"].strip().replace(' ', '_')
+
+        q = f"""MATCH (src)-[e:{edge_type}]->(dest)
+                WHERE ID(src) = $src_id AND ID(dest) = $dest_id
+                RETURN src, e, dest
+                LIMIT 1"""
+
+        result = self.g.query(q, {'src_id': int(data["from_id"]), 'dest_id': int(data["to_id"])}).result_set
+        if not result:
+            return None
+        return {"id": result[0][1].id, **self._relationship_desc(result[0])}
+
+    def merge_relationship(self, data):
+        # Lookup and create in one query: MERGE adds the edge only if it is missing
+        edge_type = data["relationship"].strip().replace(' ', '_')
+
+        q = f"""MATCH (src), (dest)
+                WHERE ID(src) = $src_id AND ID(dest) = $dest_id
+                OPTIONAL MATCH (src)-[old:{edge_type}]->(dest)
+                WITH src, dest, count(old) = 0 AS created
+                MERGE (src)-[e:{edge_type}]->(dest)
+                RETURN ID(e), created"""
+
+        result = self.g.query(q, {'src_id': int(data["from_id"]), 'dest_id': int(data["to_id"])}).result_set
+        if not result:
+            return None, False
+        return result[0][0], result[0][1]
+
     def search_entities(self, search_params):
         search_params = remove_spaces(search_params)
 
@@ -1,6 +1,6 @@
 # This code snippet defines a simple in-memory graph data structure to simulate a database for storing and managing entities
 # such as people, organizations, events, and their relationships. It uses a Python dictionary to hold the graph data and
-# a global variable for unique entity IDs. Functions provided include:
+# a per-database counter for unique entity IDs. Functions provided include:
 # - add_entity: Adds a new entity (e.g., person, organization, event) to the graph with a unique ID, incrementing the ID counter.
 # - get_full_graph: Returns the entire graph data including all entities and relationships.
 # - get_entity: Retrieves a specific entity by its type and ID.
@@ -11,99 +11,584 @@
 # - search_entities: Searches for entities based on a set of search parameters.
 # - search_entities_with_type: Searches for entities of a specific type based on search parameters.
 # - search_relationships: Searches for relationships that match given search parameters.
+# Entity searches are served from per-type, per-property secondary indexes (see memory_index.py) that add_entity,
+# update_entity and delete_entity keep up to date, so a search costs in proportion to its matches.
+# Relationships are stored by a stable relationship ID, with outgoing and incoming adjacency maps keyed by entity ID,
+# so deleting an entity or looking up the relationships of a node costs O(degree) instead of a scan of every edge.
+# When MEMORY_DB_PATH is set, every mutation is journaled to a write-ahead log with periodic snapshots in that directory
+# (see memory_persistence.py) and the graph, including its ID counters, is recovered from there on startup.
+# A columnar snapshot (MEMORY_SNAPSHOT_FORMAT=columnar) is not loaded into dicts at all: entity types and relationships
+# become lazy tables over the memory-mapped file (see memory_columnar.py), adjacency lookups consult its CSR arrays, and
+# the search index for a type is built the first time that type is searched.
+# With MEMORY_COMPACT_RECORDS=true entities and relationships are stored as compact records with shared key tables and
+# interned names (see memory_records.py) and converted back to dicts on the way out.
+# With MEMORY_THREAD_SAFE=true (the default) the database can be shared by the threads of a WSGI server and background
+# integrations: IDs come from atomic allocators, writers lock only the stripe of their entity type (plus the relationship
+# lock when they touch edges), stored entities are replaced rather than mutated, and readers such as get_full_graph
+# read without locks and retry if a write overlapped them, backing off between attempts so writers can finish (see
+# memory_concurrency.py). Only a read that still collides after MEMORY_READ_RETRIES attempts takes the locks, which
+# pauses writers for that one read; locked_reads counts how often that happens.
+# Scoped reads for the front end (get_graph_page, get_subgraph, get_top_entities; see subgraphs.py) page by entity ID
+# and walk the adjacency maps. A neighbourhood costs in proportion to what it returns; a page or a top-N list keeps a
+# bounded heap over every entity of the requested types, so it avoids building the full graph but not a pass over it.
+# Every mutation goes through _write, which journals it and then applies it with the matching _apply_* method; log
+# replay during recovery calls the same _apply_* methods. A mutation the log could not take is not applied, and one
+# whose apply raised is followed in the log by an "abort" record, so recovery skips it.
 # This representation is basic and intended for demonstration or prototyping. For production use, a database and an ORM (Object-Relational Mapping) should be utilized for data persistence and management.
 
 # This is a very basic representation. For a real application, use a database and ORM.
-from .base import DatabaseIntegration
+import contextlib
+import heapq
+import os
+import time
 
-next_id = 1
+from .base import DatabaseIntegration, relationship_key
+from .memory_columnar import ColumnarSnapshot, MappedEntities, MappedRelationships
+from .memory_concurrency import IdAllocator, StripedLocks, WriteVersion
+from .memory_index import PropertyIndex
+from .memory_persistence import GraphJournal
+from .memory_records import pack_record, unpack_record
+from .subgraphs import (GRAPH_MAX_NODES, GRAPH_PAGE_SIZE, add_to_graph, decode_cursor, empty_graph, encode_cursor,
+                        neighbourhood_ids)
+
+MEMORY_DB_PATH = os.environ.get("MEMORY_DB_PATH", "")
+MEMORY_COMPACT_RECORDS = os.environ.get("MEMORY_COMPACT_RECORDS", "false").lower() == "true"
+MEMORY_THREAD_SAFE = os.environ.get("MEMORY_THREAD_SAFE", "true").lower() == "true"
+# Optimistic attempts a lock-free read makes before it takes the locks, and the first pause between attempts (doubled
+# after each collision, up to MEMORY_READ_MAX_BACKOFF_MS)
+MEMORY_READ_RETRIES = int(os.environ.get("MEMORY_READ_RETRIES", 8))
+MEMORY_READ_BACKOFF_MS = float(os.environ.get("MEMORY_READ_BACKOFF_MS", 0.05))
+MEMORY_READ_MAX_BACKOFF_MS = float(os.environ.get("MEMORY_READ_MAX_BACKOFF_MS", 5))
+
+
+def entity_properties(entity):
+  # Entities added by the integrations are stored as {"entity_type": ..., "data": {...}}; searches look at "data"
+  entity = unpack_record(entity)
+  if isinstance(entity, dict):
+    data = entity.get("data", {})
+    if isinstance(data, dict):
+      return data
+  return {}
+
+
+def adjacency_key(entity_id):
+  # Relationship endpoints arrive as ints or strings depending on the caller (JSON body vs. URL), so key them uniformly
+  return str(entity_id)
+
+
+def relationship_matches(relationship, search_params):
+  # Convert values to strings for comparison
+  return all(
+      str(value).lower() in str(relationship.get(key, "")).lower()
+      for key, value in search_params.items())
 
 
 class InMemoryDatabase(DatabaseIntegration):
+  # Defaults for subclasses that adopt a graph through _load_graph instead of calling __init__
+  _compact = False
+  _journal = None
+  _thread_safe = False
+  locked_reads = 0  # reads that fell back to taking the locks
+
+  def __init__(self, data_dir=MEMORY_DB_PATH, compact=MEMORY_COMPACT_RECORDS, thread_safe=MEMORY_THREAD_SAFE):
+    self._compact = compact
+    self._thread_safe = thread_safe
+    self._locks = StripedLocks()
+    self._version = WriteVersion()
+    self._reset()
+    self._journal = None
+    if data_dir:
+      self._journal = GraphJournal(data_dir)
+      self._recover()
 
-  def __init__(self):
+  def _reset(self):
     self.graph = {
         "entities": {},  # Stores all entities by type and then by ID
-        "relationships": [],  # Stores relationships
+        "relationships": {},  # Stores relationships by relationship ID
+    }
+    self._index = PropertyIndex()
+    self._outgoing = {}  # entity ID -> set of IDs of relationships starting at the entity
+    self._incoming = {}  # entity ID -> set of IDs of relationships ending at the entity
+    self._entity_id_allocator = IdAllocator()
+    self._relationship_id_allocator = IdAllocator()
+    self._graph_cache = None  # (write version, result of get_full_graph)
+    self._base = None  # memory-mapped columnar snapshot the graph was recovered from, if any
+    self._unindexed_types = set()  # types loaded from self._base whose search index has not been built yet
+
+  @property
+  def _next_id(self):
+    return self._entity_id_allocator.peek()
+
+  @property
+  def _next_relationship_id(self):
+    return self._relationship_id_allocator.peek()
+
+  def _pack(self, value):
+    return pack_record(value) if self._compact else value
+
+  def _hold(self, entity_types=(), relationships=False):
+    if not self._thread_safe:
+      return contextlib.nullcontext()
+    return self._locks.hold(entity_types, relationships)
+
+  def _hold_all(self):
+    if not self._thread_safe:
+      return contextlib.nullcontext()
+    return self._locks.hold_all()
+
+  def _read(self, read):
+    # Run read without locks and keep its result only if no write overlapped it; returns (write version, result)
+    if not self._thread_safe:
+      return None, read()
+    backoff = MEMORY_READ_BACKOFF_MS / 1000.0
+    for attempt in range(MEMORY_READ_RETRIES):
+      if attempt:
+        # Give the colliding writes time to finish instead of spinning into the locked fallback
+        time.sleep(backoff)
+        backoff = min(backoff * 2, MEMORY_READ_MAX_BACKOFF_MS / 1000.0)
+      version = self._version.stable()
+      if version is None:
+        continue
+      try:
+        result = read()
+      except (RuntimeError, KeyError):
+        # A dict or set changed size under the reader, or an entry it looked up was just removed
+        continue
+      if self._version.unchanged_since(version):
+        return version, result
+    with self._locks.hold_all():
+      self.locked_reads += 1
+      return self._version.finished, read()
+
+  def _recover(self):
+    state, records = self._journal.recover()
+    if state:
+      self._restore(state)
+    aborted = {record["aborted_lsn"] for record in records if record["op"] == "abort"}
+    for record in records:
+      if record["op"] != "abort" and record["lsn"] not in aborted:
+        self._replay(record)
+
+  def _restore(self, state):
+    if isinstance(state, ColumnarSnapshot):
+      self._restore_columnar(state)
+      return
+    self._entity_id_allocator.reset(state["next_id"])
+    self._relationship_id_allocator.reset(state["next_relationship_id"])
+    for entity_type, entity_id, data in state["entities"]:
+      self._apply_add_entity(entity_type, entity_id, data)
+    for relationship_id, data in state["relationships"]:
+      self._link_relationship(data, relationship_id)
+
+  def _restore_columnar(self, snapshot):
+    self._base = snapshot
+    self._entity_id_allocator.reset(snapshot.header["next_id"])
+    self._relationship_id_allocator.reset(snapshot.header["next_relationship_id"])
+    self.graph = {
+        "entities": {
+            entity_type: MappedEntities(snapshot, entity_type)
+            for entity_type in snapshot.types
+        },
+        "relationships": MappedRelationships(snapshot),
     }
+    self._unindexed_types = set(snapshot.types)
+
+  def _ensure_indexed(self, entity_type):
+    if entity_type in self._unindexed_types:
+      for entity_id, entity in self.graph["entities"][entity_type].items():
+        self._index.add(entity_type, entity_id, entity_properties(entity))
+      self._unindexed_types.discard(entity_type)
+
+  def _index_entity(self, entity_type, entity_id, entity):
+    # Types still backed by an unindexed snapshot are indexed from their current contents on first search
+    if entity_type not in self._unindexed_types:
+      self._index.add(entity_type, entity_id, entity_properties(entity))
+
+  def _unindex_entity(self, entity_type, entity_id):
+    if entity_type not in self._unindexed_types:
+      self._index.remove(entity_type, entity_id)
+
+  def _replay(self, record):
+    fields = {key: value for key, value in record.items() if key not in ("lsn", "op")}
+    getattr(self, f"_apply_{record['op']}")(**fields)
+
+  def _snapshot_state(self):
+    return {
+        "next_id": self._next_id,
+        "next_relationship_id": self._next_relationship_id,
+        "entities": [[entity_type, entity_id, unpack_record(data)]
+                     for entity_type, entities in self.graph["entities"].items()
+                     for entity_id, data in entities.items()],
+        "relationships": [[relationship_id, unpack_record(data)]
+                          for relationship_id, data in self.graph["relationships"].items()],
+    }
+
+  def _write_locks(self, op, fields):
+    # Entity writes lock the stripe of their type; anything that adds or drops relationships also locks relationships
+    if op == "add_relationship":
+      return self._hold(relationships=True)
+    return self._hold((fields["entity_type"],), relationships=op == "delete_entity")
+
+  def _write(self, op, check=None, **fields):
+    # Under the locks for op: check the precondition, journal the mutation (if persistent) and apply it in memory.
+    # Then, without the locks, wait for the group commit covering it.
+    with self._write_locks(op, fields):
+      if check is not None and not check():
+        return False
+      with self._version if self._thread_safe else contextlib.nullcontext():
+        lsn = self._journal.append(op, fields) if self._journal is not None else None
+        try:
+          result = getattr(self, f"_apply_{op}")(**fields)
+        except Exception:
+          if lsn is not None:
+            self._journal.append("abort", {"aborted_lsn": lsn})
+          raise
+    if lsn is not None:
+      self._journal.commit(lsn)
+      if self._journal.needs_snapshot():
+        self.snapshot(only_if_due=True)
+    return result
+
+  def snapshot(self, only_if_due=False):
+    # Write a compact snapshot of the whole graph and truncate the write-ahead log
+    with self._hold_all():
+      if self._journal is not None and (not only_if_due or self._journal.needs_snapshot()):
+        self._journal.snapshot(self._snapshot_state())
+
+  def close(self):
+    if self._journal is not None:
+      self._journal.close()
+      self._journal = None
+    if self._base is not None:
+      self._base.close()
+      self._base = None
+
+  def _load_graph(self, entities, relationships):
+    # Adopt entities and relationships fetched from elsewhere (e.g. a remote store wrapped by a subclass)
+    # and build the search index and adjacency maps for them.
+    self._reset()
+    self.graph["entities"] = entities
+    for entity_type, entities_of_type in entities.items():
+      for entity_id, entity in entities_of_type.items():
+        self._index.add(entity_type, entity_id, entity_properties(entity))
+    for relationship in relationships:
+      self._link_relationship(relationship)
+
+  def _link_relationship(self, data, relationship_id=None):
+    # Endpoints are read before anything is stored, so a malformed relationship is rejected without leaving traces
+    from_key, to_key = adjacency_key(data.get("from_id")), adjacency_key(data.get("to_id"))
+    if relationship_id is None:
+      relationship_id = self._relationship_id_allocator.allocate()
+    else:
+      self._relationship_id_allocator.advance_past(relationship_id)
+    self.graph["relationships"][relationship_id] = self._pack(data)
+    self._outgoing.setdefault(from_key, set()).add(relationship_id)
+    self._incoming.setdefault(to_key, set()).add(relationship_id)
+    return relationship_id
+
+  def _unlink_entity(self, entity_id):
+    # Drop every relationship touching the entity, visiting only its own edges
+    for relationship_id in self._relationship_ids(entity_id):
+      relationship = self.graph["relationships"].pop(relationship_id)
+      _discard(self._outgoing, adjacency_key(relationship.get("from_id")), relationship_id)
+      _discard(self._incoming, adjacency_key(relationship.get("to_id")), relationship_id)
+
+  def _relationship_ids(self, entity_id, direction="both"):
+    key = adjacency_key(entity_id)
+    relationship_ids = set()
+    if direction in ("out", "both"):
+      relationship_ids |= self._outgoing.get(key, set())
+    if direction in ("in", "both"):
+      relationship_ids |= self._incoming.get(key, set())
+    if self._base is not None:
+      relationships = self.graph["relationships"]
+      for base_direction in ("out", "in"):
+        if direction in (base_direction, "both"):
+          relationship_ids.update(
+              relationship_id
+              for relationship_id in self._base.relationship_ids(key, base_direction)
+              if relationship_id in relationships)
+    return sorted(relationship_ids)
 
   def add_entity(self, entity_type, data):
-    print("add_entity")
-    print(self.add_entity)
-    global next_id
-    entity_id = next_id
+    entity_id = self._entity_id_allocator.allocate()
+    self._write("add_entity", entity_type=entity_type, entity_id=entity_id, data=data)
+    print(f"Added {entity_type} with ID: {entity_id}, next ID: {self._next_id}")
+    return entity_id
+
+  def _apply_add_entity(self, entity_type, entity_id, data):
     if entity_type not in self.graph["entities"]:
       self.graph["entities"][entity_type] = {}
-    self.graph["entities"][entity_type][entity_id] = data
-    next_id += 1
-    print(f"Added {entity_type} with ID: {entity_id}, next ID: {next_id}")
-    return entity_id
+    self.graph["entities"][entity_type][entity_id] = self._pack(data)
+    self._index_entity(entity_type, entity_id, data)
+    self._entity_id_allocator.advance_past(entity_id)
+
+  def _export(self, entities):
+    # A copy of a table of entities for callers; compact records are unpacked into fresh dicts
+    if self._compact:
+      return {entity_id: unpack_record(entity) for entity_id, entity in entities.items()}
+    return _as_dict(entities)
+
+  def _full_graph(self):
+    return {
+        "entities": {
+            entity_type: self._export(entities)
+            for entity_type, entities in list(self.graph["entities"].items())
+        },
+        "relationships": [
+            unpack_record(relationship)
+            for relationship in list(self.graph["relationships"].values())
+        ],
+    }
 
   def get_full_graph(self):
-    return self.graph
+    # The graph built for the current write version is reused until the next write; each caller gets its own copy of
+    # the tables and relationship list, so changing a result does not change what later callers see
+    cached = self._graph_cache
+    if cached is not None and cached[0] == self._version.stable():
+      return _copy_graph(cached[1])
+    version, graph = self._read(self._full_graph)
+    if version is not None:
+      self._graph_cache = (version, graph)
+    return _copy_graph(graph)
 
   def get_entity(self, entity_type, entity_id):
-    return self.graph["entities"].get(entity_type, {}).get(entity_id)
+    return unpack_record(self.graph["entities"].get(entity_type, {}).get(entity_id))
 
   def get_all_entities(self, entity_type):
-    return self.graph["entities"].get(entity_type, {})
+    return self._read(lambda: self._export(self.graph["entities"].get(entity_type, {})))[1]
 
-  def update_entity(self, entity_type, entity_id, data):
+  def _has_entity(self, entity_type, entity_id):
     entities = self.graph["entities"].get(entity_type)
-    if entities and entity_id in entities:
-      entities[entity_id].update(data)
-      return True
-    return False
+    return bool(entities) and entity_id in entities
+
+  def update_entity(self, entity_type, entity_id, data):
+    return self._write("update_entity",
+                       check=lambda: self._has_entity(entity_type, entity_id),
+                       entity_type=entity_type,
+                       entity_id=entity_id,
+                       data=data)
+
+  def _apply_update_entity(self, entity_type, entity_id, data):
+    # Replace the stored entity instead of updating it in place, so readers holding the old one never see a half update
+    entities = self.graph["entities"][entity_type]
+    entity = {**unpack_record(entities[entity_id]), **data}
+    entities[entity_id] = self._pack(entity)
+    self._index_entity(entity_type, entity_id, entity)
+    return True
 
   def delete_entity(self, entity_type, entity_id):
-    entities = self.graph["entities"].get(entity_type)
-    if entities and entity_id in entities:
-      # Delete the entity from the entities dictionary
-      del entities[entity_id]
+    return self._write("delete_entity",
+                       check=lambda: self._has_entity(entity_type, entity_id),
+                       entity_type=entity_type,
+                       entity_id=entity_id)
 
-      # Filter out relationships involving the deleted entity
-      self.graph["relationships"] = [
-          relationship for relationship in self.graph["relationships"]
-          if relationship["from_id"] != entity_id
-          and relationship["to_id"] != entity_id
-      ]
+  def _apply_delete_entity(self, entity_type, entity_id):
+    # Delete the entity from the entities dictionary
+    del self.graph["entities"][entity_type][entity_id]
+    self._unindex_entity(entity_type, entity_id)
 
-      return True
-    return False
+    # Drop relationships involving the deleted entity
+    self._unlink_entity(entity_id)
+    return True
 
   def add_relationship(self, data):
-    self.graph["relationships"].append(data)
-    return len(self.graph["relationships"])
+    relationship_id = self._relationship_id_allocator.allocate()
+    return self._write("add_relationship", relationship_id=relationship_id, data=data)
+
+  def _apply_add_relationship(self, relationship_id, data):
+    return self._link_relationship(data, relationship_id)
+
+  def find_relationship(self, data):
+    # Looked up through the adjacency maps, in O(out-degree of from_id) rather than a scan of every relationship
+    return self._read(lambda: self._find_relationship(data))[1]
+
+  def _find_relationship(self, data):
+    key = relationship_key(data)
+    for relationship_id in self._relationship_ids(data.get("from_id"), "out"):
+      relationship = unpack_record(self.graph["relationships"][relationship_id])
+      if relationship_key(relationship) == key:
+        return {"id": relationship_id, **relationship}
+    return None
+
+  def merge_relationship(self, data):
+    # The lookup is the precondition of the add, under the relationship lock, so concurrent merges of a key add it once
+    existing = []
+
+    def absent():
+      found = self._find_relationship(data)
+      if found is not None:
+        existing.append(found["id"])
+      return found is None
+
+    relationship_id = self._relationship_id_allocator.allocate()
+    if self._write("add_relationship", check=absent, relationship_id=relationship_id, data=data) is False:
+      return existing[0], False
+    return relationship_id, True
+
+  def get_relationship(self, relationship_id):
+    return unpack_record(self.graph["relationships"].get(relationship_id))
+
+  def get_entity_relationships(self, entity_id, direction="both"):
+    # Relationships starting ("out"), ending ("in") or either ("both") at the entity, in O(degree)
+    return self._read(lambda: [
+        unpack_record(self.graph["relationships"][relationship_id])
+        for relationship_id in self._relationship_ids(entity_id, direction)
+    ])[1]
 
   def search_entities(self, search_params):
     results = []
-    for entity_type, entities in self.graph["entities"].items():
-      for entity_id, entity_details in entities.items():
-        entity_info = entity_details.get("data", {})
-        # Convert values to strings for comparison
-        if all(
-            str(value).lower() in str(entity_info.get(key, "")).lower()
-            for key, value in search_params.items()):
-          results.append({"type": entity_type, "id": entity_id, **entity_info})
+    for entity_type in list(self.graph["entities"]):
+      results.extend(self.search_entities_with_type(entity_type, search_params))
     return results
 
   def search_entities_with_type(self, entity_type, search_params):
-    results = []
-    for entity_id, entity_details in self.graph["entities"].get(entity_type, {}).items():
-      entity_info = entity_details.get("data", {})
-      # Convert values to strings for comparison
-      if all(
-          str(value).lower() in str(entity_info.get(key, "")).lower()
-          for key, value in search_params.items()):
-        results.append({"type": entity_type, "id": entity_id, **entity_info})
-    return results
+    if entity_type in self._unindexed_types:
+      with self._hold((entity_type,)):
+        self._ensure_indexed(entity_type)
+    return self._read(lambda: self._search_entities_with_type(entity_type, search_params))[1]
+
+  def _search_entities_with_type(self, entity_type, search_params):
+    entities = self.graph["entities"].get(entity_type, {})
+    return [{
+        "type": entity_type,
+        "id": entity_id,
+        **entity_properties(entities[entity_id])
+    } for entity_id in self._index.match(entity_type, search_params)]
+
+  def _find_entity(self, entity_id):
+    # (entity type, stored ID) of an entity whose ID may arrive as a string (e.g. from a query string), or None
+    keys = [entity_id]
+    if isinstance(entity_id, str) and entity_id.lstrip("-").isdigit():
+      keys.append(int(entity_id))
+    for entity_type, entities in list(self.graph["entities"].items()):
+      for key in keys:
+        if key in entities:
+          return entity_type, key
+    return None
+
+  def _degree(self, entity_id):
+    if self._base is None:
+      key = adjacency_key(entity_id)
+      return len(self._outgoing.get(key, ())) + len(self._incoming.get(key, ()))
+    return len(self._relationship_ids(entity_id))
+
+  def _induced_graph(self, nodes):
+    # The given (entity type, ID) pairs and the relationships between them
+    graph = empty_graph()
+    ids = {adjacency_key(entity_id) for _, entity_id in nodes}
+    for entity_type, entity_id in nodes:
+      add_to_graph(graph, entity_type, entity_id, unpack_record(self.graph["entities"][entity_type][entity_id]))
+      for relationship_id in self._relationship_ids(entity_id, "out"):
+        relationship = self.graph["relationships"][relationship_id]
+        if adjacency_key(relationship.get("to_id")) in ids:
+          graph["relationships"].append(unpack_record(relationship))
+    return graph
+
+  def get_graph_page(self, cursor=None, limit=GRAPH_PAGE_SIZE, entity_type=None):
+    # Keyset pagination by entity ID: IDs only grow, so pages stay stable while entities are added and deleted
+    return self._read(lambda: self._graph_page(decode_cursor(cursor), limit, entity_type))[1]
+
+  def _graph_page(self, after, limit, entity_type):
+    if entity_type is None:
+      tables = dict(self.graph["entities"])
+    else:
+      tables = {entity_type: self.graph["entities"].get(entity_type, {})}
+    page = heapq.nsmallest(limit + 1, (
+        (entity_id, current_type)
+        for current_type, entities in tables.items()
+        for entity_id in entities
+        if after is None or entity_id > after))
+
+    graph = empty_graph()
+    for entity_id, current_type in page[:limit]:
+      add_to_graph(graph, current_type, entity_id, unpack_record(tables[current_type][entity_id]))
+      # Each relationship is returned with the page of the entity it starts at
+      graph["relationships"].extend(
+          unpack_record(self.graph["relationships"][relationship_id])
+          for relationship_id in self._relationship_ids(entity_id, "out"))
+    graph["next_cursor"] = encode_cursor(page[limit - 1][0]) if len(page) > limit else None
+    return graph
+
+  def get_subgraph(self, entity_id, hops=1, max_nodes=GRAPH_MAX_NODES):
+    return self._read(lambda: self._subgraph(entity_id, hops, max_nodes))[1]
+
+  def _subgraph(self, entity_id, hops, max_nodes):
+    found = self._find_entity(entity_id)
+    if found is None:
+      return empty_graph()
+
+    def neighbours(frontier):
+      for node_id in frontier:
+        for relationship_id in self._relationship_ids(node_id):
+          relationship = self.graph["relationships"][relationship_id]
+          from_id, to_id = relationship.get("from_id"), relationship.get("to_id")
+          yield to_id if adjacency_key(from_id) == adjacency_key(node_id) else from_id
+
+    nodes = []
+    for node_id in neighbourhood_ids(found[1], neighbours, hops, max_nodes):
+      node = self._find_entity(node_id)
+      if node is not None:
+        nodes.append(node)
+    return self._induced_graph(nodes)
+
+  def get_top_entities(self, limit=GRAPH_PAGE_SIZE, entity_type=None):
+    return self._read(lambda: self._top_entities(limit, entity_type))[1]
+
+  def _top_entities(self, limit, entity_type):
+    if entity_type is None:
+      tables = list(self.graph["entities"].items())
+    else:
+      tables = [(entity_type, self.graph["entities"].get(entity_type, {}))]
+    ranked = heapq.nlargest(limit, (
+        (self._degree(entity_id), current_type, entity_id)
+        for current_type, entities in tables
+        for entity_id in entities), key=lambda item: item[0])
+    return self._induced_graph([(current_type, entity_id) for _, current_type, entity_id in ranked])
 
   def search_relationships(self, search_params):
-    results = []
-    for relationship in self.graph["relationships"]:
-      # Convert values to strings for comparison
-      if all(
-          str(value).lower() in str(relationship.get(key, "")).lower()
-          for key, value in search_params.items()):
-        results.append(relationship)
-    return results
+    return self._read(lambda: self._search_relationships(search_params))[1]
+
+  def _search_relationships(self, search_params):
+    # Endpoint IDs are matched exactly through the adjacency maps; other parameters are substring matches
+    candidates = None
+    if "from_id" in search_params:
+      candidates = set(self._relationship_ids(search_params["from_id"], "out"))
+    if "to_id" in search_params:
+      to_ids = set(self._relationship_ids(search_params["to_id"], "in"))
+      candidates = to_ids if candidates is None else candidates & to_ids
+    remaining = {
+        key: value for key, value in search_params.items()
+        if key not in ("from_id", "to_id")
+    }
+
+    if candidates is None:
+      relationships = list(self.graph["relationships"].values())
+    else:
+      relationships = (self.graph["relationships"][relationship_id]
+                       for relationship_id in sorted(candidates))
+    return [
+        unpack_record(relationship) for relationship in relationships
+        if relationship_matches(relationship, remaining)
+    ]
+
+
+def _as_dict(entities):
+  # Callers get their own dict; snapshot-backed tables are decoded into one
+  return dict(entities) if isinstance(entities, dict) else dict(entities.items())
+
+
+def _copy_graph(graph):
+  # Copies the containers, not the entities: stored entities are replaced on update rather than mutated
+  return {
+      "entities": {entity_type: dict(entities) for entity_type, entities in graph["entities"].items()},
+      "relationships": list(graph["relationships"]),
+  }
+
+
+def _discard(adjacency, key, relationship_id):
+  relationship_ids = adjacency.get(key)
+  if relationship_ids is not None:
+    relationship_ids.discard(relationship_id)
+    if not relationship_ids:
+      del adjacency[key]
@@ -0,0 +1,433 @@
+# Binary, columnar snapshot format for the in-memory database, read through mmap.
+# A JSON snapshot has to be parsed in full into nested dicts before the first request can be served, which is slow and
+# memory-hungry for large graphs. A columnar snapshot is instead laid out as flat arrays that are mapped straight from
+# the file: the OS pages data in when it is touched, and an entity or relationship is decoded only when it is read.
+#
+# Layout (native byte order, every section 8-byte aligned):
+#   magic (8 bytes) | header length (uint64) | header JSON | sections...
+# The header holds the metadata (LSN, ID counters, byte order), the interned tables and the section directory:
+#   types             entity type names; entity rows are grouped by type, type_offsets gives each type's row range
+#   shapes            interned property-name tuples shared by every record with the same keys
+#   symbols           interned values of type/relationship-name properties (INTERNED_KEYS)
+# Sections:
+#   entity_ids        int64 ID per entity row
+#   entity_order      uint32 rows sorted by ID within each type range (binary search for get_entity)
+#   entity_offsets    uint64 offsets of each encoded entity in entity_data
+#   rel_ids           int64 relationship IDs, ascending
+#   rel_offsets       uint64 offsets of each encoded relationship in rel_data
+#   endpoint_offsets  uint64 offsets of the sorted, distinct relationship endpoint keys in endpoint_data
+#   out_offsets       CSR row offsets per endpoint into out_rows (relationship rows leaving the endpoint)
+#   in_offsets        CSR row offsets per endpoint into in_rows (relationship rows entering the endpoint)
+# Records are compact JSON in which every dict is [shape index, value, ...], every list is {"l": [...]} and an
+# interned string is {"s": symbol index}.
+
+import bisect
+import json
+import mmap
+import os
+import sys
+from array import array
+from collections.abc import MutableMapping
+
+MAGIC = b"MGCOL\x00\x01\x00"
+VERSION = 1
+INTERNED_KEYS = frozenset(
+    ["entity_type", "from_type", "to_type", "relationship", "relationship_type"])
+
+
+class _Encoder:
+
+  def __init__(self):
+    self.shapes = []
+    self.symbols = []
+    self._shape_index = {}
+    self._symbol_index = {}
+
+  def _intern(self, table, index, value):
+    position = index.get(value)
+    if position is None:
+      position = index[value] = len(table)
+      table.append(value)
+    return position
+
+  def encode(self, value, key=None):
+    if isinstance(value, dict):
+      keys = tuple(str(k) for k in value)
+      shape = self._intern(self.shapes, self._shape_index, keys)
+      return [shape] + [self.encode(v, k) for k, v in zip(keys, value.values())]
+    if isinstance(value, (list, tuple)):
+      return {"l": [self.encode(v) for v in value]}
+    if isinstance(value, str) and key in INTERNED_KEYS:
+      return {"s": self._intern(self.symbols, self._symbol_index, value)}
+    if value is None or isinstance(value, (str, int, float, bool)):
+      return value
+    return str(value)
+
+  def dumps(self, value):
+    return json.dumps(self.encode(value), separators=(",", ":")).encode("utf8")
+
+
+def _blob(encoded_items):
+  offsets = array("Q", [0])
+  chunks = []
+  total = 0
+  for chunk in encoded_items:
+    chunks.append(chunk)
+    total += len(chunk)
+    offsets.append(total)
+  return offsets, b"".join(chunks)
+
+
+def _csr(endpoint_count, endpoint_of_row):
+  counts = [0] * endpoint_count
+  for endpoint in endpoint_of_row:
+    counts[endpoint] += 1
+  offsets = array("Q", [0])
+  for count in counts:
+    offsets.append(offsets[-1] + count)
+  rows = array("I", bytes(4 * len(endpoint_of_row)))
+  cursor = list(offsets[:-1])
+  for row, endpoint in enumerate(endpoint_of_row):
+    rows[cursor[endpoint]] = row
+    cursor[endpoint] += 1
+  return offsets, rows
+
+
+def _endpoint_key(entity_id):
+  # Same key as memory.adjacency_key, as UTF-8 so endpoints sort and compare as bytes
+  return str(entity_id).encode("utf8")
+
+
+def write_columnar_snapshot(path, state):
+  # state is the dict produced by InMemoryDatabase._snapshot_state()
+  encoder = _Encoder()
+
+  types = []
+  rows_by_type = {}
+  for entity_type, entity_id, data in state["entities"]:
+    if entity_type not in rows_by_type:
+      types.append(entity_type)
+      rows_by_type[entity_type] = []
+    rows_by_type[entity_type].append((int(entity_id), data))
+
+  type_offsets = [0]
+  entity_ids = array("q")
+  entity_order = array("I")
+  entity_data = []
+  for entity_type in types:
+    start = len(entity_ids)
+    rows = rows_by_type[entity_type]
+    for entity_id, data in rows:
+      entity_ids.append(entity_id)
+      entity_data.append(encoder.dumps(data))
+    entity_order.extend(
+        sorted(range(start, start + len(rows)), key=entity_ids.__getitem__))
+    type_offsets.append(len(entity_ids))
+  entity_offsets, entity_blob = _blob(entity_data)
+
+  relationships = sorted(state["relationships"], key=lambda item: item[0])
+  rel_ids = array("q", (relationship_id for relationship_id, _ in relationships))
+  rel_offsets, rel_blob = _blob(encoder.dumps(data) for _, data in relationships)
+
+  endpoint_keys = sorted({
+      _endpoint_key(data.get(side))
+      for _, data in relationships for side in ("from_id", "to_id")
+  })
+  endpoint_position = {key: position for position, key in enumerate(endpoint_keys)}
+  endpoint_offsets, endpoint_blob = _blob(endpoint_keys)
+  out_offsets, out_rows = _csr(len(endpoint_keys), [
+      endpoint_position[_endpoint_key(data.get("from_id"))]
+      for _, data in relationships
+  ])
+  in_offsets, in_rows = _csr(len(endpoint_keys), [
+      endpoint_position[_endpoint_key(data.get("to_id"))]
+      for _, data in relationships
+  ])
+
+  sections = [
+      ("entity_ids", entity_ids),
+      ("entity_order", entity_order),
+      ("entity_offsets", entity_offsets),
+      ("entity_data", entity_blob),
+      ("rel_ids", rel_ids),
+      ("rel_offsets", rel_offsets),
+      ("rel_data", rel_blob),
+      ("endpoint_offsets", endpoint_offsets),
+      ("endpoint_data", endpoint_blob),
+      ("out_offsets", out_offsets),
+      ("out_rows", out_rows),
+      ("in_offsets", in_offsets),
+      ("in_rows", in_rows),
+  ]
+  header = {
+      "version": VERSION,
+      "byteorder": sys.byteorder,
+      "lsn": state.get("lsn", 0),
+      "next_id": state["next_id"],
+      "next_relationship_id": state["next_relationship_id"],
+      "types": types,
+      "type_offsets": type_offsets,
+      "shapes": encoder.shapes,
+      "symbols": encoder.symbols,
+      "sections": {},
+  }
+
+  # Section offsets depend on the header length, which depends on the offsets: lay out with a provisional
+  # header size and grow it until the directory fits.
+  reserved = 4096
+  while True:
+    offset = _align(len(MAGIC) + 8 + reserved)
+    for name, data in sections:
+      size = len(data) * (data.itemsize if isinstance(data, array) else 1)
+      typecode = data.typecode if isinstance(data, array) else "B"
+      header["sections"][name] = [offset, size, typecode]
+      offset = _align(offset + size)
+    header_bytes = json.dumps(header, separators=(",", ":")).encode("utf8")
+    if len(header_bytes) <= reserved:
+      break
+    reserved = _align(len(header_bytes) * 2)
+
+  temp_path = path + ".tmp"
+  with open(temp_path, "wb") as file:
+    file.write(MAGIC)
+    file.write(len(header_bytes).to_bytes(8, "little"))
+    file.write(header_bytes)
+    for name, data in sections:
+      start = header["sections"][name][0]
+      file.write(b"\x00" * (start - file.tell()))
+      file.write(data.tobytes() if isinstance(data, array) else data)
+    file.flush()
+    os.fsync(file.fileno())
+  os.replace(temp_path, path)
+
+
+def _align(offset):
+  return (offset + 7) & ~7
+
+
+class ColumnarSnapshot:
+
+  def __init__(self, path):
+    self.path = path
+    with open(path, "rb") as file:
+      self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    if self._mmap[:len(MAGIC)] != MAGIC:
+      raise ValueError(f"{path} is not a columnar graph snapshot")
+    header_length = int.from_bytes(self._mmap[len(MAGIC):len(MAGIC) + 8], "little")
+    header_start = len(MAGIC) + 8
+    header = json.loads(self._mmap[header_start:header_start + header_length])
+    if header["version"] != VERSION or header["byteorder"] != sys.byteorder:
+      raise ValueError(f"Unsupported columnar snapshot {path}")
+
+    self.header = header
+    self.lsn = header["lsn"]
+    self.types = header["types"]
+    self._type_offsets = header["type_offsets"]
+    self._type_index = {entity_type: i for i, entity_type in enumerate(self.types)}
+    self._shapes = [tuple(shape) for shape in header["shapes"]]
+    self._symbols = header["symbols"]
+
+    view = memoryview(self._mmap)
+    self._sections = {}
+    for name, (offset, size, typecode) in header["sections"].items():
+      section = view[offset:offset + size]
+      self._sections[name] = section if typecode == "B" else section.cast(typecode)
+    self._entity_ids = self._sections["entity_ids"]
+    self._entity_order = self._sections["entity_order"]
+    self._rel_ids = self._sections["rel_ids"]
+
+  # Records
+
+  def _decode(self, value):
+    if isinstance(value, list):
+      shape = self._shapes[value[0]]
+      return {key: self._decode(v) for key, v in zip(shape, value[1:])}
+    if isinstance(value, dict):
+      if "s" in value:
+        return self._symbols[value["s"]]
+      return [self._decode(v) for v in value["l"]]
+    return value
+
+  def _record(self, blob, offsets, row):
+    return self._decode(json.loads(bytes(self._sections[blob][offsets[row]:offsets[row + 1]])))
+
+  # Entities
+
+  def entity_rows(self, entity_type):
+    position = self._type_index.get(entity_type)
+    if position is None:
+      return range(0)
+    return range(self._type_offsets[position], self._type_offsets[position + 1])
+
+  def entity_id(self, row):
+    return self._entity_ids[row]
+
+  def entity(self, row):
+    return self._record("entity_data", self._sections["entity_offsets"], row)
+
+  def find_entity(self, entity_type, entity_id):
+    # Binary search the ID-sorted rows of the type; returns the row or None
+    if not isinstance(entity_id, int):
+      return None
+    rows = self.entity_rows(entity_type)
+    low, high = rows.start, rows.stop
+    while low < high:
+      middle = (low + high) // 2
+      if self._entity_ids[self._entity_order[middle]] < entity_id:
+        low = middle + 1
+      else:
+        high = middle
+    if low < rows.stop and self._entity_ids[self._entity_order[low]] == entity_id:
+      return self._entity_order[low]
+    return None
+
+  # Relationships
+
+  def relationship_count(self):
+    return len(self._rel_ids)
+
+  def relationship_id(self, row):
+    return self._rel_ids[row]
+
+  def relationship(self, row):
+    return self._record("rel_data", self._sections["rel_offsets"], row)
+
+  def find_relationship(self, relationship_id):
+    if not isinstance(relationship_id, int):
+      return None
+    row = bisect.bisect_left(self._rel_ids, relationship_id)
+    if row < len(self._rel_ids) and self._rel_ids[row] == relationship_id:
+      return row
+    return None
+
+  def _endpoint(self, key):
+    target = _endpoint_key(key)
+    offsets = self._sections["endpoint_offsets"]
+    data = self._sections["endpoint_data"]
+    low, high = 0, len(offsets) - 1
+    while low < high:
+      middle = (low + high) // 2
+      if bytes(data[offsets[middle]:offsets[middle + 1]]) < target:
+        low = middle + 1
+      else:
+        high = middle
+    if low < len(offsets) - 1 and bytes(data[offsets[low]:offsets[low + 1]]) == target:
+      return low
+    return None
+
+  def relationship_ids(self, key, direction):
+    # IDs of the relationships leaving ("out") or entering ("in") the endpoint key, via the CSR arrays
+    endpoint = self._endpoint(key)
+    if endpoint is None:
+      return []
+    offsets = self._sections[f"{direction}_offsets"]
+    rows = self._sections[f"{direction}_rows"]
+    return [self._rel_ids[rows[i]] for i in range(offsets[endpoint], offsets[endpoint + 1])]
+
+  def close(self):
+    for section in self._sections.values():
+      section.release()
+    self._sections = {}
+    self._entity_ids = self._entity_order = self._rel_ids = None
+    self._mmap.close()
+
+
+class _MappedTable(MutableMapping):
+  # A dict-like table whose rows live in the snapshot until touched. Rows that are read are decoded once and kept in
+  # the overlay (so in-place updates stick); writes go to the overlay and deletes of snapshot rows become tombstones.
+
+  def __init__(self, snapshot):
+    self._snapshot = snapshot
+    self._overlay = {}
+    self._deleted = set()
+    self._added = set()  # overlay keys that are not in the snapshot
+
+  def __getitem__(self, key):
+    if key in self._overlay:
+      return self._overlay[key]
+    if key in self._deleted:
+      raise KeyError(key)
+    row = self._find(key)
+    if row is None:
+      raise KeyError(key)
+    value = self._overlay[key] = self._decode(row)
+    return value
+
+  def __setitem__(self, key, value):
+    if key not in self._overlay and key not in self._added and self._find(key) is None:
+      self._added.add(key)
+    self._deleted.discard(key)
+    self._overlay[key] = value
+
+  def __delitem__(self, key):
+    if key not in self:
+      raise KeyError(key)
+    self._overlay.pop(key, None)
+    if key in self._added:
+      self._added.discard(key)
+    else:
+      self._deleted.add(key)
+
+  def __contains__(self, key):
+    if key in self._overlay:
+      return True
+    return key not in self._deleted and self._find(key) is not None
+
+  def __iter__(self):
+    for key, _ in self._rows():
+      if key not in self._deleted:
+        yield key
+    yield from [key for key in self._overlay if key in self._added]
+
+  def __len__(self):
+    return self._row_count() - len(self._deleted) + len(self._added)
+
+  def items(self):
+    # Decode without caching, so a full read (e.g. get_full_graph) does not pin the whole snapshot in memory
+    for key, row in self._rows():
+      if key in self._overlay:
+        yield key, self._overlay[key]
+      elif key not in self._deleted:
+        yield key, self._decode(row)
+    for key in [key for key in self._overlay if key in self._added]:
+      yield key, self._overlay[key]
+
+  def values(self):
+    for _, value in self.items():
+      yield value
+
+
+class MappedEntities(_MappedTable):
+
+  def __init__(self, snapshot, entity_type):
+    super().__init__(snapshot)
+    self._entity_type = entity_type
+
+  def _find(self, key):
+    return self._snapshot.find_entity(self._entity_type, key)
+
+  def _decode(self, row):
+    return self._snapshot.entity(row)
+
+  def _rows(self):
+    for row in self._snapshot.entity_rows(self._entity_type):
+      yield self._snapshot.entity_id(row), row
+
+  def _row_count(self):
+    return len(self._snapshot.entity_rows(self._entity_type))
+
+
+class MappedRelationships(_MappedTable):
+
+  def _find(self, key):
+    return self._snapshot.find_relationship(key)
+
+  def _decode(self, row):
+    return self._snapshot.relationship(row)
+
+  def _rows(self):
+    for row in range(self._snapshot.relationship_count()):
+      yield self._snapshot.relationship_id(row), row
+
+  def _row_count(self):
+    return self._snapshot.relationship_count()
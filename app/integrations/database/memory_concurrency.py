@@ -0,0 +1,100 @@
+# Concurrency primitives for the in-memory database (MEMORY_THREAD_SAFE=true, the default).
+# - IdAllocator hands out entity and relationship IDs atomically, so concurrent add_entity calls never share an ID.
+# - StripedLocks maps each entity type to one of a fixed number of locks. Writers to different types usually hold
+#   different locks and proceed in parallel; everything that touches relationships or adjacency also takes a single
+#   relationship lock, always after the stripe locks, so lock order is fixed and cannot deadlock.
+# - WriteVersion counts writes started and finished. Readers do not take locks: they read optimistically and keep the
+#   result only if no write was in flight when they started and none started while they ran (a seqlock). A reader
+#   that collides backs off before trying again, and only one that keeps colliding falls back to taking the locks.
+
+import threading
+
+MEMORY_LOCK_STRIPES = 16
+
+
+class IdAllocator:
+
+  def __init__(self, start=1):
+    self._next = start
+    self._lock = threading.Lock()
+
+  def peek(self):
+    return self._next
+
+  def allocate(self):
+    with self._lock:
+      value = self._next
+      self._next += 1
+      return value
+
+  def advance_past(self, value):
+    # Used when an ID comes from elsewhere (log replay, an explicit relationship ID) so it is never handed out again
+    with self._lock:
+      if value >= self._next:
+        self._next = value + 1
+
+  def reset(self, start):
+    with self._lock:
+      self._next = start
+
+
+class _Held:
+  # Holds a list of locks, acquired in list order and released in reverse (cheaper than an ExitStack per write)
+
+  __slots__ = ("locks",)
+
+  def __init__(self, locks):
+    self.locks = locks
+
+  def __enter__(self):
+    for lock in self.locks:
+      lock.acquire()
+
+  def __exit__(self, *exc_info):
+    for lock in reversed(self.locks):
+      lock.release()
+
+
+class StripedLocks:
+
+  def __init__(self, stripes=MEMORY_LOCK_STRIPES):
+    self._stripes = [threading.Lock() for _ in range(stripes)]
+    self.relationships = threading.Lock()
+
+  def hold(self, entity_types=(), relationships=False):
+    # The stripes of entity_types (in stripe order), then the relationship lock if requested
+    indexes = sorted({hash(entity_type) % len(self._stripes) for entity_type in entity_types})
+    locks = [self._stripes[index] for index in indexes]
+    if relationships:
+      locks.append(self.relationships)
+    return _Held(locks)
+
+  def hold_all(self):
+    return _Held(self._stripes + [self.relationships])
+
+
+class WriteVersion:
+
+  def __init__(self):
+    self.started = 0
+    self.finished = 0
+    self._lock = threading.Lock()
+
+  def __enter__(self):
+    # Writers run inside "with version:" so readers can tell a write overlapped them
+    with self._lock:
+      self.started += 1
+
+  def __exit__(self, *exc_info):
+    with self._lock:
+      self.finished += 1
+
+  def stable(self):
+    # The current version if no write is in flight, otherwise None
+    finished = self.finished
+    if self.started != finished:
+      return None
+    return finished
+
+  def unchanged_since(self, version):
+    return self.started == version
@@ -0,0 +1,130 @@
+# Secondary indexes for the in-memory database.
+# search_entities and search_entities_with_type match every search parameter as a case-insensitive substring of the
+# entity's property value. Instead of scanning and lowercasing every entity on each query, PropertyIndex keeps, per
+# entity type and per property:
+# - an exact map from the folded (lowercased) value to the ids holding that value, and
+# - an n-gram map from every n-character slice of the folded value to the ids containing it.
+# A query longer than the n-gram size intersects the posting lists of its n-grams and only verifies the survivors;
+# shorter queries scan the distinct values of the property rather than the entities. Either way the cost follows the
+# number of matches and distinct values, not the size of the graph.
+# Writers of different entity types run in parallel in the database (each under its own stripe lock) but share this
+# index: its insertion counter and top-level maps, so add and remove take the index's own lock. match reads without it;
+# the database's seqlock retries a search that overlapped a write.
+
+import threading
+
+NGRAM_SIZE = 3
+
+
+def fold(value):
+  # Same normalization the linear search used: compare the lowercased string form of any value
+  return str(value).lower()
+
+
+def ngrams(text, size=NGRAM_SIZE):
+  return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+class PropertyIndex:
+
+  def __init__(self):
+    self.exact = {}  # entity_type -> key -> folded value -> set of entity ids
+    self.grams = {}  # entity_type -> key -> n-gram -> set of entity ids
+    self.indexed = {}  # entity_type -> entity_id -> (insertion sequence, {key: folded value})
+    self._sequence = 0
+    self._lock = threading.Lock()
+
+  def add(self, entity_type, entity_id, properties):
+    # (Re)index an entity; an entity that is already indexed keeps its position in search results
+    with self._lock:
+      self._add(entity_type, entity_id, properties)
+
+  def _add(self, entity_type, entity_id, properties):
+    entries = self.indexed.setdefault(entity_type, {})
+    previous = entries.get(entity_id)
+    if previous is not None:
+      sequence = previous[0]
+      self._unindex(entity_type, entity_id, previous[1])
+    else:
+      sequence = self._sequence
+      self._sequence += 1
+
+    folded = {key: fold(value) for key, value in properties.items()}
+    exact = self.exact.setdefault(entity_type, {})
+    grams = self.grams.setdefault(entity_type, {})
+    for key, value in folded.items():
+      exact.setdefault(key, {}).setdefault(value, set()).add(entity_id)
+      key_grams = grams.setdefault(key, {})
+      for gram in ngrams(value):
+        key_grams.setdefault(gram, set()).add(entity_id)
+    entries[entity_id] = (sequence, folded)
+
+  def remove(self, entity_type, entity_id):
+    with self._lock:
+      previous = self.indexed.get(entity_type, {}).pop(entity_id, None)
+      if previous is not None:
+        self._unindex(entity_type, entity_id, previous[1])
+
+  def _unindex(self, entity_type, entity_id, folded):
+    exact = self.exact[entity_type]
+    grams = self.grams[entity_type]
+    for key, value in folded.items():
+      _discard(exact[key], value, entity_id)
+      for gram in ngrams(value):
+        _discard(grams[key], gram, entity_id)
+
+  def match(self, entity_type, search_params):
+    # Return the ids of entity_type whose properties contain every search value, in insertion order
+    entries = self.indexed.get(entity_type)
+    if not entries:
+      return []
+
+    candidates = None
+    for key, value in search_params.items():
+      ids = self._match_property(entity_type, key, fold(value))
+      candidates = ids if candidates is None else candidates & ids
+      if not candidates:
+        return []
+    if candidates is None:
+      return list(entries)
+    return sorted(candidates, key=lambda entity_id: entries[entity_id][0])
+
+  def _match_property(self, entity_type, key, needle):
+    entries = self.indexed[entity_type]
+    if not needle:
+      # The empty string is a substring of everything, including the "" used for missing properties
+      return set(entries)
+
+    if len(needle) < NGRAM_SIZE:
+      ids = set()
+      for value, holders in self.exact.get(entity_type, {}).get(key, {}).items():
+        if needle in value:
+          ids |= holders
+      return ids
+
+    key_grams = self.grams.get(entity_type, {}).get(key, {})
+    postings = []
+    for gram in ngrams(needle):
+      holders = key_grams.get(gram)
+      if not holders:
+        return set()
+      postings.append(holders)
+    postings.sort(key=len)
+    ids = set(postings[0])
+    for holders in postings[1:]:
+      ids &= holders
+      if not ids:
+        return ids
+    # n-gram hits are a superset of substring hits; check the survivors against the stored value
+    return {
+        entity_id for entity_id in ids
+        if needle in entries[entity_id][1].get(key, "")
+    }
+
+
+def _discard(postings, token, entity_id):
+  holders = postings.get(token)
+  if holders is not None:
+    holders.discard(entity_id)
+    if not holders:
+      del postings[token]
@@ -0,0 +1,227 @@
+# Persistence for the in-memory database: an append-only write-ahead log (WAL) of entity and relationship mutations
+# plus periodic compact snapshots of the whole graph.
+# Every mutation is appended to the log as one JSON line tagged with a log sequence number (LSN) before it is applied
+# in memory. If the apply then fails, an {"op": "abort", "aborted_lsn": ...} record follows it and recovery skips both.
+# Durability uses group commit: a writer waits until an fsync covering its LSN has completed, and whichever writer
+# finds no fsync in flight performs one on behalf of everyone queued behind it. Concurrent writers therefore
+# share fsyncs instead of paying one each.
+# Every MEMORY_SNAPSHOT_EVERY records the graph is written to a snapshot (atomically, via rename) that remembers the
+# last LSN it includes, and the log is truncated. Recovery loads the latest snapshot and replays the log tail after
+# that LSN; a torn final line left by a crash mid-append is discarded.
+# Snapshots are JSON by default; MEMORY_SNAPSHOT_FORMAT=columnar writes the mmap-able binary format from
+# memory_columnar.py instead, which lets a large graph start serving without parsing the whole snapshot first.
+
+import json
+import os
+import threading
+import time
+
+from .memory_columnar import ColumnarSnapshot, write_columnar_snapshot
+
+MEMORY_SNAPSHOT_EVERY = int(os.environ.get("MEMORY_SNAPSHOT_EVERY", 10000))
+# "group" fsyncs before a write returns (batched across concurrent writers), "off" leaves flushing to the OS
+MEMORY_WAL_SYNC = os.environ.get("MEMORY_WAL_SYNC", "group").lower()
+# Optional pause before a group commit fsync so more writers can join the batch
+MEMORY_WAL_COMMIT_DELAY_MS = float(os.environ.get("MEMORY_WAL_COMMIT_DELAY_MS", 0))
+# "json" or "columnar"
+MEMORY_SNAPSHOT_FORMAT = os.environ.get("MEMORY_SNAPSHOT_FORMAT", "json").lower()
+
+SNAPSHOT_FILE = "snapshot.json"
+COLUMNAR_SNAPSHOT_FILE = "snapshot.col"
+WAL_FILE = "wal.jsonl"
+
+
+def _fsync_directory(directory):
+  # Make a rename inside the directory durable (not supported on every platform)
+  try:
+    fd = os.open(directory, os.O_RDONLY)
+  except OSError:
+    return
+  try:
+    os.fsync(fd)
+  except OSError:
+    pass
+  finally:
+    os.close(fd)
+
+
+def write_snapshot(path, state):
+  temp_path = path + ".tmp"
+  with open(temp_path, "w") as file:
+    json.dump(state, file, separators=(",", ":"), default=str)
+    file.flush()
+    os.fsync(file.fileno())
+  os.replace(temp_path, path)
+  _fsync_directory(os.path.dirname(os.path.abspath(path)))
+
+
+def read_snapshot(path):
+  try:
+    with open(path, "r") as file:
+      return json.load(file)
+  except FileNotFoundError:
+    return None
+
+
+class WriteAheadLog:
+
+  def __init__(self, path, sync_mode=MEMORY_WAL_SYNC, commit_delay_ms=MEMORY_WAL_COMMIT_DELAY_MS):
+    self.path = path
+    self.sync_mode = sync_mode
+    self.commit_delay = commit_delay_ms / 1000.0
+    self.lsn = 0  # last LSN appended
+    self._durable_lsn = 0  # last LSN known to be on disk
+    self._write_lock = threading.Lock()
+    self._sync_condition = threading.Condition()
+    self._syncing = False
+    self._file = None
+
+  def read(self, after_lsn=0):
+    # Return the records after after_lsn and truncate any torn tail so new appends start on a clean line
+    records = []
+    good_offset = 0
+    try:
+      with open(self.path, "rb") as file:
+        for line in file:
+          if not line.endswith(b"\n"):
+            break
+          try:
+            record = json.loads(line)
+          except ValueError:
+            break
+          good_offset += len(line)
+          self.lsn = max(self.lsn, record["lsn"])
+          if record["lsn"] > after_lsn:
+            records.append(record)
+    except FileNotFoundError:
+      return records
+
+    if good_offset < os.path.getsize(self.path):
+      print(f"Discarding torn write-ahead log tail after byte {good_offset}")
+      with open(self.path, "r+b") as file:
+        file.truncate(good_offset)
+    return records
+
+  def open(self, start_lsn=0):
+    self.lsn = max(self.lsn, start_lsn)
+    self._durable_lsn = self.lsn
+    self._file = open(self.path, "ab")
+
+  def append(self, record):
+    with self._write_lock:
+      self.lsn += 1
+      line = json.dumps({"lsn": self.lsn, **record}, separators=(",", ":"), default=str)
+      self._file.write(line.encode("utf8") + b"\n")
+      return self.lsn
+
+  def commit(self, lsn):
+    # Group commit: wait until an fsync covering lsn has completed, running it ourselves if nobody else is
+    if self.sync_mode == "off":
+      return
+    with self._sync_condition:
+      while self._durable_lsn < lsn:
+        if self._syncing:
+          self._sync_condition.wait()
+          continue
+        self._syncing = True
+        self._sync_condition.release()
+        try:
+          if self.commit_delay:
+            time.sleep(self.commit_delay)
+          target = self._flush()
+        finally:
+          self._sync_condition.acquire()
+          self._syncing = False
+        self._durable_lsn = max(self._durable_lsn, target)
+        self._sync_condition.notify_all()
+
+  def _flush(self):
+    with self._write_lock:
+      target = self.lsn
+      self._file.flush()
+    os.fsync(self._file.fileno())
+    return target
+
+  def truncate(self):
+    # Called once a snapshot covers every appended record
+    with self._write_lock:
+      self._file.flush()
+      self._file.truncate(0)
+      os.fsync(self._file.fileno())
+    with self._sync_condition:
+      self._durable_lsn = max(self._durable_lsn, self.lsn)
+
+  def close(self):
+    if self._file is not None:
+      self._flush()
+      self._file.close()
+      self._file = None
+
+
+class GraphJournal:
+
+  def __init__(self,
+               directory,
+               snapshot_every=MEMORY_SNAPSHOT_EVERY,
+               sync_mode=MEMORY_WAL_SYNC,
+               snapshot_format=MEMORY_SNAPSHOT_FORMAT):
+    os.makedirs(directory, exist_ok=True)
+    self.directory = directory
+    self.snapshot_every = snapshot_every
+    self.snapshot_format = snapshot_format
+    self.snapshot_path = os.path.join(directory, SNAPSHOT_FILE)
+    self.columnar_snapshot_path = os.path.join(directory, COLUMNAR_SNAPSHOT_FILE)
+    self.wal = WriteAheadLog(os.path.join(directory, WAL_FILE), sync_mode=sync_mode)
+    self.records_since_snapshot = 0
+
+  def _latest_snapshot(self):
+    # Either snapshot format may be on disk (e.g. after MEMORY_SNAPSHOT_FORMAT changed); the higher LSN wins
+    state = read_snapshot(self.snapshot_path)
+    if os.path.exists(self.columnar_snapshot_path):
+      columnar = ColumnarSnapshot(self.columnar_snapshot_path)
+      if state is None or columnar.lsn > state["lsn"]:
+        return columnar
+      columnar.close()
+    return state
+
+  def recover(self):
+    # Return the latest snapshot (a state dict, a ColumnarSnapshot or None) and the log records written after it
+    state = self._latest_snapshot()
+    if state is None:
+      snapshot_lsn = 0
+    elif isinstance(state, ColumnarSnapshot):
+      snapshot_lsn = state.lsn
+    else:
+      snapshot_lsn = state["lsn"]
+    records = self.wal.read(after_lsn=snapshot_lsn)
+    self.wal.open(start_lsn=snapshot_lsn)
+    self.records_since_snapshot = len(records)
+    print(f"Recovered in-memory graph: snapshot at LSN {snapshot_lsn}, {len(records)} log records to replay")
+    return state, records
+
+  def append(self, op, fields):
+    self.records_since_snapshot += 1
+    return self.wal.append({"op": op, **fields})
+
+  def commit(self, lsn):
+    self.wal.commit(lsn)
+
+  def needs_snapshot(self):
+    return self.snapshot_every > 0 and self.records_since_snapshot >= self.snapshot_every
+
+  def snapshot(self, state):
+    state["lsn"] = self.wal.lsn
+    if self.snapshot_format == "columnar":
+      path, stale_path = self.columnar_snapshot_path, self.snapshot_path
+      write_columnar_snapshot(path, state)
+    else:
+      path, stale_path = self.snapshot_path, self.columnar_snapshot_path
+      write_snapshot(path, state)
+    _fsync_directory(self.directory)
+    if os.path.exists(stale_path):
+      os.remove(stale_path)
+    self.wal.truncate()
+    self.records_since_snapshot = 0
+
+  def close(self):
+    self.wal.close()
@@ -0,0 +1,47 @@
+# Compact record storage for the in-memory database (MEMORY_COMPACT_RECORDS=true).
+# A stored entity is a dict ({"entity_type": ..., "data": {...}}) and a stored relationship is a dict repeating the same
+# keys (from_type, to_type, from_entity, relationship_type, snippet, ...) for every edge. Per-object dict overhead then
+# dominates memory use. pack_record turns every dict into a Record, a tuple whose first slot is a key tuple shared
+# by all records with the same keys and whose other slots hold the values. Type and relationship names are interned,
+# so each distinct name is stored once. unpack_record turns a Record back into the dict the caller stored.
+
+import sys
+
+from .memory_columnar import INTERNED_KEYS
+
+_key_tables = {}  # key tuple -> the shared instance of that key tuple
+
+
+class Record(tuple):
+  # (keys, value, value, ...); a tuple subclass with no per-instance __dict__
+  __slots__ = ()
+
+  @property
+  def keys(self):
+    return self[0]
+
+  def get(self, key, default=None):
+    keys = self[0]
+    for position, candidate in enumerate(keys):
+      if candidate == key:
+        return unpack_record(self[position + 1])
+    return default
+
+  def to_dict(self):
+    return {key: unpack_record(value) for key, value in zip(self[0], self[1:])}
+
+
+def pack_record(value, key=None):
+  if isinstance(value, dict):
+    keys = tuple(value)
+    keys = _key_tables.setdefault(keys, keys)
+    return Record((keys, *(pack_record(v, k) for k, v in zip(keys, value.values()))))
+  if type(value) is str and key in INTERNED_KEYS:
+    return sys.intern(value)
+  return value
+
+
+def unpack_record(value):
+  if isinstance(value, Record):
+    return value.to_dict()
+  return value
@@ -0,0 +1,81 @@
+# MurmurHash64A, the hash NebulaGraph's built-in hash() uses, which MindGraph uses to turn entity names into int64
+# vertex IDs (see nebulagraph.py). Query `RETURN hash("foobar")` in Nebula Console to compare.
+# - murmur64(string): one string, for single inserts; 8-byte blocks are unpacked with struct rather than byte by byte.
+# - murmur64_many(strings): many strings at once with vectorized uint64 NumPy arithmetic (which wraps modulo 2**64 like
+#   the C implementation), for bulk imports. The strings are laid out as rows of one zero-padded byte matrix and every
+#   row runs the block loop together, each stopping after its own number of blocks. NumPy is imported on the first
+#   batch, so the scalar path works without it.
+# Both return signed 64-bit integers, as Nebula does.
+
+import struct
+
+SEED = 0xC70F6907
+M = 0xC6A4A7935BD1E995
+R = 47
+MASK = 2**64 - 1
+
+
+def to_signed(h):
+    return h - 2**64 if h >= 2**63 else h
+
+
+def murmur64(string: str, seed: int = SEED) -> int:
+    data = string.encode("utf8")
+    length = len(data)
+    off = length & ~7
+    h = (seed ^ (M * length)) & MASK
+
+    for (k,) in struct.iter_unpack("<Q", data[:off]):
+        k = (k * M) & MASK
+        k ^= k >> R
+        k = (k * M) & MASK
+        h ^= k
+        h = (h * M) & MASK
+
+    if length & 7:
+        h ^= int.from_bytes(data[off:], "little")
+        h = (h * M) & MASK
+
+    h ^= h >> R
+    h = (h * M) & MASK
+    h ^= h >> R
+    return to_signed(h)
+
+
+def murmur64_many(strings, seed: int = SEED) -> list:
+    import numpy as np
+
+    encoded = [string.encode("utf8") for string in strings]
+    if not encoded:
+        return []
+    lengths = np.fromiter((len(data) for data in encoded), dtype=np.int64, count=len(encoded))
+    blocks_per_row = lengths >> 3
+    # One spare block per row so every row's tail (zero-padded) can be read as a whole block
+    width = (int(blocks_per_row.max()) + 1) * 8
+
+    # Scatter all the bytes into a zero-padded (rows, width) matrix in one step
+    rows = len(encoded)
+    flat = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    starts = np.cumsum(lengths) - lengths
+    row_index = np.repeat(np.arange(rows), lengths)
+    column_index = np.arange(flat.size) - np.repeat(starts, lengths)
+    padded = np.zeros((rows, width), dtype=np.uint8)
+    padded[row_index, column_index] = flat
+    blocks = padded.view("<u8")
+
+    m = np.uint64(M)
+    r = np.uint64(R)
+    h = np.uint64(seed) ^ (lengths.astype(np.uint64) * m)
+    for block in range(int(blocks_per_row.max())):
+        k = blocks[:, block] * m
+        k ^= k >> r
+        k *= m
+        h = np.where(blocks_per_row > block, (h ^ k) * m, h)
+
+    tails = blocks[np.arange(rows), blocks_per_row]
+    h = np.where(lengths & 7 != 0, (h ^ tails) * m, h)
+
+    h ^= h >> r
+    h *= m
+    h ^= h >> r
+    return h.view(np.int64).tolist()
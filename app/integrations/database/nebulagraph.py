@@ -1,4 +1,3 @@
-import ctypes
 import json
 import os
 import time
@@ -7,8 +6,12 @@ from nebula3.gclient.net import ConnectionPool
 from nebula3.gclient.net.SessionPool import SessionPool
 from nebula3.Config import Config, SessionPoolConfig
 
+from ...schema_registry import get_schema
 from .base import DatabaseIntegration
 from .memory import InMemoryDatabase
+# Vertex IDs are the int64 hash of the entity name: MindGraph uses numeric IDs, and Nebula's built-in hash() (used when
+# the Vertex ID Type is int64) gives the same value for a name, see murmur.py
+from .murmur import murmur64, murmur64_many
 
 
 NEBULA_USER = os.environ.get("NEBULA_USER", "root")
@@ -22,83 +25,6 @@ NEBULA_DDL_WAIT_RETRIES = os.environ.get("NEBULA_DDL_WAIT_RETRIES", 3)
 NEBULA_GRAPH_SAMPLE_SIZE = os.environ.get("NEBULA_GRAPH_SAMPLE_SIZE", 2000)
 
 
-def murmur64(string: str, seed: int = 0xC70F6907) -> int:
-    """
-    MurmurHash3 64-bit implementation. Same as the one used in NebulaGraph.
-
-    This is needed as MindGraph is using numeric IDs for entities.
-
-    In NebulaGraph, the built-in hash function is used to hash the vertex ID when
-    Vertex ID Type is int64.
-
-    Query `RETURN hash("foobar")` in Nebula Console to see
-    the hash value of a string.
-
-    Args:
-        string (str): The string to hash.
-        seed (int): The seed value.
-
-    Returns:
-        int: The 64-bit hash value.
-    """
-    data = bytes(string, encoding="utf8")
-
-    def bytes_to_long(bytes):
-        assert len(bytes) == 8
-        return sum((b << (k * 8) for k, b in enumerate(bytes)))
-
-    m = ctypes.c_uint64(0xC6A4A7935BD1E995).value
-
-    r = ctypes.c_uint32(47).value
-
-    MASK = ctypes.c_uint64(2**64 - 1).value
-
-    data_as_bytes = bytearray(data)
-
-    seed = ctypes.c_uint64(seed).value
-
-    h = seed ^ ((m * len(data_as_bytes)) & MASK)
-
-    off = int(len(data_as_bytes) / 8) * 8
-    for ll in range(0, off, 8):
-        k = bytes_to_long(data_as_bytes[ll : ll + 8])
-        k = (k * m) & MASK
-        k = k ^ ((k >> r) & MASK)
-        k = (k * m) & MASK
-        h = h ^ k
-        h = (h * m) & MASK
-
-    l = len(data_as_bytes) & 7
-
-    if l >= 7:
-        h = h ^ (data_as_bytes[off + 6] << 48)
-
-    if l >= 6:
-        h = h ^ (data_as_bytes[off + 5] << 40)
-
-    if l >= 5:
-        h = h ^ (data_as_bytes[off + 4] << 32)
-
-    if l >= 4:
-        h = h ^ (data_as_bytes[off + 3] << 24)
-
-    if l >= 3:
-        h = h ^ (data_as_bytes[off + 2] << 16)
-
-    if l >= 2:
-        h = h ^ (data_as_bytes[off + 1] << 8)
-
-    if l >= 1:
-        h = h ^ data_as_bytes[off]
-        h = (h * m) & MASK
-
-    h = h ^ ((h >> r) & MASK)
-    h = (h * m) & MASK
-    h = h ^ ((h >> r) & MASK)
-
-    return ctypes.c_longlong(h).value
-
-
 class NebulaGraphIntegration(InMemoryDatabase, DatabaseIntegration):
     def __init__(self, schema_file_path="schema.json"):
         self.nebula_user = NEBULA_USER
@@ -110,9 +36,10 @@ class NebulaGraphIntegration(InMemoryDatabase, DatabaseIntegration):
         self.client = None
         self._ensure_nebula_connection()
 
-        self.schema = self._load_schema(schema_file_path)
+        self.compiled_schema = get_schema(schema_file_path)
+        self.schema = self.compiled_schema.schema
         self._ensure_nebulagraph_schema()
-        # cache and fast track implementation for search_entities
+        # Entities and relationships written through this instance; searches run in NebulaGraph itself
         self.graph = {"entities": {}, "relationships": []}
 
     def _ensure_nebula_connection(self):
@@ -181,12 +108,6 @@ class NebulaGraphIntegration(InMemoryDatabase, DatabaseIntegration):
         )
         self.client.init(SessionPoolConfig())
 
-    def _load_schema(self, schema_file_path):
-        # Load and return the schema from the schema.json file
-        with open(schema_file_path, "r") as file:
-            schema = json.load(file)
-        return schema
-
     def _get_nebula_schema(self):
         tags_raw = self.client.execute("SHOW TAGS").column_values("Name")
         tags = [tag.cast() for tag in tags_raw]
@@ -209,28 +130,11 @@ class NebulaGraphIntegration(InMemoryDatabase, DatabaseIntegration):
         Note, for relationship extraction there is a fallback type: "associated" which is used when no type is provided.
 
         """
-        # Build Schema Creation Queries
-        # VERTEX TAGS
-        tag_names = []
-        tag_queries = []
-        relationships_in_schema = set()
-        for entity_type, entity_item in self.schema.items():
-            tag_name = entity_type
-            tag_queries.append(
-                f"CREATE TAG IF NOT EXISTS `{tag_name}`(name string, description string);"
-            )
-            tag_names.append(tag_name)
-            for relationship_type in entity_item.get("edge_types", {}).keys():
-                relationships_in_schema.add(relationship_type)
-        # EDGES TYPES
-        edge_names = []
-        edge_queries = []
-        for relationship_type in relationships_in_schema:
-            edge_name = relationship_type
-            edge_queries.append(
-                f"CREATE EDGE IF NOT EXISTS `{edge_name}`(snippet string, relationship_type string);"
-            )
-            edge_names.append(edge_name)
+        # Schema Creation Queries, built once per schema load by the schema registry
+        tag_queries = list(self.compiled_schema.nebula_tag_queries.values())
+        edge_queries = list(self.compiled_schema.nebula_edge_queries.values())
+        tag_names = list(self.compiled_schema.nebula_tag_queries)
+        edge_names = list(self.compiled_schema.nebula_edge_queries)
 
         current_schema = self._get_nebula_schema()
         missing_tags = set(tag_names) - set(current_schema["entities"])
@@ -254,6 +158,48 @@ class NebulaGraphIntegration(InMemoryDatabase, DatabaseIntegration):
             else:
                 print(f"Successfully created tags and edges: {query}")
 
+        self._ensure_nebulagraph_indexes()
+
+    def _ensure_nebulagraph_indexes(self):
+        """
+        Ensure every tag and edge type has the index its searches run on (see search_entities_with_type and
+        search_relationships), and build the new ones over the data already in the space.
+
+        Index creation only takes effect after a couple of heartbeats, so the rebuild is retried with the same backoff
+        as the space creation.
+        """
+        indexes = {
+            "TAG": self.compiled_schema.nebula_tag_index_queries,
+            "EDGE": self.compiled_schema.nebula_edge_index_queries,
+        }
+        for kind, queries in indexes.items():
+            existing_raw = self.client.execute(f"SHOW {kind} INDEXES").column_values("Index Name")
+            existing = {index.cast() for index in existing_raw}
+            missing = [name for name in queries if name not in existing]
+            if not missing:
+                continue
+
+            print(f"Missing {kind.lower()} indexes will be created: {missing}")
+            query = "\n".join(queries[name] for name in missing)
+            execute_result = self.client.execute(query)
+            assert (
+                execute_result.is_succeeded()
+            ), f"Failed to create indexes: {execute_result.error_msg()}\n query: {query}"
+
+            retries = int(NEBULA_DDL_WAIT_RETRIES)
+            backoff_seconds = int(NEBULA_DDL_WAIT_BACKOFF_SECONDS)
+            rebuild = f"REBUILD {kind} INDEX " + ", ".join(f"`{name}`" for name in missing)
+            for attempt in range(retries):
+                result = self.client.execute(rebuild)
+                if result.is_succeeded():
+                    print(f"Rebuilding {kind.lower()} indexes: {missing}")
+                    break
+                if attempt < retries - 1:
+                    print(f"Attempt {attempt + 1} to rebuild indexes failed: {result.error_msg()}. Retrying...")
+                    time.sleep(backoff_seconds * 2**attempt)  # Exponential backoff
+                else:
+                    print(f"Failed to rebuild indexes {missing}: {result.error_msg()}")
+
     def get_full_graph(self, limit=NEBULA_GRAPH_SAMPLE_SIZE):
         """
         Return the sampled full graph. sample size is configurable with NEBULA_GRAPH_SAMPLE_SIZE.
@@ -331,10 +277,11 @@ class NebulaGraphIntegration(InMemoryDatabase, DatabaseIntegration):
 
         return graph_sample
 
-    def _get_cache_full_graph(self, limit=NEBULA_GRAPH_SAMPLE_SIZE, force=False):
-        if force or not self.graph["entities"] or not self.graph["relationships"]:
-            self.graph = self.get_full_graph(limit=limit)
-        return self.graph
+    # Scoped reads work on the sampled graph from get_full_graph, like the rest of the UI
+    # (the InMemoryDatabase versions rely on adjacency maps this class does not keep)
+    get_graph_page = DatabaseIntegration.get_graph_page
+    get_subgraph = DatabaseIntegration.get_subgraph
+    get_top_entities = DatabaseIntegration.get_top_entities
 
     def get_entity(self, entity_type, entity_id):
         """
@@ -401,7 +348,8 @@ class NebulaGraphIntegration(InMemoryDatabase, DatabaseIntegration):
         vertex_id = murmur64(prop_name)
 
         # Insert into NebulaGraph
-        query = f"INSERT VERTEX {vertex_tag}(name, description) VALUES {vertex_id}:('{prop_name}', '{prop_description}');"
+        query = (f"INSERT VERTEX `{nebula_name(vertex_tag)}`(name, description) "
+                 f"VALUES {vertex_id}:({nebula_string(prop_name)}, {nebula_string(prop_description)});")
         result = self.client.execute(query)
         assert result.is_succeeded(), f"Failed to insert vertex: {result.error_msg()}"
 
@@ -413,6 +361,37 @@ class NebulaGraphIntegration(InMemoryDatabase, DatabaseIntegration):
 
         return str(vertex_id)
 
+    def add_entities(self, entity_type, entities):
+        """
+        Add entities of one type in a single INSERT VERTEX, hashing all their names at once.
+
+        Returns:
+            list: The IDs of the new entities, in order.
+        """
+        if not entities:
+            return []
+        actual_data = [data["data"] for data in entities]
+        names = [data.get("name", "") for data in actual_data]
+        if not all(names):
+            raise ValueError("Entity name is required.")
+        vertex_ids = murmur64_many(names)
+
+        # Names and descriptions are escaped string literals, so a quote in one cannot break (or rewrite) the batch
+        values = ", ".join(
+            f"{vertex_id}:({nebula_string(data['name'])}, {nebula_string(data.get('description', ''))})"
+            for vertex_id, data in zip(vertex_ids, actual_data)
+        )
+        query = f"INSERT VERTEX `{nebula_name(entity_type)}`(name, description) VALUES {values};"
+        result = self.client.execute(query)
+        assert result.is_succeeded(), f"Failed to insert vertices: {result.error_msg()}"
+
+        # Added to cache
+        cached = self.graph["entities"].setdefault(entity_type, {})
+        for vertex_id, data in zip(vertex_ids, actual_data):
+            cached[vertex_id] = data
+
+        return [str(vertex_id) for vertex_id in vertex_ids]
+
     def update_entity(self, entity_type, entity_id, data):
         """
         Update an entity in the graph.
@@ -496,6 +475,22 @@ class NebulaGraphIntegration(InMemoryDatabase, DatabaseIntegration):
 
         return murmur64(f"{src_id}{edge_type}{dst_id}")
 
+    def find_relationship(self, data):
+        # An edge is identified by (source, edge type, rank, destination), so this fetches that one edge
+        edge_type = data["relationship"].strip()
+        src_id = int(data["from_id"])
+        dst_id = int(data["to_id"])
+        result = self.client.execute(
+            f"FETCH PROP ON `{edge_type}` {src_id} -> {dst_id} YIELD properties(edge) AS props;"
+        )
+        if not result.is_succeeded() or result.row_size() == 0:
+            return None
+        return {**data, "id": murmur64(f"{src_id}{edge_type}{dst_id}")}
+
+    # Check with find_relationship, then add_relationship (the InMemoryDatabase versions rely on its adjacency maps)
+    merge_relationship = DatabaseIntegration.merge_relationship
+    merge_relationships = DatabaseIntegration.merge_relationships
+
     def delete_entity(self, entity_type, entity_id):
         """
         Delete an entity from the graph.
@@ -559,48 +554,106 @@ class NebulaGraphIntegration(InMemoryDatabase, DatabaseIntegration):
 
         return True
 
+    def _query_rows(self, query):
+        # The rows of a query as dicts of plain Python values (property maps included)
+        result = self.client.execute(query)
+        assert result.is_succeeded(), f"Failed to search: {result.error_msg()}\n query: {query}"
+        columns = result.keys()
+        rows = []
+        for row in range(result.row_size()):
+            values = result.row_values(row)
+            rows.append({column: cast_value(value) for column, value in zip(columns, values)})
+        return rows
+
     def search_entities(self, search_params):
-        # TODO: Implement search_entities on NebulaGraph side
-        self._get_cache_full_graph()
+        # Every tag in the schema, each searched through its index
         results = []
-        for entity_type, entities in self.graph["entities"].items():
-            for entity_id, entity_details in entities.items():
-                entity_info = entity_details.get("data", {})
-                # Convert values to strings for comparison
-                if all(
-                    str(value).lower() in str(entity_info.get(key, "")).lower()
-                    for key, value in search_params.items()
-                ):
-                    results.append(
-                        {"type": entity_type, "id": entity_id, **entity_info}
-                    )
+        for entity_type in self.compiled_schema.entity_types:
+            results.extend(self.search_entities_with_type(entity_type, search_params))
         return results
 
     def search_entities_with_type(self, entity_type, search_params):
-        # TODO: Implement search_entities on NebulaGraph side
-        self._get_cache_full_graph()
-        results = []
-        for entity_id, entity_details in (
-            self.graph["entities"].get(entity_type, {}).items()
-        ):
-            entity_info = entity_details.get("data", {})
-            # Convert values to strings for comparison
-            if all(
-                str(value).lower() in str(entity_info.get(key, "")).lower()
-                for key, value in search_params.items()
-            ):
-                results.append({"type": entity_type, "id": entity_id, **entity_info})
-        return results
+        """
+        Case-insensitive substring search on the entity's properties, run by NebulaGraph over the whole space: the
+        MATCH on the tag is driven by its tag index and the filter is evaluated in storage.
+        """
+        conditions = [
+            contains_condition(f"v.`{nebula_name(entity_type)}`.`{nebula_name(key)}`", value)
+            for key, value in search_params.items()
+        ]
+        where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+        rows = self._query_rows(
+            f"MATCH (v:`{nebula_name(entity_type)}`) {where}RETURN id(v) AS id, properties(v) AS props;"
+        )
+        return [{"type": entity_type, "id": row["id"], **(row["props"] or {})} for row in rows]
 
     def search_relationships(self, search_params):
-        # TODO: Implement search_relationships on NebulaGraph side
-        self._get_cache_full_graph()
+        """
+        Relationships matching search_params, like the InMemoryDatabase: from_id and to_id are matched exactly,
+        everything else as a case-insensitive substring. "relationship" narrows down the edge types to search, and
+        from_entity / to_entity match the names of the endpoints. Each edge type is a MATCH driven by its edge index.
+        """
+        remaining = dict(search_params)
+        relationship = str(remaining.pop("relationship", "")).lower()
+        edge_types = [
+            edge_type for edge_type in self.compiled_schema.edge_types if relationship in edge_type.lower()
+        ]
+
+        conditions = []
+        for key, value in remaining.items():
+            if key in ("from_id", "to_id"):
+                try:
+                    vertex_id = int(value)
+                except (TypeError, ValueError):
+                    # Vertex IDs are integers, so no edge can have this endpoint
+                    return []
+                conditions.append(f"id({'a' if key == 'from_id' else 'b'}) == {vertex_id}")
+            elif key == "from_entity":
+                conditions.append(contains_condition("properties(a).name", value))
+            elif key == "to_entity":
+                conditions.append(contains_condition("properties(b).name", value))
+            else:
+                conditions.append(contains_condition(f"e.`{nebula_name(key)}`", value))
+        where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+
         results = []
-        for relationship in self.graph["relationships"]:
-            # Convert values to strings for comparison
-            if all(
-                str(value).lower() in str(relationship.get(key, "")).lower()
-                for key, value in search_params.items()
-            ):
-                results.append(relationship)
+        for edge_type in edge_types:
+            rows = self._query_rows(
+                f"MATCH (a)-[e:`{nebula_name(edge_type)}`]->(b) {where}"
+                f"RETURN id(a) AS from_id, id(b) AS to_id, properties(e) AS props, "
+                f"properties(a).name AS from_entity, properties(b).name AS to_entity;"
+            )
+            for row in rows:
+                results.append({
+                    **(row["props"] or {}),
+                    "relationship": edge_type,
+                    "from_id": row["from_id"],
+                    "to_id": row["to_id"],
+                    "from_entity": row["from_entity"] or "",
+                    "to_entity": row["to_entity"] or "",
+                })
         return results
+
+
+def nebula_name(name):
+    # Tag, edge type and property names go in backticks
+    return str(name).replace("`", "")
+
+
+def nebula_string(value):
+    # A double-quoted nGQL string literal
+    return json.dumps(str(value), ensure_ascii=False)
+
+
+def contains_condition(expression, value):
+    return f"lower(toString({expression})) CONTAINS {nebula_string(str(value).lower())}"
+
+
+def cast_value(value):
+    # ValueWrapper -> Python value, including the values inside maps and lists
+    value = value.cast() if hasattr(value, "cast") else value
+    if isinstance(value, dict):
+        return {key: cast_value(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [cast_value(item) for item in value]
+    return value
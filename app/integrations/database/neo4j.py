@@ -1,12 +1,39 @@
 import os
-from neo4j import GraphDatabase
 from .base import DatabaseIntegration
+from .neo4j_drivers import get_driver
+from .subgraphs import (GRAPH_MAX_NODES, GRAPH_PAGE_SIZE, add_to_graph, cypher_label, cypher_name, decode_cursor,
+                        empty_graph, encode_cursor, neighbourhood_ids)
 from flask import current_app 
 
 NEO4J_URI = os.environ.get("NEO4J_URI", "bolt://localhost:7687")
 NEO4J_USERNAME = os.environ.get("NEO4J_USERNAME", "neo4j")
 NEO4J_PASSWORD = os.environ.get("NEO4J_PASSWORD", "password")
 NEO4J_DATABASE = os.environ.get("NEO4J_DATABASE", "neo4j")
+# Finding unlabelled nodes takes a scan of every node, so iter_full_graph only looks for them when asked to
+NEO4J_INCLUDE_UNLABELLED = os.environ.get("NEO4J_INCLUDE_UNLABELLED", "false").lower() == "true"
+
+
+# Columns returned for each edge; see relationship_desc
+EDGE_COLUMNS = """elementId(src) AS src_id,
+                    labels(src)[0] AS from_type,
+                    type(e) AS relationship,
+                    elementId(dest) AS dest_id,
+                    labels(dest)[0] AS to_type,
+                    properties(e) AS edge_props"""
+
+
+def relationship_desc(row):
+    return {
+        "relationship": row["relationship"],
+        "snippet": row["edge_props"].get("snippet", row["relationship"]),
+        "from_id": row["src_id"],
+        "to_id": row["dest_id"],
+        "from_type": row["from_type"],
+        "to_type": row["to_type"],
+        "from_entity": "",
+        "to_entity": "",
+        "relationship_type": row["relationship"],
+    }
 
 
 # rename dict keys containing spaces with _
@@ -26,10 +53,12 @@ def remove_spaces(data):
 
 class Neo4jDBIntegration(DatabaseIntegration):
     def __init__(self, schema_file_path="schema.json", database=NEO4J_DATABASE):
+        # Integrations are cheap to create: they share one pooled driver per server and pick the database per session
         self._database = database
-        self._driver = GraphDatabase.driver(
-            NEO4J_URI, auth=(NEO4J_USERNAME, NEO4J_PASSWORD), database=database
-        )
+        self._driver = get_driver(NEO4J_URI, NEO4J_USERNAME, NEO4J_PASSWORD, database=database)
+
+    def session(self, database=None):
+        return self._driver.session(database=database or self._database)
     def add_entity(self, entity_type, data):
         data["data"] = remove_spaces(data["data"])
 
@@ -42,59 +71,130 @@ class Neo4jDBIntegration(DatabaseIntegration):
         # return entity ID
         return result[0]["id"]
 
-    def get_full_graph(self, database=None):
-        if database is None:
-            database = self._database
+    def add_entities(self, entity_type, entities):
+        # One write transaction, one UNWIND: creates every node and returns their IDs in input order
+        rows = []
+        for data in entities:
+            data["data"] = remove_spaces(data["data"])
+            rows.append(data["data"])
+        if not rows:
+            return []
+
+        q = f"""UNWIND $rows AS row
+                CREATE (n:{entity_type})
+                SET n = row
+                RETURN elementId(n) AS id"""
+
+        result = self._write_transaction([(q, {"rows": rows})])
+        return [row["id"] for row in result[0]]
 
+    def get_full_graph(self, database=None):
         graph = {
             "entities": {},
             "relationships": [],
         }
 
-        with self._driver.session(database=database) as session:
-            # get nodes
-            nodes = session.run(
-                "MATCH (n) RETURN n, elementId(n) AS id, labels(n)[0] AS label"
-            )
-            for node in nodes:
-                lbl = node["label"]
-                id = node["id"]
-                node_props = dict(node["n"])  # Convert Node object to dict
-
+        for record in self.iter_full_graph(database):
+            if record[0] == "entity":
+                _, lbl, id, entity = record
                 if lbl not in graph["entities"]:
                     graph["entities"][lbl] = {}
 
-                graph["entities"][lbl][id] = {"entity_type": lbl, "data": node_props}
+                graph["entities"][lbl][id] = entity
+            else:
+                graph["relationships"].append(record[1])
+
+        return graph
+
+    def iter_full_graph(self, database=None):
+        # Yield ("entity", label, id, entity) for every node, grouped by label, then ("relationship", desc) for every
+        # edge, as Bolt delivers the records, so callers can stream the graph without holding all of it.
+        # Nodes are read with one query per label rather than one query sorted by label: an ORDER BY makes the server
+        # sort every node before it sends the first record.
+        if database is None:
+            database = self._database
+
+        with self.session(database) as session:
+            labels = [record["label"] for record in session.run("CALL db.labels() YIELD label RETURN label")]
+            # A node is listed under its first label, as labels(n)[0] always grouped it; unlabelled nodes come last
+            queries = [(f"MATCH (n:{cypher_name(lbl)}) WHERE labels(n)[0] = $label", lbl) for lbl in labels]
+            if NEO4J_INCLUDE_UNLABELLED:
+                queries.append(("MATCH (n) WHERE size(labels(n)) = 0", None))
+            for match, lbl in queries:
+                nodes = session.run(f"{match} RETURN n, elementId(n) AS id", {"label": lbl})
+                for node in nodes:
+                    node_props = dict(node["n"])  # Convert Node object to dict
+                    yield "entity", lbl, node["id"], {"entity_type": lbl, "data": node_props}
 
             # get edges
-            results = session.run(
-                """
-                MATCH (src)-[e]->(dest)
-                RETURN elementId(src) AS src_id,
-                    labels(src)[0] AS from_type,
-                    type(e) AS relationship,
-                    elementId(dest) AS dest_id,
-                    labels(dest)[0] AS to_type,
-                    properties(e) AS edge_props
-                """
-            )
+            results = session.run(f"MATCH (src)-[e]->(dest) RETURN {EDGE_COLUMNS}")
             for row in results:
-                desc = {
-                    "relationship": row["relationship"],
-                    "snippet": row["edge_props"].get("snippet", row["relationship"]),
-                    "from_id": row["src_id"],
-                    "to_id": row["dest_id"],
-                    "from_type": row["from_type"],
-                    "to_type": row["to_type"],
-                    "from_entity": "",
-                    "to_entity": "",
-                    "relationship_type": row["relationship"],
-                }
-
-                graph["relationships"].append(desc)
+                yield "relationship", relationship_desc(row)
+
+    def _scoped_graph(self, nodes, edge_query, params):
+        # Build a graph from node rows (n, id, label) and the edges returned by edge_query
+        graph = empty_graph()
+        for node in nodes:
+            add_to_graph(graph, node["label"], node["id"], {"entity_type": node["label"], "data": node["n"]})
+        graph["relationships"] = [relationship_desc(row) for row in self._query(edge_query, params)]
+        return graph
 
+    def get_graph_page(self, cursor=None, limit=GRAPH_PAGE_SIZE, entity_type=None):
+        # Keyset pagination on elementId; each page carries the relationships starting at its nodes.
+        # elementId has no index, so every page is a top-N pass over the matching nodes (ORDER BY ... LIMIT keeps
+        # only limit + 1 of them, rather than sorting them all); an entity_type filter narrows it to one label.
+        q = f"""MATCH (n{cypher_label(entity_type)})
+                WHERE $after IS NULL OR elementId(n) > $after
+                RETURN n, elementId(n) AS id, labels(n)[0] AS label
+                ORDER BY id
+                LIMIT $limit"""
+
+        nodes = self._query(q, {"after": decode_cursor(cursor), "limit": limit + 1})
+        page = nodes[:limit]
+        graph = self._scoped_graph(
+            page,
+            f"MATCH (src)-[e]->(dest) WHERE elementId(src) IN $ids RETURN {EDGE_COLUMNS}",
+            {"ids": [node["id"] for node in page]},
+        )
+        graph["next_cursor"] = encode_cursor(page[-1]["id"]) if len(nodes) > limit else None
         return graph
 
+    def get_subgraph(self, entity_id, hops=1, max_nodes=GRAPH_MAX_NODES):
+        # One query per hop for the next frontier, then one each for the nodes and the edges between them
+        def neighbours(frontier):
+            q = """MATCH (n)--(m)
+                    WHERE elementId(n) IN $ids
+                    RETURN DISTINCT elementId(m) AS id"""
+            return [row["id"] for row in self._query(q, {"ids": frontier})]
+
+        ids = list(neighbourhood_ids(entity_id, neighbours, hops, max_nodes))
+        nodes = self._query(
+            "MATCH (n) WHERE elementId(n) IN $ids RETURN n, elementId(n) AS id, labels(n)[0] AS label",
+            {"ids": ids},
+        )
+        return self._scoped_graph(
+            nodes,
+            f"""MATCH (src)-[e]->(dest)
+                WHERE elementId(src) IN $ids AND elementId(dest) IN $ids
+                RETURN {EDGE_COLUMNS}""",
+            {"ids": ids},
+        )
+
+    def get_top_entities(self, limit=GRAPH_PAGE_SIZE, entity_type=None):
+        q = f"""MATCH (n{cypher_label(entity_type)})
+                RETURN n, elementId(n) AS id, labels(n)[0] AS label, COUNT {{ (n)--() }} AS degree
+                ORDER BY degree DESC
+                LIMIT $limit"""
+
+        nodes = self._query(q, {"limit": limit})
+        return self._scoped_graph(
+            nodes,
+            f"""MATCH (src)-[e]->(dest)
+                WHERE elementId(src) IN $ids AND elementId(dest) IN $ids
+                RETURN {EDGE_COLUMNS}""",
+            {"ids": [node["id"] for node in nodes]},
+        )
+
     def get_entity(self, entity_type, entity_id):
         q = f"""MATCH (n:{entity_type})
                 WHERE elementId(n) = $id
@@ -152,6 +252,90 @@ class Neo4jDBIntegration(DatabaseIntegration):
 
         return True
 
+    def add_relationships(self, relationships):
+        # Relationship types cannot be query parameters, so there is one UNWIND per type, all in one write transaction
+        rows_by_type = {}
+        for data in relationships:
+            edge_type = data["relationship"].strip().replace(" ", "_")
+            rows_by_type.setdefault(edge_type, []).append(
+                {"src_id": data["from_id"], "dest_id": data["to_id"]}
+            )
+        if not rows_by_type:
+            return []
+
+        queries = [
+            (
+                f"""UNWIND $rows AS row
+                MATCH (src), (dest)
+                WHERE elementId(src) = row.src_id AND elementId(dest) = row.dest_id
+                CREATE (src)-[:{edge_type}]->(dest)""",
+                {"rows": rows},
+            )
+            for edge_type, rows in rows_by_type.items()
+        ]
+        self._write_transaction(queries)
+
+        return [True for _ in relationships]
+
+    def find_relationship(self, data):
+        # One indexed match from the source node on the relationship type
+        edge_type = data["relationship"].strip().replace(" ", "_")
+        q = f"""MATCH (src)-[e:{edge_type}]->(dest)
+                WHERE elementId(src) = $src_id AND elementId(dest) = $dest_id
+                RETURN elementId(e) AS id, {EDGE_COLUMNS}
+                LIMIT 1"""
+
+        rows = self._query(q, {"src_id": data["from_id"], "dest_id": data["to_id"]})
+        if not rows:
+            return None
+        return {"id": rows[0]["id"], **relationship_desc(rows[0])}
+
+    def merge_relationship(self, data):
+        return self.merge_relationships([data])[0]
+
+    def merge_relationships(self, relationships):
+        # MERGE creates each (src, type, dest) edge only if it is missing; the OPTIONAL MATCH before it tells which
+        # rows created one. One UNWIND per type, all in one write transaction. Repeats of a key within the list are
+        # answered from its first occurrence, since one statement cannot see its own earlier MERGEs reliably. Rows whose
+        # endpoints do not exist come back as (None, False).
+        results = [(None, False)] * len(relationships)
+        first_position = {}  # (src_id, dest_id, edge type) -> position of its first occurrence
+        rows_by_type = {}
+        for position, data in enumerate(relationships):
+            edge_type = data["relationship"].strip().replace(" ", "_")
+            key = (data["from_id"], data["to_id"], edge_type)
+            if key in first_position:
+                continue
+            first_position[key] = position
+            rows_by_type.setdefault(edge_type, []).append(
+                {"position": position, "src_id": data["from_id"], "dest_id": data["to_id"]}
+            )
+        if not rows_by_type:
+            return results
+
+        queries = [
+            (
+                f"""UNWIND $rows AS row
+                MATCH (src), (dest)
+                WHERE elementId(src) = row.src_id AND elementId(dest) = row.dest_id
+                OPTIONAL MATCH (src)-[old:{edge_type}]->(dest)
+                WITH src, dest, row, count(old) = 0 AS created
+                MERGE (src)-[e:{edge_type}]->(dest)
+                RETURN row.position AS position, elementId(e) AS id, created""",
+                {"rows": rows},
+            )
+            for edge_type, rows in rows_by_type.items()
+        ]
+        for rows in self._write_transaction(queries):
+            for row in rows:
+                results[row["position"]] = (row["id"], row["created"])
+
+        for position, data in enumerate(relationships):
+            key = (data["from_id"], data["to_id"], data["relationship"].strip().replace(" ", "_"))
+            if position != first_position[key]:
+                results[position] = (results[first_position[key]][0], False)
+        return results
+
     def search_entities(self, search_params):
         search_params = remove_spaces(search_params)
         filters = " AND ".join([f"n.{key} = ${key}" for key in search_params])
@@ -207,11 +391,24 @@ class Neo4jDBIntegration(DatabaseIntegration):
                 node_id = node_result[0]["id"]
             else:
                 return []
+            where = "elementId(src) = $node_id OR elementId(dest) = $node_id"
+            params = {"node_id": node_id}
+        elif 'from_id' in search_params or 'to_id' in search_params:
+            # Relationships by endpoint, as conditional_relationship_addition searches them
+            conditions = []
+            params = {}
+            if 'from_id' in search_params:
+                conditions.append("elementId(src) = $from_id")
+                params["from_id"] = search_params["from_id"]
+            if 'to_id' in search_params:
+                conditions.append("elementId(dest) = $to_id")
+                params["to_id"] = search_params["to_id"]
+            where = " AND ".join(conditions)
         else:
             return []
 
         q = f"""MATCH (src)-[e]->(dest)
-                WHERE elementId(src) = $node_id OR elementId(dest) = $node_id
+                WHERE {where}
                 RETURN elementId(src) AS from_temp_id,
                     labels(src)[0] AS from_type,
                     type(e) AS relationship,
@@ -221,7 +418,7 @@ class Neo4jDBIntegration(DatabaseIntegration):
 
         print('Debug: query:', q)
         
-        edges = self._query(q, {"node_id": node_id})
+        edges = self._query(q, params)
 
         results = []
         for edge in edges:
@@ -246,9 +443,19 @@ class Neo4jDBIntegration(DatabaseIntegration):
         result = self._query(q)
         return [db["name"] for db in result]
 
+    def _write_transaction(self, queries):
+        # Run (cypher, params) pairs in a single managed write transaction (retried as a whole on transient errors)
+        def work(tx):
+            return [[r.data() for r in tx.run(cypher, params)] for cypher, params in queries]
+
+        selected_db = current_app.config.get("SELECTED_DB", self._database)
+        with self.session(selected_db) as session:
+            print("Using database:", selected_db)
+            return session.execute_write(work)
+
     def _query(self, cypher, params={}):
         selected_db = current_app.config.get("SELECTED_DB", self._database)
-        with self._driver.session(database=selected_db) as session:
+        with self.session(selected_db) as session:
             print("Using database:", selected_db)
             data = session.run(cypher, params)
             json_data = [r.data() for r in data]
@@ -0,0 +1,75 @@
+# Process-wide registry of Neo4j drivers.
+# A neo4j Driver owns a pool of Bolt connections and is meant to live as long as the process. Building one per request
+# (or per database switch) pays a TCP/Bolt handshake for every query and leaks the old pools. get_driver hands out one
+# shared driver per (URI, username, password); sessions for a particular database are opened from it with
+# driver.session(database=...). The pool size and how long a session waits for a free connection are configurable:
+# - NEO4J_MAX_POOL_SIZE: connections per driver (default 100, the driver's own default)
+# - NEO4J_ACQUISITION_TIMEOUT: seconds to wait for a pooled connection before failing (default 60)
+# - NEO4J_WARMUP_CONNECTIONS: connections to open up front when a driver is created (default 0, lazily)
+
+import atexit
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from neo4j import GraphDatabase
+
+NEO4J_MAX_POOL_SIZE = int(os.environ.get("NEO4J_MAX_POOL_SIZE", 100))
+NEO4J_ACQUISITION_TIMEOUT = float(os.environ.get("NEO4J_ACQUISITION_TIMEOUT", 60))
+NEO4J_WARMUP_CONNECTIONS = int(os.environ.get("NEO4J_WARMUP_CONNECTIONS", 0))
+
+_drivers = {}  # (uri, username, password) -> driver
+_drivers_lock = threading.Lock()
+
+
+def get_driver(uri, username, password, database=None):
+    # Return the shared driver for these credentials, creating (and optionally warming up) it on first use
+    key = (uri, username, password)
+    with _drivers_lock:
+        driver = _drivers.get(key)
+        if driver is not None:
+            return driver
+        print(f"Creating Neo4j driver for {uri} (pool size {NEO4J_MAX_POOL_SIZE})")
+        driver = GraphDatabase.driver(
+            uri,
+            auth=(username, password),
+            max_connection_pool_size=NEO4J_MAX_POOL_SIZE,
+            connection_acquisition_timeout=NEO4J_ACQUISITION_TIMEOUT,
+        )
+        _drivers[key] = driver
+
+    if NEO4J_WARMUP_CONNECTIONS > 0:
+        warm_up(driver, database, NEO4J_WARMUP_CONNECTIONS)
+    return driver
+
+
+def warm_up(driver, database=None, connections=1):
+    # Verify the server is reachable and open `connections` pooled connections, so the first requests after startup
+    # do not each pay for a handshake. Each session holds its connection until all of them are open; otherwise they
+    # would just take turns on one. A failure is reported but not raised: the app can start before the database does.
+    connections = min(connections, NEO4J_MAX_POOL_SIZE)
+    all_open = threading.Barrier(connections)
+
+    def open_connection(_):
+        with driver.session(database=database) as session:
+            session.run("RETURN 1").consume()
+            all_open.wait(timeout=NEO4J_ACQUISITION_TIMEOUT)
+
+    try:
+        driver.verify_connectivity()
+        with ThreadPoolExecutor(max_workers=connections) as executor:
+            list(executor.map(open_connection, range(connections)))
+        print(f"Warmed up {connections} Neo4j connections")
+    except Exception as e:
+        print(f"Neo4j warm-up failed: {e}")
+
+
+def close_drivers():
+    with _drivers_lock:
+        drivers = list(_drivers.values())
+        _drivers.clear()
+    for driver in drivers:
+        driver.close()
+
+
+atexit.register(close_drivers)
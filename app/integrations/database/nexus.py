@@ -16,8 +16,9 @@ from typeid import TypeID, get_prefix_and_suffix as typeid_prefix
 
 from nexus_python.nexusdb import NexusDB
 
+from ...schema_registry import get_schema
 from .base import DatabaseIntegration
-from .memory import InMemoryDatabase
+from .memory import InMemoryDatabase, entity_properties
 
 relation_prefix = os.environ.get("NEXUSDB_SCHEMA_PREFIX")
 if os.environ.get("NEXUSDB_USE_SHARED_GRAPH") == "True":
@@ -30,32 +31,24 @@ class NexusDBIntegration(InMemoryDatabase, DatabaseIntegration):
 
   def __init__(self, schema_file_path="schema.json"):
     self.nexus_db = NexusDB()  # Placeholder for NexusDB connection setup
-    self.schema = self._load_schema(schema_file_path)
+    self.compiled_schema = get_schema(schema_file_path)
+    self.schema = self.compiled_schema.schema
     self._ensure_db_schema()
-    self.graph = self._fetch_initial_graph()
-
-  def _load_schema(self, schema_file_path):
-    # Load and return the schema from the schema.json file
-    with open(schema_file_path, "r") as file:
-      schema = json.load(file)
-    return schema
+    graph = self._fetch_initial_graph()
+    self._load_graph(graph["entities"], graph["relationships"])
 
   def _ensure_db_schema(self):
     # Check existing database schema against the loaded schema
     print("Checking database schema...")
-    for node_type, details in self.schema.items():
+    for node_type, columns in self.compiled_schema.column_names.items():
       relation_name = f"{relation_prefix}_{node_type}"
       # print(f"Checking relation: {relation_name}")
       status = self.nexus_db.lookup(relation_name, fields=None, condition="")
       # print(f"Status: {status}\n\n")
 
       if status == "Error retrieving data from server":
-        # Convert details to fields format expected by NexusDB
-        edge_types = details.get("edge_types", {})
-        # Apply special character rules for each column name
-        fields = [{
-            "name": edge.replace("/", "_or_").replace(" ", "_")
-        } for edge in edge_types]
+        # Convert the schema's column names to the fields format expected by NexusDB
+        fields = [{"name": column} for column in columns]
 
         print(f"Creating relation: {relation_name} with columns: {fields}\n\n")
         create_relation = self.nexus_db.create(relation_name, fields)
@@ -71,14 +64,8 @@ class NexusDBIntegration(InMemoryDatabase, DatabaseIntegration):
           continue  # Skip to the next iteration if JSON is invalid
 
         existing_headers = status_dict.get("headers", [])
-        schema_fields = details.get("edge_types", {}).keys()
-        # Convert schema fields according to the naming rules applied when creating columns
-        schema_fields_converted = [
-            field.replace("/", "_or_").replace(" ", "_")
-            for field in schema_fields
-        ]
         missing_fields = [
-            field for field in schema_fields_converted
+            field for field in columns
             if field not in existing_headers
         ]
 
@@ -220,6 +207,7 @@ class NexusDBIntegration(InMemoryDatabase, DatabaseIntegration):
     if entity_type not in self.graph["entities"]:
       self.graph["entities"][entity_type] = {}
     self.graph["entities"][entity_type][entity_id] = data
+    self._index.add(entity_type, entity_id, entity_properties(data))
     # Update NexusDB
     actual_data = data["data"]
     relation = f"{relation_prefix}_{entity_type}"
@@ -244,6 +232,7 @@ class NexusDBIntegration(InMemoryDatabase, DatabaseIntegration):
     entities = self.graph["entities"].get(entity_type)
     if entities and entity_id in entities:
       entities[entity_id].update(data)
+      self._index.add(entity_type, entity_id, entity_properties(entities[entity_id]))
       # Update NexusDB
       actual_data = data[
           "data"]  # Assuming 'data' has a 'data' key with the actual update data
@@ -294,9 +283,10 @@ class NexusDBIntegration(InMemoryDatabase, DatabaseIntegration):
       return False
 
     # Update in-memory graph
-    self.graph["relationships"].append(data)
+    return self._link_relationship(data)
 
-    return len(self.graph["relationships"])
+  # Relationships are looked up in the in-memory copy, but new ones must go through add_relationship to reach NexusDB
+  merge_relationship = DatabaseIntegration.merge_relationship
 
   def delete_entity(self, entity_type, entity_id):
     entities = self.graph["entities"].get(entity_type)
@@ -304,13 +294,10 @@ class NexusDBIntegration(InMemoryDatabase, DatabaseIntegration):
     if entities and entity_id in entities:
       # Delete the entity from the entities dictionary
       del entities[entity_id]
+      self._index.remove(entity_type, entity_id)
 
-      # Filter out relationships involving the deleted entity
-      self.graph["relationships"] = [
-          relationship for relationship in self.graph["relationships"]
-          if relationship["from_id"] != entity_id
-          and relationship["to_id"] != entity_id
-      ]
+      # Drop relationships involving the deleted entity
+      self._unlink_entity(entity_id)
 
       # Update NexusDB
       relation = f"{relation_prefix}_{entity_type.title()}"
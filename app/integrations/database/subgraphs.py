@@ -0,0 +1,155 @@
+# Scoped reads of the graph for clients that cannot load all of it:
+# - a page of entities (cursor-paginated, optionally one entity type) with the relationships starting at them,
+# - the k-hop neighbourhood of one entity,
+# - the N entities with the most relationships (optionally one entity type) and the relationships between them.
+# Every result has the shape of get_full_graph, {"entities": {type: {id: entity}}, "relationships": [...]}, so the
+# front end renders it the same way; pages add "next_cursor" (None on the last page).
+# DatabaseIntegration implements all three on top of get_full_graph with the functions below; backends override them
+# with native queries. Cursors are opaque strings: backends put whatever position they need in them.
+# A page or a top-N list still ranks every entity of the requested types to find its entries (a bounded heap or a
+# Cypher ORDER BY ... LIMIT, O(n log limit)); only neighbourhoods cost in proportion to what they return.
+
+import base64
+import json
+import os
+
+GRAPH_PAGE_SIZE = int(os.environ.get("GRAPH_PAGE_SIZE", 200))
+GRAPH_MAX_PAGE_SIZE = int(os.environ.get("GRAPH_MAX_PAGE_SIZE", 5000))
+GRAPH_MAX_HOPS = int(os.environ.get("GRAPH_MAX_HOPS", 3))
+# Upper bound on the entities in a neighbourhood, however many hops were asked for
+GRAPH_MAX_NODES = int(os.environ.get("GRAPH_MAX_NODES", 1000))
+
+
+def encode_cursor(position):
+    return base64.urlsafe_b64encode(json.dumps(position).encode("utf8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except ValueError:
+        raise ValueError(f"Invalid cursor: {cursor}") from None
+
+
+def cypher_name(name):
+    # A label or relationship type as a quoted Cypher identifier
+    return "`" + name.replace("`", "``") + "`"
+
+
+def cypher_label(entity_type):
+    # The label part of a node pattern, (n{label}), for an optional entity type filter
+    return ":" + cypher_name(entity_type) if entity_type else ""
+
+
+def clamp(value, default, maximum, minimum=1):
+    # Query-string numbers: missing means default, anything else is kept within [minimum, maximum]
+    if value is None:
+        return default
+    return max(minimum, min(int(value), maximum))
+
+
+def empty_graph():
+    return {"entities": {}, "relationships": []}
+
+
+def add_to_graph(graph, entity_type, entity_id, entity):
+    graph["entities"].setdefault(entity_type, {})[entity_id] = entity
+
+
+def graph_page(full_graph, cursor=None, limit=GRAPH_PAGE_SIZE, entity_type=None):
+    # Offset pagination over the full graph's entity order; the relationships starting at each page's entities
+    # are returned with that page, so every relationship is returned exactly once over all pages
+    offset = decode_cursor(cursor) or 0
+    entities = [
+        (current_type, entity_id, entity)
+        for current_type, entities_of_type in full_graph["entities"].items()
+        if entity_type is None or current_type == entity_type
+        for entity_id, entity in entities_of_type.items()
+    ]
+    page = entities[offset:offset + limit]
+
+    graph = empty_graph()
+    ids = set()
+    for current_type, entity_id, entity in page:
+        add_to_graph(graph, current_type, entity_id, entity)
+        ids.add(str(entity_id))
+    graph["relationships"] = [
+        relationship for relationship in full_graph["relationships"]
+        if relationship is not None and str(relationship.get("from_id")) in ids
+    ]
+    graph["next_cursor"] = encode_cursor(offset + limit) if offset + limit < len(entities) else None
+    return graph
+
+
+def induced_subgraph(full_graph, ids):
+    # The entities with the given IDs (as strings) and the relationships between them
+    graph = empty_graph()
+    for entity_type, entities in full_graph["entities"].items():
+        for entity_id, entity in entities.items():
+            if str(entity_id) in ids:
+                add_to_graph(graph, entity_type, entity_id, entity)
+    graph["relationships"] = [
+        relationship for relationship in full_graph["relationships"]
+        if relationship is not None
+        and str(relationship.get("from_id")) in ids and str(relationship.get("to_id")) in ids
+    ]
+    return graph
+
+
+def neighbourhood_ids(start_id, neighbours, hops, max_nodes=GRAPH_MAX_NODES):
+    # Breadth-first search from start_id, following neighbours(frontier) -> iterable of IDs, for up to `hops` hops and
+    # at most max_nodes entities. IDs are compared as strings; returns the set of visited IDs.
+    visited = {str(start_id)}
+    frontier = [start_id]
+    for _ in range(hops):
+        next_frontier = []
+        for neighbour in neighbours(frontier):
+            if str(neighbour) not in visited:
+                if len(visited) >= max_nodes:
+                    return visited
+                visited.add(str(neighbour))
+                next_frontier.append(neighbour)
+        if not next_frontier:
+            break
+        frontier = next_frontier
+    return visited
+
+
+def subgraph(full_graph, entity_id, hops=1, max_nodes=GRAPH_MAX_NODES):
+    adjacency = {}
+    for relationship in full_graph["relationships"]:
+        if relationship is None:
+            continue
+        from_id, to_id = str(relationship.get("from_id")), str(relationship.get("to_id"))
+        adjacency.setdefault(from_id, []).append(to_id)
+        adjacency.setdefault(to_id, []).append(from_id)
+
+    def neighbours(frontier):
+        for node_id in frontier:
+            yield from adjacency.get(str(node_id), ())
+
+    return induced_subgraph(full_graph, neighbourhood_ids(entity_id, neighbours, hops, max_nodes))
+
+
+def top_entities(full_graph, limit, entity_type=None):
+    degree = {}
+    for relationship in full_graph["relationships"]:
+        if relationship is None:
+            continue
+        for key in ("from_id", "to_id"):
+            node_id = str(relationship.get(key))
+            degree[node_id] = degree.get(node_id, 0) + 1
+    ranked = sorted(
+        (
+            str(entity_id)
+            for current_type, entities in full_graph["entities"].items()
+            if entity_type is None or current_type == entity_type
+            for entity_id in entities
+        ),
+        key=lambda node_id: degree.get(node_id, 0),
+        reverse=True,
+    )
+    return induced_subgraph(full_graph, set(ranked[:limit]))
+
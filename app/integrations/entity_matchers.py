@@ -0,0 +1,149 @@
+# Deterministic matcher stage in front of the model for entity deduplication (see conditional_entity_addition).
+# Each matcher looks at a new entity payload ({"entity_type", "data"}) and its search candidates and either settles
+# the case, returning (MATCH, candidate ID) or (NEW, None), or returns None to leave it to the next matcher and, in the
+# end, to the model. The built-in matchers, in order:
+# - no_candidates: nothing was found, so the entity is new.
+# - exact_name: exactly one candidate has the same normalized name (case, accents, punctuation and spacing ignored).
+# - token_similarity: token-set (Jaccard) similarity of the names. The single best candidate at or above
+#   MATCHER_MATCH_THRESHOLD is a match; if every candidate is below MATCHER_NEW_THRESHOLD the entity is new. The
+#   default new-threshold of 0 never settles a non-match this way, since names such as "EA" and "Electronic Arts" share
+#   no tokens; raise it for data where names are reliable.
+# ENTITY_MATCHERS lists the matchers to run, in order; a name that is not a built-in matcher fails the import with a
+# ValueError rather than the first deduplication. register_matcher adds new ones, which run when passed to prefilter
+# in `matchers` or appended to ACTIVE_MATCHERS. matcher_stats counts how many entities each matcher settled (hits)
+# and how many were left to the model (misses): every hit is one model call, or one entity in a batched call, saved.
+
+import os
+import re
+import threading
+import unicodedata
+
+MATCH = "match"
+NEW = "new"
+
+MATCHER_MATCH_THRESHOLD = float(os.environ.get("MATCHER_MATCH_THRESHOLD", 1.0))
+MATCHER_NEW_THRESHOLD = float(os.environ.get("MATCHER_NEW_THRESHOLD", 0.0))
+ENTITY_MATCHERS = os.environ.get("ENTITY_MATCHERS", "no_candidates,exact_name,token_similarity")
+
+NAME_FIELDS = ("name", "term")
+
+MATCHERS = {}
+
+
+def register_matcher(name):
+    def register(matcher):
+        MATCHERS[name] = matcher
+        return matcher
+    return register
+
+
+def entity_name(properties):
+    for field in NAME_FIELDS:
+        value = properties.get(field)
+        if isinstance(value, str) and value.strip():
+            return value
+    return None
+
+
+def normalize_name(name):
+    # "  Électronic-Arts, Inc. " -> "electronic arts inc"
+    name = unicodedata.normalize("NFKD", name)
+    name = "".join(c for c in name if not unicodedata.combining(c))
+    return " ".join(re.sub(r"[^\w\s]", " ", name.lower()).split())
+
+
+def token_set_similarity(a, b):
+    tokens_a = set(normalize_name(a).split())
+    tokens_b = set(normalize_name(b).split())
+    if not tokens_a or not tokens_b:
+        return 0.0
+    return len(tokens_a & tokens_b) / len(tokens_a | tokens_b)
+
+
+@register_matcher("no_candidates")
+def no_candidates(payload, candidates):
+    if not candidates:
+        return NEW, None
+    return None
+
+
+@register_matcher("exact_name")
+def exact_name(payload, candidates):
+    name = entity_name(payload.get("data", {}))
+    if name is None:
+        return None
+    name = normalize_name(name)
+    same = [candidate for candidate in candidates if normalize_name(entity_name(candidate) or "") == name]
+    if len(same) == 1:
+        return MATCH, same[0]["id"]
+    return None
+
+
+@register_matcher("token_similarity")
+def token_similarity(payload, candidates):
+    name = entity_name(payload.get("data", {}))
+    if name is None:
+        return None
+    scores = sorted(
+        ((token_set_similarity(name, entity_name(candidate) or ""), candidate["id"]) for candidate in candidates),
+        key=lambda score: score[0],
+        reverse=True,
+    )
+    if not scores:
+        return None
+    best_score, best_id = scores[0]
+    runner_up = scores[1][0] if len(scores) > 1 else None
+    if best_score >= MATCHER_MATCH_THRESHOLD and runner_up != best_score:
+        return MATCH, best_id
+    if best_score < MATCHER_NEW_THRESHOLD:
+        return NEW, None
+    return None
+
+
+class MatcherStats:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.settled = {}  # matcher name -> entities it settled
+        self.sent_to_model = 0
+
+    def record(self, matcher_name):
+        # matcher_name is None when no matcher settled the entity and the model has to decide
+        with self._lock:
+            if matcher_name is None:
+                self.sent_to_model += 1
+            else:
+                self.settled[matcher_name] = self.settled.get(matcher_name, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "settled_locally": sum(self.settled.values()),
+                "sent_to_model": self.sent_to_model,
+                "settled_by": dict(self.settled),
+            }
+
+
+matcher_stats = MatcherStats()
+
+
+def check_matchers(names):
+    unknown = [name for name in names if name not in MATCHERS]
+    if unknown:
+        raise ValueError(f"Unknown entity matchers {unknown}; known matchers are {sorted(MATCHERS)}")
+    return names
+
+
+ACTIVE_MATCHERS = check_matchers([name.strip() for name in ENTITY_MATCHERS.split(",") if name.strip()])
+
+
+def prefilter(payload, candidates, matchers=None):
+    # Run the active matchers in order; returns (MATCH, ID) or (NEW, None), or None when the model has to decide
+    names = ACTIVE_MATCHERS if matchers is None else check_matchers(matchers)
+    for name in names:
+        decision = MATCHERS[name](payload, candidates)
+        if decision is not None:
+            matcher_stats.record(name)
+            return decision
+    matcher_stats.record(None)
+    return None
@@ -1,6 +1,6 @@
-import openai
 from flask import jsonify
 from app.integration_manager import get_integration_function
+from app.llm_cache import chat_completion
 
 
 def latent_input(app, data):
@@ -12,7 +12,7 @@ def latent_input(app, data):
         try:
             # OpenAI Chat Completion request
             print(f"User input: {user_input}")
-            response = openai.ChatCompletion.create(
+            response = chat_completion(
                 model="gpt-3.5-turbo",
                 messages=[
                     {"role": "system", "content": "You are an AI who writes long and detailed answers describing all entities (people, organizations, events, concepts) and their relationships based on a given input. Include as many entities and relationships as possible in your answer. The relationships described should always include two clear parties. Be as comprehensive as possible including as much of your available knowledge in the answer, never discluding anything that you know about. Make sure to specify as many relationships as possible, and not just the entities. Every entity should be connected to another entity through at least one path."},
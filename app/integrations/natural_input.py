@@ -57,58 +57,41 @@
 # operational context, leveraging the `add_multiple_conditional_function` for dynamic data integration based on AI-generated content.
 
 from flask import Flask, request, jsonify
-import openai
 import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
 from app.integration_manager import get_integration_function
+from app.integrations.entity_matchers import normalize_name
+from app.llm_cache import chat_completion
+from app.schema_registry import get_schema
 
 app = Flask(__name__)
 
+# Long inputs (a scraped page's text_body, or a plain text input) are split into chunks of about
+# NATURAL_INPUT_CHUNK_CHARS characters on paragraph and sentence boundaries, each chunk starting with the last
+# NATURAL_INPUT_CHUNK_OVERLAP characters of sentences of the previous one so relationships spanning a boundary are
+# still seen together. The chunks are extracted concurrently (NATURAL_INPUT_MAX_WORKERS at a time) and their graphs are
+# merged into one before add_multiple_conditional: entities with the same type and normalized name become one entity,
+# temp_ids are renumbered so they cannot collide across chunks, and repeated relationships are dropped.
+NATURAL_INPUT_CHUNK_CHARS = int(os.environ.get("NATURAL_INPUT_CHUNK_CHARS", 8000))
+NATURAL_INPUT_CHUNK_OVERLAP = int(os.environ.get("NATURAL_INPUT_CHUNK_OVERLAP", 600))
+NATURAL_INPUT_MAX_WORKERS = int(os.environ.get("NATURAL_INPUT_MAX_WORKERS", 4))
+
 
 def create_knowledge_graph(app, natural_input):
     with app.app_context():
         try:
             print("start openai call")
 
-            with open("schema.json", "r") as file:
-                schema = json.load(file)
-
-            nodes_properties = {}
-            node_types = []
-            all_edge_types = set()
-
-            for node_type, info in schema.items():
-                all_edge_types.update(info["edge_types"].keys())
-                node_types.append(info["node_type"])  # Collect node types
-                edges = list(info["edge_types"].keys())
-                properties = {
-                    "temp_id": {"type": "integer"},
-                    "name": {"type": "string"},
-                }
-
-                # Add additional properties based on the schema
-                for edge_type, description in info["edge_types"].items():
-                    properties[edge_type] = {
-                        "type": "string",
-                        "description": description,
-                    }
-
-                nodes_properties[node_type] = {
-                    "type": "array",
-                    "items": {
-                        "type": "object",
-                        "properties": properties,
-                        "required": ["temp_id", "name"],
-                    },
-                }
-
-            edges = list(all_edge_types)
-            # print(f"edges: {edges}\n")
+            # Loaded, validated and compiled once, reloaded only when schema.json changes
+            extraction_function = get_schema().extraction_function
 
         except Exception as e:
             print(f"Error during knowledge graph creation: {e}")
             return jsonify({"error": str(e)}), 500
 
-        completion = openai.ChatCompletion.create(
+        completion = chat_completion(
             model="gpt-4-0125-preview",
             messages=[
                 {
@@ -135,60 +118,7 @@ def create_knowledge_graph(app, natural_input):
                     "content": f"Help me understand the following by creating a structured knowledge graph: {natural_input}",
                 },
             ],
-            functions=[
-                {
-                    "name": "knowledge_graph",
-                    "description": f"Generate a knowledge graph with entities and relationships. Node types must be in {node_types}. Do your best to capture relationships. Do not abbreviate anything. Do not provide a response that is not part of the JSON.",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "nodes": {
-                                "type": "object",
-                                "properties": nodes_properties,
-                            },
-                            "relationships": {
-                                "type": "array",
-                                "items": {
-                                    "type": "object",
-                                    "properties": {
-                                        "from_type": {
-                                            "type": "string",
-                                        },
-                                        "from_temp_id": {"type": "integer"},
-                                        "to_type": {
-                                            "type": "string",
-                                        },
-                                        "to_temp_id": {"type": "integer"},
-                                        "data": {
-                                            "type": "object",
-                                            "properties": {
-                                                "relationship": {
-                                                    "type": "string",
-                                                    "description": "Detailed relationship information between the two properties.",
-                                                    "enum": edges,
-                                                },
-                                                "snippet": {
-                                                    "type": "string",
-                                                    "description": "Provide a snippet from the source word for word (either one or more full sentences) describing this relationship between the two entities.",
-                                                },
-                                            },
-                                            "required": ["relationship", "snippet"],
-                                        },
-                                    },
-                                    "required": [
-                                        "from_type",
-                                        "from_temp_id",
-                                        "to_type",
-                                        "to_temp_id",
-                                        "data",
-                                    ],
-                                },
-                            },
-                        },
-                        "required": ["nodes", "relationships"],
-                    },
-                }
-            ],
+            functions=[extraction_function],
             function_call={"name": "knowledge_graph"},
         )
         print("OPENAI END")
@@ -199,12 +129,136 @@ def create_knowledge_graph(app, natural_input):
         return response_data
 
 
+def split_text(text, max_chars=NATURAL_INPUT_CHUNK_CHARS, overlap=NATURAL_INPUT_CHUNK_OVERLAP):
+    # Paragraphs, then sentences, then (for a sentence longer than a chunk) plain slices
+    sentences = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        for sentence in re.split(r"(?<=[.!?])\s+", paragraph.strip()):
+            while len(sentence) > max_chars:
+                sentences.append(sentence[:max_chars])
+                sentence = sentence[max_chars:]
+            if sentence:
+                sentences.append(sentence)
+
+    chunks = []
+    current = []
+    size = 0
+    for sentence in sentences:
+        if current and size + len(sentence) > max_chars:
+            chunks.append(" ".join(current))
+            # Carry the last sentences of this chunk over, up to overlap characters
+            carried = []
+            carried_size = 0
+            for previous in reversed(current):
+                if carried_size + len(previous) > overlap:
+                    break
+                carried.insert(0, previous)
+                carried_size += len(previous) + 1
+            current = carried
+            size = carried_size
+        current.append(sentence)
+        size += len(sentence) + 1
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+
+def chunk_inputs(data):
+    # The inputs to extract separately: data itself when it is short, otherwise one copy of it per chunk of its text
+    # (the text_body of a scraped page, or the natural_input text)
+    natural = data.get("natural_input") if isinstance(data, dict) else None
+    if isinstance(natural, dict) and isinstance(natural.get("text_body"), str):
+        text = natural["text_body"]
+
+        def with_text(chunk):
+            return {**data, "natural_input": {**natural, "text_body": chunk}}
+    elif isinstance(natural, str):
+        text = natural
+
+        def with_text(chunk):
+            return {**data, "natural_input": chunk}
+    else:
+        return [data]
+    if len(text) <= NATURAL_INPUT_CHUNK_CHARS:
+        return [data]
+    return [with_text(chunk) for chunk in split_text(text)]
+
+
+def merge_graphs(graphs):
+    # One add_multiple_conditional payload out of several extracted graphs
+    merged = {"nodes": {}, "relationships": []}
+    by_name = {}  # (entity type, normalized name) -> merged entity
+    seen_relationships = set()
+    next_temp_id = 1
+    for graph in graphs:
+        temp_ids = {}  # this graph's temp_id -> (entity type, merged temp_id)
+        for entity_type, entities in (graph.get("nodes") or {}).items():
+            for entity in entities or []:
+                name = str(entity.get("name", "")).strip()
+                key = (entity_type, normalize_name(name)) if name else None
+                existing = by_name.get(key) if key else None
+                if existing is None:
+                    existing = {**entity, "temp_id": next_temp_id}
+                    next_temp_id += 1
+                    merged["nodes"].setdefault(entity_type, []).append(existing)
+                    if key:
+                        by_name[key] = existing
+                else:
+                    # Keep the first chunk's values, filling in properties only later chunks found
+                    for field, value in entity.items():
+                        existing.setdefault(field, value)
+                temp_ids[entity.get("temp_id")] = (entity_type, existing["temp_id"])
+
+        for relationship in graph.get("relationships") or []:
+            source = temp_ids.get(relationship.get("from_temp_id"))
+            target = temp_ids.get(relationship.get("to_temp_id"))
+            if source is None or target is None:
+                print(f"Dropping relationship with an unknown entity: {relationship}")
+                continue
+            relationship_data = relationship.get("data") or {}
+            key = (source, target, relationship_data.get("relationship"))
+            if key in seen_relationships:
+                continue
+            seen_relationships.add(key)
+            merged["relationships"].append({
+                **relationship,
+                "from_type": source[0],
+                "from_temp_id": source[1],
+                "to_type": target[0],
+                "to_temp_id": target[1],
+            })
+    return merged
+
+
+def extract_graph(app, data):
+    knowledge_graph_data = create_knowledge_graph(app, data)
+    if not isinstance(knowledge_graph_data, str):
+        # create_knowledge_graph answered with an error response
+        raise ValueError("Knowledge graph extraction failed")
+    return json.loads(knowledge_graph_data)
+
+
 def natural_input(app, data):
     with app.app_context():
         try:
-            # Assume create_knowledge_graph returns the correct data structure
-            knowledge_graph_data = create_knowledge_graph(app, data)
-            knowledge_graph_data = json.loads(knowledge_graph_data)
+            # Extract each chunk of the input concurrently, then merge the graphs into one
+            inputs = chunk_inputs(data)
+            if len(inputs) == 1:
+                knowledge_graph_data = extract_graph(app, inputs[0])
+            else:
+                print(f"Extracting {len(inputs)} chunks")
+                with ThreadPoolExecutor(max_workers=min(NATURAL_INPUT_MAX_WORKERS, len(inputs))) as executor:
+                    extractions = [executor.submit(extract_graph, app, chunk) for chunk in inputs]
+                graphs = []
+                for number, extraction in enumerate(extractions):
+                    if extraction.exception() is not None:
+                        # A failed chunk only loses its own part of the graph
+                        print(f"Chunk {number} failed: {extraction.exception()}")
+                    else:
+                        graphs.append(extraction.result())
+                if not graphs:
+                    raise extractions[0].exception()
+                knowledge_graph_data = merge_graphs(graphs)
             # Retrieve the callable function for the add_multiple_conditional integration
             print("get function")
             add_multiple_conditional_function = get_integration_function(
@@ -1,8 +1,14 @@
 # Used for the csv input, which sends an array of URLs to this function, which splits up and sends to the url_input function which is loaded with the integration manager.
 
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from flask import jsonify
 from urllib.parse import urlparse, quote
 from app.integration_manager import get_integration_function
+from app.jobs import in_current_job
+
+URL_ARRAY_WORKERS = int(os.environ.get("URL_ARRAY_WORKERS", 4))
 
 # Function to check if a string is a valid URL
 def is_valid_url(url):
@@ -12,7 +18,10 @@ def is_valid_url(url):
     except ValueError:
         return False
 
-# Updated integration function to process an array of URLs using the Integration Manager
+# Each URL goes through the url_input integration (download, then natural_input extraction), up to URL_ARRAY_WORKERS
+# URLs at a time, so one page downloads while another is being extracted. Downloads share url_input's pooled session,
+# so each host still gets at most URL_FETCH_PER_HOST connections. Inside a job, every url_input call (and what it calls)
+# is recorded as a stage of the job. The response lists how long each URL took and its status code.
 def url_array_processor(app, data):
     with app.app_context():
         print("URL Array Processor Integration")
@@ -20,30 +29,45 @@ def url_array_processor(app, data):
     
         results = []
         errors = []
+        timings = []
     
         # Retrieve the url_input integration function
         url_input_function = get_integration_function('url_input')
     
         if not url_input_function:
             return jsonify({"error": "url_input integration not found"}), 404
-    
+
+        valid_urls = []
         for url in urls:
             if is_valid_url(url):
+                valid_urls.append(url)
+            else:
+                errors.append(f"Invalid URL: {url}")
+
+        def process(url):
+            started = time.perf_counter()
+            try:
                 # Encode the URL
-                encoded_url = quote(url, safe='')
-                url_input_data = {'natural_input': encoded_url}
-    
-                # Dynamically call the url_input function
-                response, status_code = url_input_function(app, url_input_data)
+                response, status_code = url_input_function(app, {'natural_input': quote(url, safe='')})
+            except Exception as e:
+                response, status_code = None, str(e)
+            return response, status_code, round(time.perf_counter() - started, 3)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(1, min(URL_ARRAY_WORKERS, len(valid_urls)))) as executor:
+            processed = {executor.submit(in_current_job(process), url): url for url in valid_urls}
+            for future in as_completed(processed):
+                url = processed[future]
+                response, status_code, seconds = future.result()
+                timings.append({"url": url, "seconds": seconds, "status_code": status_code})
     
                 if status_code == 200:
                     results.append(response)
                 else:
                     errors.append(f"Failed to process URL {url}: Status Code {status_code}")
-            else:
-                errors.append(f"Invalid URL: {url}")
-    
-        return jsonify({"results": "success", "errors": errors}), 200
+
+        print(f"Processed {len(valid_urls)} URLs in {time.perf_counter() - started:.1f}s")
+        return jsonify({"results": "success", "errors": errors, "timings": timings}), 200
 
 # Function to register this integration with the IntegrationManager
 def register(integration_manager):
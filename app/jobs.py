@@ -0,0 +1,207 @@
+# Background jobs for long-running integrations (url_array_processor, url_input, natural_input, latent_input, ...).
+# POST /jobs/<integration_name> queues the integration with the request body and answers 202 with a job ID right away;
+# a pool of JOB_WORKERS threads runs the queued jobs, calling the integration function exactly as /trigger-integration
+# does, so integrations need no changes to run as jobs. GET /jobs/<job_id> reports the job's status and stages, and
+# GET /jobs/<job_id>/result answers with the integration's own response and status code once it has finished.
+# - Stages: while a job runs, every integration it calls through get_integration_function (url_array_processor ->
+#   url_input -> natural_input -> add_multiple_conditional) is recorded as a stage with its status and timings, also
+#   when an integration calls others from a thread pool through in_current_job (url_array_processor's url_input calls).
+# - Backpressure: at most JOB_QUEUE_SIZE jobs wait in the queue; past that, submit raises JobQueueFull and the endpoint
+#   answers 429, so a burst of uploads cannot pile up unbounded work.
+# - Only the last JOB_RETAIN finished jobs are kept. Jobs live in this process: they are lost on restart, and with
+#   several worker processes a job's status is only known to the process that accepted it.
+
+import collections
+import os
+import queue
+import threading
+import time
+import uuid
+
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 4))
+JOB_QUEUE_SIZE = int(os.environ.get("JOB_QUEUE_SIZE", 32))
+JOB_RETAIN = int(os.environ.get("JOB_RETAIN", 500))
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+class JobQueueFull(Exception):
+  pass
+
+
+def response_body(response):
+  # (JSON body, status code) of what an integration returned: a Flask response, optionally with a status code
+  status_code = None
+  if isinstance(response, tuple):
+    response, status_code = response[0], response[1]
+  if hasattr(response, "get_json"):
+    return response.get_json(silent=True), status_code or response.status_code
+  return response, status_code or 200
+
+
+class Job:
+
+  def __init__(self, integration_name, function, data):
+    self.id = uuid.uuid4().hex
+    self.integration_name = integration_name
+    self.function = function
+    self.data = data
+    self.status = QUEUED
+    self.stages = []
+    self.result = None
+    self.status_code = None
+    self.error = None
+    self.created = time.time()
+    self.started = None
+    self.finished = None
+
+  def to_dict(self, include_result=False):
+    job = {
+        "id": self.id,
+        "integration": self.integration_name,
+        "status": self.status,
+        "stages": [dict(stage) for stage in self.stages],
+        "created": self.created,
+        "started": self.started,
+        "finished": self.finished,
+        "error": self.error,
+    }
+    if include_result:
+      job["result"] = self.result
+      job["status_code"] = self.status_code
+    return job
+
+
+_current = threading.local()
+
+
+def current_job():
+  # The job running on this thread, or None outside of jobs
+  return getattr(_current, "job", None)
+
+
+def in_current_job(function):
+  # function, run as part of the current job when another thread calls it (for integrations that fan out to a thread
+  # pool), so the integrations it calls are recorded as stages of the job too
+  job = current_job()
+  if job is None:
+    return function
+
+  def run_in_job(*args, **kwargs):
+    _current.job = job
+    try:
+      return function(*args, **kwargs)
+    finally:
+      _current.job = None
+
+  return run_in_job
+
+
+def tracked(integration_name, function):
+  # The integration function, recording each call as a stage of the current job
+  job = current_job()
+  if job is None or function is None:
+    return function
+
+  def run_stage(app, data):
+    stage = {"stage": integration_name, "status": RUNNING, "started": time.time(), "finished": None}
+    job.stages.append(stage)
+    try:
+      response = function(app, data)
+    except Exception:
+      stage["status"] = FAILED
+      raise
+    finally:
+      stage["finished"] = time.time()
+    status_code = response_body(response)[1]
+    stage["status"] = SUCCEEDED if status_code < 400 else FAILED
+    stage["status_code"] = status_code
+    return response
+
+  return run_stage
+
+
+class JobQueue:
+
+  def __init__(self, app, workers=JOB_WORKERS, max_queued=JOB_QUEUE_SIZE, retain=JOB_RETAIN):
+    self.app = app
+    self.retain = retain
+    self._queue = queue.Queue(maxsize=max_queued)
+    self._jobs = collections.OrderedDict()  # job ID -> Job, oldest first
+    self._lock = threading.Lock()
+    self._threads = [
+        threading.Thread(target=self._work, name=f"job-worker-{n}", daemon=True) for n in range(workers)
+    ]
+    for thread in self._threads:
+      thread.start()
+
+  def submit(self, integration_name, function, data):
+    job = Job(integration_name, function, data)
+    with self._lock:
+      try:
+        self._queue.put_nowait(job)
+      except queue.Full:
+        raise JobQueueFull(f"{self._queue.maxsize} jobs are already waiting") from None
+      self._jobs[job.id] = job
+      self._forget_finished()
+    print(f"Job {job.id} queued: {integration_name}")
+    return job
+
+  def get(self, job_id):
+    with self._lock:
+      return self._jobs.get(job_id)
+
+  def stats(self):
+    with self._lock:
+      counts = collections.Counter(job.status for job in self._jobs.values())
+    return {"queued": self._queue.qsize(), "capacity": self._queue.maxsize, "workers": len(self._threads),
+            "jobs": dict(counts)}
+
+  def _forget_finished(self):
+    finished = [job_id for job_id, job in self._jobs.items() if job.status in (SUCCEEDED, FAILED)]
+    for job_id in finished[:max(0, len(finished) - self.retain)]:
+      del self._jobs[job_id]
+
+  def _work(self):
+    while True:
+      job = self._queue.get()
+      self._run(job)
+      self._queue.task_done()
+
+  def _run(self, job):
+    job.status = RUNNING
+    job.started = time.time()
+    _current.job = job
+    try:
+      with self.app.app_context():
+        response = tracked(job.integration_name, job.function)(self.app, job.data)
+        job.result, job.status_code = response_body(response)
+      job.status = SUCCEEDED if job.status_code < 400 else FAILED
+    except Exception as e:
+      print(f"Job {job.id} failed: {e}")
+      job.error = str(e)
+      job.status_code = 500
+      job.status = FAILED
+    finally:
+      _current.job = None
+      job.data = None
+      # Logged before the job is marked finished, so nothing is printed for it once a poller has seen it finish
+      finished = time.time()
+      print(f"Job {job.id} {job.status} in {finished - job.started:.1f}s")
+      job.finished = finished
+
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue(app):
+  # The process-wide job queue, started on first use
+  global _job_queue
+  with _job_queue_lock:
+    if _job_queue is None:
+      _job_queue = JobQueue(app)
+    return _job_queue
@@ -0,0 +1,159 @@
+# Disk-backed cache for OpenAI chat completions and embeddings, shared by every integration (and kg_selection).
+# Results are stored in a SQLite file under a content-addressed key: the SHA-256 of the call kind, the model and every
+# request parameter (messages included), so the same request is answered locally however it was reached. Entries
+# expire LLM_CACHE_TTL seconds after they were written (0 keeps them until evicted), and once the stored values pass
+# LLM_CACHE_MAX_BYTES the least recently used entries are evicted. SQLite runs in WAL mode, so several worker processes
+# can share one file.
+# - LLM_CACHE_PATH: the cache file (default .cache/llm_cache.sqlite3); empty disables caching
+# - LLM_CACHE_TTL: seconds an entry stays valid (default 30 days)
+# - LLM_CACHE_MAX_BYTES: total size of the cached values before LRU eviction (default 256MB)
+# chat_completion(**kwargs) and embedding(text, model) are drop-in replacements for openai.ChatCompletion.create and
+# openai.embeddings_utils.get_embedding; pass cache=False to chat_completion for a call that must not be reused.
+
+import array
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import openai
+from openai.util import convert_to_openai_object
+
+LLM_CACHE_PATH = os.environ.get("LLM_CACHE_PATH", os.path.join(".cache", "llm_cache.sqlite3"))
+LLM_CACHE_TTL = float(os.environ.get("LLM_CACHE_TTL", 30 * 24 * 3600))
+LLM_CACHE_MAX_BYTES = int(os.environ.get("LLM_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+# Writes between checks of the total size
+LLM_CACHE_EVICT_EVERY = 64
+
+
+def cache_key(kind, **params):
+  canonical = json.dumps({"kind": kind, **params}, sort_keys=True, separators=(",", ":"), default=str)
+  return hashlib.sha256(canonical.encode("utf8")).hexdigest()
+
+
+class LLMCache:
+
+  def __init__(self, path, ttl=LLM_CACHE_TTL, max_bytes=LLM_CACHE_MAX_BYTES):
+    self.ttl = ttl
+    self.max_bytes = max_bytes
+    self.hits = 0
+    self.misses = 0
+    self._writes = 0
+    self._lock = threading.Lock()
+
+    directory = os.path.dirname(path)
+    if directory:
+      os.makedirs(directory, exist_ok=True)
+    self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    self._db.execute("PRAGMA journal_mode=WAL")
+    self._db.execute("PRAGMA synchronous=NORMAL")
+    self._db.execute("""CREATE TABLE IF NOT EXISTS entries (
+                          key TEXT PRIMARY KEY,
+                          value BLOB NOT NULL,
+                          size INTEGER NOT NULL,
+                          created REAL NOT NULL,
+                          accessed REAL NOT NULL)""")
+    self._db.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+
+  def get(self, key):
+    # The cached bytes, or None on a miss (an expired entry is a miss and is dropped)
+    now = time.time()
+    with self._lock:
+      row = self._db.execute("SELECT value, created FROM entries WHERE key = ?", (key,)).fetchone()
+      if row is not None and self.ttl and now - row[1] > self.ttl:
+        self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+        row = None
+      if row is None:
+        self.misses += 1
+        return None
+      self._db.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+      self.hits += 1
+      return row[0]
+
+  def put(self, key, value):
+    now = time.time()
+    with self._lock:
+      self._db.execute(
+          "INSERT OR REPLACE INTO entries (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+          (key, value, len(value), now, now))
+      self._writes += 1
+      if self._writes % LLM_CACHE_EVICT_EVERY == 0:
+        self._evict()
+
+  def evict(self):
+    with self._lock:
+      self._evict()
+
+  def _evict(self):
+    # Drop expired entries, then the least recently used ones until the values fit in max_bytes
+    if self.ttl:
+      self._db.execute("DELETE FROM entries WHERE created < ?", (time.time() - self.ttl,))
+    total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+    if total <= self.max_bytes:
+      return
+    freed = 0
+    doomed = []
+    # rowid breaks ties between entries touched within the clock's resolution
+    for key, size in self._db.execute("SELECT key, size FROM entries ORDER BY accessed, rowid"):
+      doomed.append((key,))
+      freed += size
+      if total - freed <= self.max_bytes:
+        break
+    self._db.executemany("DELETE FROM entries WHERE key = ?", doomed)
+    print(f"LLM cache: evicted {len(doomed)} entries ({freed} bytes)")
+
+  def stats(self):
+    with self._lock:
+      count, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+      return {"hits": self.hits, "misses": self.misses, "entries": count, "bytes": size}
+
+  def close(self):
+    with self._lock:
+      self._db.close()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+  # The process-wide cache, opened on first use; None when LLM_CACHE_PATH is empty
+  global _cache
+  if not LLM_CACHE_PATH:
+    return None
+  with _cache_lock:
+    if _cache is None:
+      _cache = LLMCache(LLM_CACHE_PATH)
+    return _cache
+
+
+def chat_completion(cache=True, **kwargs):
+  llm_cache = get_cache() if cache else None
+  if llm_cache is None:
+    return openai.ChatCompletion.create(**kwargs)
+
+  key = cache_key("chat", **kwargs)
+  cached = llm_cache.get(key)
+  if cached is not None:
+    return convert_to_openai_object(json.loads(cached))
+  response = openai.ChatCompletion.create(**kwargs)
+  llm_cache.put(key, json.dumps(response.to_dict_recursive()).encode("utf8"))
+  return response
+
+
+def embedding(text, model="text-embedding-ada-002"):
+  # Embeddings are stored as packed doubles rather than JSON text, which is well under half the size
+  text = text.replace("\n", " ")
+  llm_cache = get_cache()
+  key = cache_key("embedding", model=model, input=text)
+  if llm_cache is not None:
+    cached = llm_cache.get(key)
+    if cached is not None:
+      return array.array("d", cached).tolist()
+
+  vector = openai.Embedding.create(input=[text], model=model)["data"][0]["embedding"]
+  if llm_cache is not None:
+    llm_cache.put(key, array.array("d", vector).tobytes())
+  return vector
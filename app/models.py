@@ -1,6 +1,14 @@
 current_db_integration = None
-from flask import current_app
-from app.integrations.database.neo4j import Neo4jDBIntegration
+from flask import current_app, has_app_context
+from app.integrations.database import load_backend
+from app.signals import entity_created, entity_updated, entity_deleted
+
+# Every write below sends the matching signal, whether it came from a route or from an integration, so listeners
+# (such as the graph change feed in app/graph_changes.py) see all changes made through the app.
+
+
+def signal_sender():
+  return current_app._get_current_object() if has_app_context() else None
 
 def set_database_integration(db_integration_instance):
   global current_db_integration
@@ -10,9 +18,23 @@ def set_database_integration(db_integration_instance):
 def add_entity(entity_type, data):
   global current_db_integration
   print("AYOO!!!")
-  current_db_integration = Neo4jDBIntegration(database=current_app.config["SELECTED_DB"])
+  # Cheap: every Neo4jDBIntegration shares the process-wide driver and its connection pool (and the neo4j module is
+  # imported once, the first time it is needed)
+  current_db_integration = load_backend("neo4j")(database=current_app.config["SELECTED_DB"])
   print(current_db_integration._database)
-  return current_db_integration.add_entity(entity_type, data)
+  entity_id = current_db_integration.add_entity(entity_type, data)
+  entity_created.send(signal_sender(), entity_type=entity_type, entity_id=entity_id, data=data)
+  return entity_id
+
+
+def add_entities(entity_type, entities):
+  global current_db_integration
+  current_db_integration = load_backend("neo4j")(database=current_app.config["SELECTED_DB"])
+  entity_ids = current_db_integration.add_entities(entity_type, entities)
+  sender = signal_sender()
+  for entity_id, data in zip(entity_ids, entities):
+    entity_created.send(sender, entity_type=entity_type, entity_id=entity_id, data=data)
+  return entity_ids
 
 
 def get_full_graph():
@@ -28,15 +50,52 @@ def get_all_entities(entity_type):
 
 
 def update_entity(entity_type, entity_id, data):
-  return current_db_integration.update_entity(entity_type, entity_id, data)
+  updated = current_db_integration.update_entity(entity_type, entity_id, data)
+  if updated:
+    entity_updated.send(signal_sender(), entity_type=entity_type, entity_id=entity_id, data=data)
+  return updated
 
 
 def delete_entity(entity_type, entity_id):
-  return current_db_integration.delete_entity(entity_type, entity_id)
+  deleted = current_db_integration.delete_entity(entity_type, entity_id)
+  if deleted:
+    entity_deleted.send(signal_sender(), entity_type=entity_type, entity_id=entity_id)
+  return deleted
 
 
 def add_relationship(data):
-  return current_db_integration.add_relationship(data)
+  relationship_id = current_db_integration.add_relationship(data)
+  entity_created.send(signal_sender(), entity_type="relationship", entity_id=relationship_id, data=data)
+  return relationship_id
+
+
+def add_relationships(relationships):
+  relationship_ids = current_db_integration.add_relationships(relationships)
+  sender = signal_sender()
+  for relationship_id, data in zip(relationship_ids, relationships):
+    entity_created.send(sender, entity_type="relationship", entity_id=relationship_id, data=data)
+  return relationship_ids
+
+
+def find_relationship(data):
+  return current_db_integration.find_relationship(data)
+
+
+def merge_relationship(data):
+  # Add the relationship unless one with the same (from_id, to_id, relationship) exists; returns (ID, created)
+  relationship_id, created = current_db_integration.merge_relationship(data)
+  if created:
+    entity_created.send(signal_sender(), entity_type="relationship", entity_id=relationship_id, data=data)
+  return relationship_id, created
+
+
+def merge_relationships(relationships):
+  results = current_db_integration.merge_relationships(relationships)
+  sender = signal_sender()
+  for (relationship_id, created), data in zip(results, relationships):
+    if created:
+      entity_created.send(sender, entity_type="relationship", entity_id=relationship_id, data=data)
+  return results
 
 
 def search_entities(search_params):
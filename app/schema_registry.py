@@ -0,0 +1,199 @@
+# Loads schema.json once for the whole app: natural_input's extraction prompt and the NexusDB and NebulaGraph backends
+# all read it through get_schema() rather than parsing the file themselves.
+# schema.json maps each entity type to {"node_type": name, "edge_types": {property or relationship: description}}.
+# It is validated when loaded (a SchemaError names what is wrong), and everything derived from it is computed once per
+# load in CompiledSchema:
+# - extraction_function: the OpenAI function-calling schema natural_input asks the model to fill in,
+# - column_names: each type's properties as column names (the NexusDB naming: "/" -> "_or_", " " -> "_"),
+# - nebula_tag_queries / nebula_edge_queries: the NebulaGraph DDL for every tag and edge type, and
+#   nebula_tag_index_queries / nebula_edge_index_queries: the indexes its searches run on (by index name).
+# get_schema() checks the file's modification time and reloads it when it has changed; if the new file is invalid the
+# previous schema stays in use and the error is printed.
+# - SCHEMA_PATH: the schema file (default schema.json)
+
+import json
+import os
+import threading
+
+SCHEMA_PATH = os.environ.get("SCHEMA_PATH", "schema.json")
+
+
+class SchemaError(ValueError):
+  pass
+
+
+def column_name(field):
+  return field.replace("/", "_or_").replace(" ", "_")
+
+
+def index_name(kind, name):
+  # Index names are plain identifiers, whatever the tag or edge type is called ("Is a/Type of" -> idx_edge_Is_a_or_Type_of)
+  return f"idx_{kind}_" + "".join(c if c.isalnum() else "_" for c in column_name(name))
+
+
+def validate_schema(schema):
+  if not isinstance(schema, dict) or not schema:
+    raise SchemaError("The schema must be a non-empty object of entity types")
+  for entity_type, info in schema.items():
+    if not isinstance(info, dict):
+      raise SchemaError(f"{entity_type}: expected an object")
+    if not isinstance(info.get("node_type"), str) or not info["node_type"]:
+      raise SchemaError(f"{entity_type}: node_type must be a non-empty string")
+    edge_types = info.get("edge_types")
+    if not isinstance(edge_types, dict):
+      raise SchemaError(f"{entity_type}: edge_types must be an object")
+    for edge_type, description in edge_types.items():
+      if not isinstance(description, str):
+        raise SchemaError(f"{entity_type}.edge_types.{edge_type}: the description must be a string")
+
+
+def compile_extraction_function(schema, node_types, edges):
+  nodes_properties = {}
+  for node_type, info in schema.items():
+    properties = {
+        "temp_id": {"type": "integer"},
+        "name": {"type": "string"},
+    }
+
+    # Add additional properties based on the schema
+    for edge_type, description in info["edge_types"].items():
+      properties[edge_type] = {
+          "type": "string",
+          "description": description,
+      }
+
+    nodes_properties[node_type] = {
+        "type": "array",
+        "items": {
+            "type": "object",
+            "properties": properties,
+            "required": ["temp_id", "name"],
+        },
+    }
+
+  return {
+      "name": "knowledge_graph",
+      "description": f"Generate a knowledge graph with entities and relationships. Node types must be in {node_types}. Do your best to capture relationships. Do not abbreviate anything. Do not provide a response that is not part of the JSON.",
+      "parameters": {
+          "type": "object",
+          "properties": {
+              "nodes": {
+                  "type": "object",
+                  "properties": nodes_properties,
+              },
+              "relationships": {
+                  "type": "array",
+                  "items": {
+                      "type": "object",
+                      "properties": {
+                          "from_type": {
+                              "type": "string",
+                          },
+                          "from_temp_id": {"type": "integer"},
+                          "to_type": {
+                              "type": "string",
+                          },
+                          "to_temp_id": {"type": "integer"},
+                          "data": {
+                              "type": "object",
+                              "properties": {
+                                  "relationship": {
+                                      "type": "string",
+                                      "description": "Detailed relationship information between the two properties.",
+                                      "enum": edges,
+                                  },
+                                  "snippet": {
+                                      "type": "string",
+                                      "description": "Provide a snippet from the source word for word (either one or more full sentences) describing this relationship between the two entities.",
+                                  },
+                              },
+                              "required": ["relationship", "snippet"],
+                          },
+                      },
+                      "required": [
+                          "from_type",
+                          "from_temp_id",
+                          "to_type",
+                          "to_temp_id",
+                          "data",
+                      ],
+                  },
+              },
+          },
+          "required": ["nodes", "relationships"],
+      },
+  }
+
+
+class CompiledSchema:
+
+  def __init__(self, schema, mtime=None):
+    validate_schema(schema)
+    self.schema = schema
+    self.mtime = mtime
+    self.entity_types = list(schema)
+    self.node_types = [info["node_type"] for info in schema.values()]
+    self.edge_types = sorted({edge_type for info in schema.values() for edge_type in info["edge_types"]})
+    self.column_names = {
+        entity_type: [column_name(field) for field in info["edge_types"]] for entity_type, info in schema.items()
+    }
+    self.extraction_function = compile_extraction_function(schema, self.node_types, self.edge_types)
+    self.nebula_tag_queries = {
+        entity_type: f"CREATE TAG IF NOT EXISTS `{entity_type}`(name string, description string);"
+        for entity_type in self.entity_types
+    }
+    self.nebula_edge_queries = {
+        edge_type: f"CREATE EDGE IF NOT EXISTS `{edge_type}`(snippet string, relationship_type string);"
+        for edge_type in self.edge_types
+    }
+    # Every search is a MATCH on one tag or edge type, which NebulaGraph can only run from an index on it; the tag
+    # indexes also cover name, so name lookups do not read the vertices
+    self.nebula_tag_index_queries = {
+        index_name("tag", entity_type): f"CREATE TAG INDEX IF NOT EXISTS `{index_name('tag', entity_type)}` "
+                                        f"ON `{entity_type}`(name(128));"
+        for entity_type in self.entity_types
+    }
+    self.nebula_edge_index_queries = {
+        index_name("edge", edge_type): f"CREATE EDGE INDEX IF NOT EXISTS `{index_name('edge', edge_type)}` "
+                                       f"ON `{edge_type}`();"
+        for edge_type in self.edge_types
+    }
+
+
+class SchemaRegistry:
+
+  def __init__(self, path):
+    self.path = path
+    self.loads = 0
+    self._compiled = None
+    self._failed_mtime = None  # a modification time whose file did not load, so it is not retried on every call
+    self._lock = threading.Lock()
+
+  def get(self):
+    mtime = os.stat(self.path).st_mtime_ns
+    with self._lock:
+      if self._compiled is None or self._compiled.mtime != mtime and self._failed_mtime != mtime:
+        try:
+          with open(self.path, "r") as file:
+            self._compiled = CompiledSchema(json.load(file), mtime)
+          self.loads += 1
+          print(f"Loaded schema from {self.path}: {len(self._compiled.entity_types)} entity types")
+        except (ValueError, OSError) as e:
+          if self._compiled is None:
+            raise
+          self._failed_mtime = mtime
+          print(f"Keeping the previous schema, {self.path} could not be loaded: {e}")
+      return self._compiled
+
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+
+def get_schema(path=SCHEMA_PATH):
+  # The compiled schema in `path`, reloaded when the file has changed
+  with _registries_lock:
+    registry = _registries.get(path)
+    if registry is None:
+      registry = _registries[path] = SchemaRegistry(path)
+  return registry.get()
@@ -8,11 +8,11 @@
 # - A route for adding relationships between entities.
 # - Routes for searching entities and relationships based on provided search parameters.
 # - A special route for triggering integrations by name, allowing external functionalities to be executed.
+# - Routes for running integrations as background jobs (see jobs.py) and following their progress.
 # Each route is associated with a specific HTTP method (GET, POST, PUT, DELETE) and includes logic for handling request data,
 # interacting with the database through model functions, and sending responses in JSON format. Signals are used to notify
 # other parts of the application about the creation, update, or deletion of entities.
 
-from app.integrations.database.neo4j import Neo4jDBIntegration
 from flask import (
     Blueprint,
     send_from_directory,
@@ -20,9 +20,9 @@ from flask import (
     jsonify,
     request,
     render_template,
+    stream_with_context,
 )
 import os, json
-from neo4j import GraphDatabase, graph
 from .models import (
     add_entity,
     get_full_graph,
@@ -35,9 +35,19 @@ from .models import (
     search_entities_with_type,
     search_relationships,
 )
-from .signals import entity_created, entity_updated, entity_deleted
+from .graph_changes import GRAPH_EVENTS_KEEPALIVE, graph_changes
+from .graph_stream import iter_graph_dict, stream_graph_json
 from .integration_manager import get_integration_function
-from .integrations.database import CurrentDBIntegration
+from .jobs import JobQueueFull, get_job_queue
+from .integrations.entity_matchers import matcher_stats
+from .integrations.database import CurrentDBIntegration, load_backend
+from .integrations.database.subgraphs import (
+    GRAPH_MAX_HOPS,
+    GRAPH_MAX_NODES,
+    GRAPH_MAX_PAGE_SIZE,
+    GRAPH_PAGE_SIZE,
+    clamp,
+)
 
 
 NEO4J_URI = os.environ.get("NEO4J_URI", "bolt://localhost:7687")
@@ -62,25 +72,131 @@ class CustomJSONEncoder(json.JSONEncoder):
 @main.route("/get-graph-data", methods=["GET"])
 def get_graph_data():
     global CurrentDBIntegration
-    all_entities = CurrentDBIntegration.get_full_graph()
-    db_name = CurrentDBIntegration._database
+    db_name = getattr(CurrentDBIntegration, "_database", None)
     print("Database Name:", db_name)
-    print("ALL ENTITIES")
-    print(all_entities)
-
-    # Filter out None values from all_entities
-    filtered_entities = {}
-    for k, v in all_entities.items():
-        if isinstance(v, dict):
-            filtered_entities[k] = {kk: vv for kk, vv in v.items() if vv is not None}
-        elif isinstance(v, list):
-            filtered_entities[k] = [item for item in v if item is not None]
-        else:
-            filtered_entities[k] = v
-    return current_app.response_class(
-        json.dumps(filtered_entities, cls=CustomJSONEncoder),
+
+    # Nothing to send if the client already has this version of the graph
+    version = graph_changes.version
+    not_modified = not_modified_response(version)
+    if not_modified is not None:
+        return not_modified
+
+    # Stream the graph record by record instead of building, copying and printing it whole
+    iter_full_graph = getattr(CurrentDBIntegration, "iter_full_graph", None)
+    if iter_full_graph is not None:
+        records = iter_full_graph()
+    else:
+        records = iter_graph_dict(CurrentDBIntegration.get_full_graph())
+    response = current_app.response_class(
+        stream_with_context(stream_graph_json(records, CustomJSONEncoder())),
         mimetype='application/json'
     )
+    return versioned(response, version)
+
+
+# Graph reads are tagged with the graph version they were read at (taken before reading, so a write that lands during
+# the read only makes the next request fetch again). Browsers revalidate with If-None-Match and get a 304 while the
+# graph is unchanged; X-Graph-Version is the version to pass to /graph/changes and /graph/events.
+def not_modified_response(version):
+    etag = graph_changes.etag(version)
+    if request.if_none_match.contains(etag):
+        return versioned(current_app.response_class(status=304), version)
+    return None
+
+
+def versioned(response, version):
+    response.set_etag(graph_changes.etag(version))
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Graph-Version"] = str(version)
+    return response
+
+
+# Scoped graph reads for the front end (see integrations/database/subgraphs.py); same JSON shape as /get-graph-data
+def graph_response(read):
+    version = graph_changes.version
+    not_modified = not_modified_response(version)
+    if not_modified is not None:
+        return not_modified
+    try:
+        graph = read()
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    response = current_app.response_class(json.dumps(graph, cls=CustomJSONEncoder), mimetype='application/json')
+    return versioned(response, version)
+
+
+def since_version():
+    # ?since= (or the Last-Event-ID an EventSource sends when it reconnects); the current version if neither is given
+    since = request.headers.get("Last-Event-ID") or request.args.get("since")
+    if since is None:
+        return graph_changes.version
+    return int(since)
+
+
+@main.route("/graph/changes", methods=["GET"])
+def get_graph_changes():
+    # The changes after a graph version; "reset": true means reload the graph instead
+    try:
+        since = since_version()
+    except ValueError:
+        return jsonify(error="Invalid since version"), 400
+    changes = graph_changes.changes_since(since)
+    return current_app.response_class(json.dumps(changes, cls=CustomJSONEncoder), mimetype='application/json')
+
+
+@main.route("/graph/events", methods=["GET"])
+def graph_events():
+    # Server-Sent Events: one "changes" event (shaped like /graph/changes) whenever the graph changes, and a comment
+    # every GRAPH_EVENTS_KEEPALIVE seconds otherwise so proxies keep the connection open
+    try:
+        since = since_version()
+    except ValueError:
+        return jsonify(error="Invalid since version"), 400
+
+    def events(since):
+        while True:
+            version = graph_changes.wait(since, GRAPH_EVENTS_KEEPALIVE)
+            if version == since:
+                yield ": keepalive\n\n"
+                continue
+            changes = graph_changes.changes_since(since)
+            since = changes["version"]
+            yield f"id: {since}\nevent: changes\ndata: {json.dumps(changes, cls=CustomJSONEncoder)}\n\n"
+
+    return current_app.response_class(
+        events(since),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@main.route("/graph/page", methods=["GET"])
+def get_graph_page():
+    return graph_response(lambda: CurrentDBIntegration.get_graph_page(
+        cursor=request.args.get("cursor"),
+        limit=clamp(request.args.get("limit"), GRAPH_PAGE_SIZE, GRAPH_MAX_PAGE_SIZE),
+        entity_type=request.args.get("type"),
+    ))
+
+
+@main.route("/graph/subgraph", methods=["GET"])
+def get_subgraph():
+    entity_id = request.args.get("id")
+    if not entity_id:
+        return jsonify(error="Missing id"), 400
+    return graph_response(lambda: CurrentDBIntegration.get_subgraph(
+        entity_id,
+        hops=clamp(request.args.get("hops"), 1, GRAPH_MAX_HOPS),
+        max_nodes=clamp(request.args.get("limit"), GRAPH_MAX_NODES, GRAPH_MAX_NODES),
+    ))
+
+
+@main.route("/graph/top", methods=["GET"])
+def get_top_entities():
+    return graph_response(lambda: CurrentDBIntegration.get_top_entities(
+        limit=clamp(request.args.get("limit"), GRAPH_PAGE_SIZE, GRAPH_MAX_PAGE_SIZE),
+        entity_type=request.args.get("type"),
+    ))
 
 
 @main.route("/favicon.ico")
@@ -104,19 +220,50 @@ def trigger_integration(integration_name):
   return jsonify(error="Integration function not found"), 404
 
 
+@main.route("/jobs/<integration_name>", methods=["POST"])
+def submit_job(integration_name):
+  # Run an integration in the background; poll the returned status URL for progress and the result
+  integration_function = get_integration_function(integration_name)
+  if not integration_function:
+    return jsonify(error="Integration function not found"), 404
+  try:
+    job = get_job_queue(current_app._get_current_object()).submit(integration_name, integration_function, request.json)
+  except JobQueueFull as e:
+    return jsonify(error=f"Too many jobs queued: {e}"), 429, {"Retry-After": "30"}
+  return jsonify(job_id=job.id, status_url=f"/jobs/{job.id}"), 202, {"Location": f"/jobs/{job.id}"}
+
+
+@main.route("/jobs", methods=["GET"])
+def get_jobs_stats():
+  return jsonify(get_job_queue(current_app._get_current_object()).stats()), 200
+
+
+@main.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+  job = get_job_queue(current_app._get_current_object()).get(job_id)
+  if job is None:
+    return jsonify(error="Job not found"), 404
+  return jsonify(job.to_dict()), 200
+
+
+@main.route("/jobs/<job_id>/result", methods=["GET"])
+def get_job_result(job_id):
+  # The integration's own response once the job has finished; 202 with the job's status until then
+  job = get_job_queue(current_app._get_current_object()).get(job_id)
+  if job is None:
+    return jsonify(error="Job not found"), 404
+  if job.finished is None:
+    return jsonify(job.to_dict()), 202
+  if job.error is not None:
+    return jsonify(error=job.error), job.status_code
+  return jsonify(job.result), job.status_code
+
+
 @main.route("/<entity_type>", methods=["POST"])
 def create_entity(entity_type):
   data = request.json
+  # add_entity sends entity_created
   entity_id = add_entity(entity_type, data)
-
-  # Send signal for the created entity, if you want to trigger it for other types, remove the condition.
-  entity_created.send(
-      current_app._get_current_object(),
-      entity_type=entity_type,
-      entity_id=entity_id,
-      data=data,
-  )
-
   return jsonify(id=entity_id), 201
 
 
@@ -137,14 +284,8 @@ def retrieve_all_entities(entity_type):
 @main.route("/<entity_type>/<int:entity_id>", methods=["PUT"])
 def update_entity_route(entity_type, entity_id):
   data = request.json
+  # update_entity sends entity_updated
   if update_entity(entity_type, entity_id, data):
-    # Send signal for the updated entity
-    entity_updated.send(
-        current_app._get_current_object(),
-        entity_type=entity_type,
-        entity_id=entity_id,
-        data=data,
-    )
     return jsonify(success=True), 200
   return jsonify(error="Update failed"), 404
 
@@ -152,13 +293,8 @@ def update_entity_route(entity_type, entity_id):
 @main.route("/<entity_type>/<entity_id>", methods=["DELETE"])
 def delete_entity_route(entity_type, entity_id):
   print(f"Deleting {entity_type} with id {entity_id}")
+  # delete_entity sends entity_deleted
   if delete_entity(entity_type, entity_id):
-    # Send signal for the deleted entity
-    entity_deleted.send(
-        current_app._get_current_object(),
-        entity_type=entity_type,
-        entity_id=entity_id,
-    )
     return jsonify(success=True), 200
   return jsonify(error="Delete failed"), 404
 
@@ -166,16 +302,8 @@ def delete_entity_route(entity_type, entity_id):
 @main.route("/relationship", methods=["POST"])
 def create_relationship_route():
   data = request.json
+  # add_relationship sends entity_created with entity_type="relationship"
   relationship_id = add_relationship(data)
-
-  # Assuming you want to send a signal for relationship creation as well
-  entity_created.send(
-      current_app._get_current_object(),
-      entity_type="relationship",
-      entity_id=relationship_id,
-      data=data,
-  )
-
   return jsonify(id=relationship_id), 201
 
 
@@ -201,6 +329,12 @@ def search_relationship():
   return jsonify(error="Missing search parameters"), 400
 
 
+@main.route("/matcher-stats", methods=["GET"])
+def get_matcher_stats():
+    # How many entities the deterministic matchers settled without a model call, and how many they left to the model
+    return jsonify(matcher_stats.snapshot()), 200
+
+
 @main.route("/databases", methods=["GET"])
 def get_databases():
     databases = CurrentDBIntegration.get_databases()
@@ -210,9 +344,10 @@ def get_databases():
 @main.route("/set-database/<db_name>", methods=["POST"])
 def set_database(db_name):
     global CurrentDBIntegration
-    CurrentDBIntegration._driver.close()
-    CurrentDBIntegration = Neo4jDBIntegration(database=db_name)
+    # The new integration reuses the shared driver, so switching databases opens no new connections
+    CurrentDBIntegration = load_backend("neo4j")(database=db_name)
     current_app.config["SELECTED_DB"] = db_name  # Set the selected database name
+    graph_changes.reset()  # a different graph: clients reload rather than apply changes
     return jsonify({"message": "Database switched"}), 200
 
 
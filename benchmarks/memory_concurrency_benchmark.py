@@ -0,0 +1,103 @@
+# Stress test for the thread-safe in-memory database (MEMORY_THREAD_SAFE=true).
+# For each thread count, worker threads run a mixed workload against one shared database: adding entities of their
+# own type, linking them to existing entities, updating them, searching, reading single entities, and occasionally
+# reading the full graph. The benchmark reports total operations per second, then checks invariants: no duplicate IDs
+# were handed out and every relationship points at entities that exist. A single-threaded run with the locks turned
+# off (MEMORY_THREAD_SAFE=false) is included as the baseline for the cost of the locking itself.
+#
+# Usage (from the repository root):
+#   python -m benchmarks.memory_concurrency_benchmark --threads 1 2 4 8 16 32 --operations 20000
+
+import argparse
+import contextlib
+import io
+import random
+import threading
+import time
+
+from benchmarks.memory_snapshot_benchmark import ENTITY_TYPES, RELATIONSHIPS
+
+
+def worker(db, worker_id, operations, seed, added, errors):
+  rng = random.Random(seed + worker_id)
+  entity_type = ENTITY_TYPES[worker_id % len(ENTITY_TYPES)]
+  mine = []
+  try:
+    for i in range(operations):
+      roll = rng.random()
+      if roll < 0.3 or not mine:
+        entity_id = db.add_entity(entity_type, {
+            "entity_type": entity_type,
+            "data": {"name": f"{entity_type} {worker_id}-{i}"},
+        })
+        mine.append(entity_id)
+      elif roll < 0.5:
+        db.add_relationship({
+            "from_id": rng.choice(mine),
+            "to_id": rng.choice(mine),
+            "relationship": rng.choice(RELATIONSHIPS),
+        })
+      elif roll < 0.6:
+        db.update_entity(entity_type, rng.choice(mine), {"data": {"name": f"{entity_type} {worker_id}-{i} v2"}})
+      elif roll < 0.8:
+        db.search_entities_with_type(entity_type, {"name": f"{worker_id}-{rng.randrange(i + 1)}"})
+      elif roll < 0.999:
+        db.get_entity(entity_type, rng.choice(mine))
+      else:
+        db.get_full_graph()
+  except Exception as error:
+    errors.append(error)
+  added.extend(mine)
+
+
+def run(threads, operations, seed, thread_safe=True):
+  from app.integrations.database.memory import InMemoryDatabase
+
+  db = InMemoryDatabase(data_dir="", thread_safe=thread_safe)
+  added, errors = [], []
+  per_thread = operations // threads
+  workers = [
+      threading.Thread(target=worker, args=(db, worker_id, per_thread, seed, added, errors))
+      for worker_id in range(threads)
+  ]
+  with contextlib.redirect_stdout(io.StringIO()):
+    started = time.perf_counter()
+    for thread in workers:
+      thread.start()
+    for thread in workers:
+      thread.join()
+    elapsed = time.perf_counter() - started
+
+  graph = db.get_full_graph()
+  entity_ids = {entity_id for entities in graph["entities"].values() for entity_id in entities}
+  dangling = sum(
+      1 for relationship in graph["relationships"]
+      if relationship["from_id"] not in entity_ids or relationship["to_id"] not in entity_ids)
+  return {
+      "ops_per_s": per_thread * threads / elapsed,
+      "duplicate_ids": len(added) - len(set(added)),
+      "dangling": dangling,
+      "errors": errors,
+  }
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Throughput of the thread-safe in-memory database")
+  parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+  parser.add_argument("--operations", type=int, default=20000, help="total operations per run")
+  parser.add_argument("--seed", type=int, default=7)
+  args = parser.parse_args()
+
+  print(f"{args.operations} operations per run")
+  print(f"{'threads':<12}{'ops/s':>12}{'duplicate IDs':>16}{'dangling edges':>16}{'errors':>8}")
+  runs = [("1 unlocked", 1, False)] + [(str(threads), threads, True) for threads in args.threads]
+  for label, threads, thread_safe in runs:
+    result = run(threads, args.operations, args.seed, thread_safe)
+    print(f"{label:<12}{result['ops_per_s']:>12.0f}{result['duplicate_ids']:>16}{result['dangling']:>16}"
+          f"{len(result['errors']):>8}")
+    for error in result["errors"][:3]:
+      print(f"  {error!r}")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,92 @@
+# Compares the memory held by the in-memory database with plain dict records and with compact records
+# (MEMORY_COMPACT_RECORDS=true). Each mode builds the same synthetic graph in a fresh process and reports the bytes
+# allocated for it (tracemalloc), the resident set size it added, and the time to build it and read it back.
+#
+# Usage (from the repository root):
+#   python -m benchmarks.memory_records_benchmark --entities 100000 --relationships 200000
+
+import argparse
+import contextlib
+import io
+import json
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from benchmarks.memory_snapshot_benchmark import ENTITY_TYPES, RELATIONSHIPS, rss_mb
+
+
+def measure(compact, entities, relationships, seed):
+  from app.integrations.database.memory import InMemoryDatabase
+
+  rng = random.Random(seed)
+  before = rss_mb()
+  tracemalloc.start()
+  started = time.perf_counter()
+  db = InMemoryDatabase(data_dir="", compact=compact)
+  ids = []
+  with contextlib.redirect_stdout(io.StringIO()):
+    for i in range(entities):
+      entity_type = rng.choice(ENTITY_TYPES)
+      ids.append(db.add_entity(entity_type, {
+          "entity_type": entity_type,
+          "data": {"name": f"{entity_type} {i}", "description": f"Synthetic {entity_type.lower()} number {i}"},
+      }))
+  for _ in range(relationships):
+    from_id, to_id = rng.sample(ids, 2)
+    # Fresh strings per edge, as they arrive from parsed JSON requests
+    db.add_relationship({
+        "from_id": from_id,
+        "to_id": to_id,
+        "from_type": "".join(rng.choice(ENTITY_TYPES)),
+        "to_type": "".join(rng.choice(ENTITY_TYPES)),
+        "relationship": "".join(rng.choice(RELATIONSHIPS)),
+        "relationship_type": "".join("associated"),
+        "snippet": "",
+    })
+  built = time.perf_counter()
+  allocated, _ = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  after = rss_mb()
+  graph = db.get_full_graph()
+  read = time.perf_counter()
+  print(json.dumps({
+      "allocated_mb": allocated / 2**20,
+      "rss_mb": after - before,
+      "build_s": built - started,
+      "full_graph_s": read - built,
+      "relationships": len(graph["relationships"]),
+  }))
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Memory use: dict records vs. compact records")
+  parser.add_argument("--entities", type=int, default=100000)
+  parser.add_argument("--relationships", type=int, default=200000)
+  parser.add_argument("--seed", type=int, default=7)
+  parser.add_argument("--mode", choices=["dict", "compact"], help=argparse.SUPPRESS)
+  args = parser.parse_args()
+
+  if args.mode:
+    measure(args.mode == "compact", args.entities, args.relationships, args.seed)
+    return
+
+  results = {}
+  for mode in ("dict", "compact"):
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.memory_records_benchmark", "--mode", mode,
+         "--entities", str(args.entities), "--relationships", str(args.relationships), "--seed", str(args.seed)],
+        check=True, capture_output=True, text=True).stdout
+    results[mode] = json.loads(output.strip().splitlines()[-1])
+
+  print(f"{args.entities} entities, {args.relationships} relationships")
+  print(f"{'records':<10}{'allocated MB':>14}{'RSS MB':>10}{'build s':>10}{'full graph s':>14}")
+  for mode, result in results.items():
+    print(f"{mode:<10}{result['allocated_mb']:>14.1f}{result['rss_mb']:>10.1f}"
+          f"{result['build_s']:>10.3f}{result['full_graph_s']:>14.3f}")
+
+
+if __name__ == "__main__":
+  main()
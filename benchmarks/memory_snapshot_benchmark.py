@@ -0,0 +1,115 @@
+# Compares cold start of the in-memory database from a JSON snapshot and from a memory-mapped columnar snapshot.
+# For each format a fresh process recovers the same synthetic graph and reports how long recovery took, the resident
+# set size it added, and how long the first search and the first full-graph read took afterwards.
+#
+# Usage (from the repository root):
+#   python -m benchmarks.memory_snapshot_benchmark --entities 200000 --relationships 400000
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+ENTITY_TYPES = ["Person", "Organization", "Event", "Concept", "Location"]
+RELATIONSHIPS = ["Works for", "Related to", "Located in/Found in", "Invests in", "Collaborates on"]
+
+
+def rss_mb():
+  # Current resident set size (Linux); falls back to the peak reported by getrusage elsewhere
+  try:
+    with open("/proc/self/statm") as statm:
+      return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+  except OSError:
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def build(data_dir, snapshot_format, entities, relationships, seed):
+  from app.integrations.database.memory import InMemoryDatabase
+  from app.integrations.database.memory_persistence import GraphJournal
+
+  rng = random.Random(seed)
+  db = InMemoryDatabase()
+  ids = []
+  for i in range(entities):
+    entity_type = rng.choice(ENTITY_TYPES)
+    ids.append(db._next_id)
+    db._apply_add_entity(entity_type, db._next_id, {
+        "entity_type": entity_type,
+        "data": {"name": f"{entity_type} {i}", "description": f"Synthetic {entity_type.lower()} number {i}"},
+    })
+  for _ in range(relationships):
+    from_id, to_id = rng.sample(ids, 2)
+    db._apply_add_relationship(db._next_relationship_id, {
+        "from_id": from_id,
+        "to_id": to_id,
+        "relationship": rng.choice(RELATIONSHIPS),
+        "relationship_type": "associated",
+        "snippet": "",
+    })
+  journal = GraphJournal(data_dir, sync_mode="off", snapshot_format=snapshot_format)
+  with contextlib.redirect_stdout(io.StringIO()):
+    journal.recover()
+  journal.snapshot(db._snapshot_state())
+  journal.close()
+
+
+def load(data_dir):
+  from app.integrations.database.memory import InMemoryDatabase
+
+  before = rss_mb()
+  started = time.perf_counter()
+  with contextlib.redirect_stdout(io.StringIO()):
+    db = InMemoryDatabase(data_dir=data_dir)
+  recovered = time.perf_counter()
+  after_start = rss_mb()
+  db.search_entities_with_type("Person", {"name": "person 12"})
+  searched = time.perf_counter()
+  graph = db.get_full_graph()
+  full_graph = time.perf_counter()
+  print(json.dumps({
+      "startup_s": recovered - started,
+      "startup_rss_mb": after_start - before,
+      "first_search_s": searched - recovered,
+      "full_graph_s": full_graph - searched,
+      "entities": sum(len(entities) for entities in graph["entities"].values()),
+      "relationships": len(graph["relationships"]),
+  }))
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Cold start: JSON vs. columnar snapshot")
+  parser.add_argument("--entities", type=int, default=200000)
+  parser.add_argument("--relationships", type=int, default=400000)
+  parser.add_argument("--seed", type=int, default=7)
+  parser.add_argument("--load", help=argparse.SUPPRESS)
+  args = parser.parse_args()
+
+  if args.load:
+    load(args.load)
+    return
+
+  results = {}
+  for snapshot_format in ("json", "columnar"):
+    data_dir = tempfile.mkdtemp(prefix=f"mindgraph-{snapshot_format}-")
+    build(data_dir, snapshot_format, args.entities, args.relationships, args.seed)
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.memory_snapshot_benchmark", "--load", data_dir],
+        check=True, capture_output=True, text=True).stdout
+    results[snapshot_format] = json.loads(output.strip().splitlines()[-1])
+
+  print(f"{args.entities} entities, {args.relationships} relationships")
+  print(f"{'format':<10}{'startup s':>12}{'startup RSS MB':>16}{'first search s':>16}{'full graph s':>14}")
+  for snapshot_format, result in results.items():
+    print(f"{snapshot_format:<10}{result['startup_s']:>12.3f}{result['startup_rss_mb']:>16.1f}"
+          f"{result['first_search_s']:>16.3f}{result['full_graph_s']:>14.3f}")
+
+
+if __name__ == "__main__":
+  main()
@@ -1,43 +1,219 @@
+import hashlib
 import os
+import threading
+import time
 import openai
+import numpy as np
 from app.integrations.database.neo4j import Neo4jDBIntegration
+from app.llm_cache import chat_completion, embedding
 import json
+from concurrent.futures import ThreadPoolExecutor
+
+# Each summary's embedding is stored next to graph_summaries.json when the summary is written, so routing a query
+# (ai_search) takes one embedding of the query and one matrix-vector product over SummaryIndex, however many
+# databases there are. Embeddings are matched to summaries by a hash of the summary text; missing or stale ones are
+# computed when the summaries are loaded.
+GRAPH_SUMMARIES_FILE = 'graph_summaries.json'
+GRAPH_SUMMARY_EMBEDDINGS_FILE = 'graph_summary_embeddings.npz'
+SUMMARY_EMBEDDING_MODEL = "text-embedding-ada-002"
+
+# Summaries are rewritten in the background by SummaryWorker (see schedule_summary): writes only mark their database
+# dirty, and each dirty database is summarized once it has been quiet for SUMMARY_DEBOUNCE seconds, and at most once
+# every SUMMARY_INTERVAL seconds, however many writes came in meanwhile.
+SUMMARY_INTERVAL = float(os.environ.get("SUMMARY_INTERVAL", 300))
+SUMMARY_DEBOUNCE = float(os.environ.get("SUMMARY_DEBOUNCE", 10))
+# A summary is updated from the entities and relationships added since the last one (passed to schedule_summary).
+# Without a previous summary, when those changes are unknown, or when they are longer than SUMMARY_PARTITION_CHARS,
+# it is rebuilt from the whole graph, map-reduce style: the graph is split into partitions of up to
+# SUMMARY_PARTITION_CHARS characters, each is summarized (SUMMARY_MAX_WORKERS at a time) and the partial summaries
+# are combined into one.
+SUMMARY_PARTITION_CHARS = int(os.environ.get("SUMMARY_PARTITION_CHARS", 24000))
+SUMMARY_MAX_WORKERS = int(os.environ.get("SUMMARY_MAX_WORKERS", 4))
+SUMMARY_PARTIAL_TOKENS = 300
+
+
+class SummaryIndex:
+    def __init__(self, names, vectors):
+        self.names = list(names)
+        matrix = np.asarray(vectors, dtype=np.float32)
+        if not self.names:
+            matrix = np.zeros((0, 0), dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        self.matrix = matrix / norms  # rows are unit vectors, so a dot product is the cosine similarity
+
+    def best_match(self, query_vector):
+        # (database name, cosine similarity) of the summary closest to the query, or (None, -1) without summaries
+        if not self.names:
+            return None, -1
+        query = np.asarray(query_vector, dtype=np.float32)
+        similarities = self.matrix @ (query / (np.linalg.norm(query) or 1))
+        best = int(np.argmax(similarities))
+        return self.names[best], float(similarities[best])
+
+
+def summary_hash(summary):
+    return hashlib.sha256(summary.encode("utf8")).hexdigest()
+
+
+def load_summary_embeddings():
+    # {database name: (summary hash, vector)} from GRAPH_SUMMARY_EMBEDDINGS_FILE
+    try:
+        with np.load(GRAPH_SUMMARY_EMBEDDINGS_FILE) as stored:
+            return {
+                str(name): (str(digest), vector)
+                for name, digest, vector in zip(stored["names"], stored["hashes"], stored["vectors"])
+            }
+    except FileNotFoundError:
+        return {}
+
+
+def store_summary_embeddings(embeddings):
+    names = list(embeddings)
+    # Written to a temporary file first so a concurrent reader never sees half a file
+    temporary = GRAPH_SUMMARY_EMBEDDINGS_FILE + ".tmp.npz"
+    np.savez(
+        temporary,
+        names=np.array(names, dtype=str),
+        hashes=np.array([embeddings[name][0] for name in names], dtype=str),
+        vectors=np.array([embeddings[name][1] for name in names], dtype=np.float32) if names else np.zeros((0, 0)),
+    )
+    os.replace(temporary, GRAPH_SUMMARY_EMBEDDINGS_FILE)
+
+
+def build_summary_index(app):
+    # Embed any summary whose stored embedding is missing or stale, then index them all
+    summaries = app.config["GRAPH_SUMMARIES"]
+    embeddings = load_summary_embeddings()
+    changed = False
+    for db_name, summary in summaries.items():
+        digest = summary_hash(summary)
+        if db_name not in embeddings or embeddings[db_name][0] != digest:
+            embeddings[db_name] = (digest, embedding(summary, model=SUMMARY_EMBEDDING_MODEL))
+            changed = True
+    for db_name in set(embeddings) - set(summaries):
+        del embeddings[db_name]
+        changed = True
+    if changed:
+        store_summary_embeddings(embeddings)
+
+    names = list(summaries)
+    app.config["GRAPH_SUMMARY_INDEX"] = SummaryIndex(names, [embeddings[name][1] for name in names])
 
 def get_database_summary(database_name):
+    # _query hands back record.data(), which turns nodes into plain property dicts and relationships into
+    # (start properties, type, end properties) tuples, so the fields the summary needs are returned explicitly
     db_integration = Neo4jDBIntegration(database=database_name)
-    result = db_integration._query("MATCH (n) RETURN n")
-    nodes = [record["n"] for record in result]
-    
-    result = db_integration._query("MATCH ()-[r]->() RETURN r")
-    relationships = [record["r"] for record in result]
-    
+    nodes = db_integration._query("MATCH (n) RETURN labels(n) AS labels, properties(n) AS properties")
+    relationships = db_integration._query(
+        f"MATCH (a)-[r]->(b) RETURN {cypher_node_name('a')} AS from_name, type(r) AS type, "
+        f"{cypher_node_name('b')} AS to_name"
+    )
+
     return {
         "nodes": nodes,
         "relationships": relationships
     }
 
-def summarize_and_store_graph(app, database_name):
-    # Retrieve the details of the knowledge graph
-    graph_data = get_database_summary(database_name)
 
-    # Pass the graph data to GPT-4 for summarization
+def cypher_node_name(variable):
+    return f"coalesce({variable}.name, {variable}.term, elementId({variable}))"
+
+
+def graph_lines(graph_data):
+    # One line per node ("Label {properties}") and relationship ("name -[TYPE]-> name"), nodes grouped by label so
+    # that each partition of the lines covers a few kinds of entities
+    nodes = sorted(graph_data["nodes"], key=lambda node: sorted(node["labels"]))
+    lines = [f"{':'.join(sorted(node['labels']))} {node['properties']}" for node in nodes]
+    for relationship in graph_data["relationships"]:
+        lines.append(f"{relationship['from_name']} -[{relationship['type']}]-> {relationship['to_name']}")
+    return lines
+
+
+def partition_lines(lines, max_chars=SUMMARY_PARTITION_CHARS):
+    partitions = [[]]
+    size = 0
+    for line in lines:
+        if partitions[-1] and size + len(line) > max_chars:
+            partitions.append([])
+            size = 0
+        partitions[-1].append(line)
+        size += len(line) + 1
+    return ["\n".join(partition) for partition in partitions]
+
+
+def ask_summary(prompt, max_tokens=100):
     openai.api_key = os.environ["OPENAI_API_KEY"]
-    
+    response = chat_completion(
+        model="gpt-4",
+        messages=[
+            {"role": "system", "content": "You are a helpful assistant that summarizes knowledge graph data."},
+            {"role": "user", "content": prompt}
+        ],
+        max_tokens=max_tokens,
+        n=1,
+        stop=None,
+        temperature=0.7,
+    )
+    return response.choices[0].message['content'].strip()
+
+
+def map_reduce_summary(lines):
+    # Summarize each partition of the graph concurrently, then summarize the partial summaries (in partitions again,
+    # if they do not fit in one prompt) until one summary is left. Every round at least halves the partials: when no
+    # two of them fit in one partition they are combined in pairs anyway, so the loop ends however small the limit.
+    partitions = partition_lines(lines)
+    if len(partitions) == 1:
+        return ask_summary(f"Please summarize the following knowledge graph data:\n\n{partitions[0]}")
+
+    with ThreadPoolExecutor(max_workers=min(SUMMARY_MAX_WORKERS, len(partitions))) as executor:
+        partials = list(executor.map(
+            lambda partition: ask_summary(
+                f"Please summarize the following part of a knowledge graph:\n\n{partition}",
+                max_tokens=SUMMARY_PARTIAL_TOKENS,
+            ),
+            partitions,
+        ))
+    print(f"Summarized {len(partitions)} graph partitions")
+
+    while True:
+        partitions = partition_lines(partials)
+        if len(partitions) > (len(partials) + 1) // 2:
+            partitions = ["\n".join(partials[i:i + 2]) for i in range(0, len(partials), 2)]
+        if len(partitions) == 1:
+            return ask_summary(
+                "Please combine these summaries of parts of one knowledge graph into a summary of the whole graph:"
+                f"\n\n{partitions[0]}"
+            )
+        partials = [
+            ask_summary(f"Please combine these summaries of parts of a knowledge graph:\n\n{partition}",
+                        max_tokens=SUMMARY_PARTIAL_TOKENS)
+            for partition in partitions
+        ]
+
+
+def update_summary(summary, changes):
+    return ask_summary(
+        f"This is a summary of a knowledge graph:\n\n{summary}\n\n"
+        "Please update it to also cover the following entities and relationships, which were just added to the graph:"
+        "\n\n" + "\n".join(changes)
+    )
+
+
+def summarize_and_store_graph(app, database_name, changes=None):
+    # changes: lines describing what was added since the last summary, or None when that is unknown. Updates the
+    # stored summary from them when it can, otherwise rebuilds it from the whole graph.
     try:
-        response = openai.ChatCompletion.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant that summarizes knowledge graph data."},
-                {"role": "user", "content": f"Please summarize the following knowledge graph data:\n\n{graph_data}"}
-            ],
-            max_tokens=100,
-            n=1,
-            stop=None,
-            temperature=0.7,
-        )
-        
-        # Extract the summary from the GPT-4 response
-        summary = response.choices[0].message['content'].strip()
+        previous = app.config.get("GRAPH_SUMMARIES", {}).get(database_name)
+        if previous and changes is not None and sum(len(line) + 1 for line in changes) <= SUMMARY_PARTITION_CHARS:
+            if not changes:
+                return
+            print(f"Updating the summary of {database_name} with {len(changes)} changes")
+            summary = update_summary(previous, changes)
+        else:
+            # Retrieve the details of the knowledge graph
+            print(f"Rebuilding the summary of {database_name}")
+            summary = map_reduce_summary(graph_lines(get_database_summary(database_name)))
         print("88888888888888888888888")
         print(summary)
         
@@ -48,12 +224,125 @@ def summarize_and_store_graph(app, database_name):
         app.config["GRAPH_SUMMARIES"][database_name] = summary
         
         # Save the summaries to a JSON file
-        with open('graph_summaries.json', 'w') as f:
+        with open(GRAPH_SUMMARIES_FILE, 'w') as f:
             json.dump(app.config["GRAPH_SUMMARIES"], f)
+
+        # Embed the new summary now, rather than on every search
+        build_summary_index(app)
+        app.config["GRAPH_SUMMARIES_MTIME"] = os.stat(GRAPH_SUMMARIES_FILE).st_mtime_ns
         
     except Exception as e:
         print(f"Error summarizing graph data: {e}")
-        # Handle the error appropriately, e.g., return an error response or raise an exception
+        # Let the caller know the summary is stale; SummaryWorker keeps the changes for its next run
+        raise
+
+
+class SummaryWorker:
+    def __init__(self, summarize, interval=SUMMARY_INTERVAL, debounce=SUMMARY_DEBOUNCE):
+        self.summarize = summarize  # called with a database name and its changes, on the worker thread
+        self.interval = interval
+        self.debounce = debounce
+        self.runs = 0
+        self._dirty = {}     # database name -> time of the last write not yet summarized
+        self._last_run = {}  # database name -> time its last summary started
+        self._changes = {}   # database name -> lines describing the changes not yet summarized, None if unknown
+        self._running = None
+        self._stopped = False
+        self._changed = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="summary-worker", daemon=True)
+        self._thread.start()
+
+    def mark_dirty(self, database_name, changes=None):
+        # Never blocks on a summary: only records the write and wakes the worker
+        with self._changed:
+            if database_name not in self._dirty:
+                self._changes[database_name] = list(changes) if changes is not None else None
+            elif changes is None or self._changes[database_name] is None:
+                self._changes[database_name] = None
+            else:
+                self._changes[database_name].extend(changes)
+            self._dirty[database_name] = time.monotonic()
+            self._changed.notify_all()
+
+    def _restore(self, database_name, changes):
+        # A failed run's changes go back in front of any written since, to be retried at the next slot
+        with self._changed:
+            if database_name not in self._dirty:
+                self._changes[database_name] = changes
+                self._dirty[database_name] = time.monotonic()
+            elif changes is None or self._changes[database_name] is None:
+                self._changes[database_name] = None
+            else:
+                self._changes[database_name] = changes + self._changes[database_name]
+
+    def _next_due(self):
+        # (database name, seconds until it is due) for the dirty database due first, or (None, None)
+        now = time.monotonic()
+        due = [
+            (max(written + self.debounce, self._last_run.get(name, float("-inf")) + self.interval) - now, name)
+            for name, written in self._dirty.items()
+        ]
+        if not due:
+            return None, None
+        wait, name = min(due)
+        return name, max(wait, 0)
+
+    def _run(self):
+        while True:
+            with self._changed:
+                while True:
+                    if self._stopped:
+                        return
+                    name, wait = self._next_due()
+                    if name is not None and wait == 0:
+                        break
+                    self._changed.wait(wait)
+                # Writes arriving while it runs mark it dirty again, for the next run
+                del self._dirty[name]
+                changes = self._changes.pop(name)
+                self._last_run[name] = time.monotonic()
+                self._running = name
+            try:
+                self.summarize(name, changes)
+            except Exception as e:
+                print(f"Error summarizing {name}: {e}")
+                self._restore(name, changes)
+            with self._changed:
+                self.runs += 1
+                self._running = None
+                self._changed.notify_all()
+
+    def wait_idle(self, timeout=None):
+        # Block until nothing is dirty or being summarized; returns False on timeout
+        with self._changed:
+            return self._changed.wait_for(lambda: not self._dirty and self._running is None, timeout)
+
+    def stop(self):
+        with self._changed:
+            self._stopped = True
+            self._changed.notify_all()
+        self._thread.join()
+
+
+_summary_worker = None
+_summary_worker_lock = threading.Lock()
+
+
+def schedule_summary(app, database_name, changes=None):
+    # Ask for database_name's summary to be brought up to date in the background; changes lists what was added (one
+    # line per entity or relationship), or is None to have the summary rebuilt from the whole graph
+    global _summary_worker
+    with _summary_worker_lock:
+        if _summary_worker is None:
+            def summarize(name, changes):
+                # The worker thread has no app context of its own, and rebuilds read the graph through the backend,
+                # which needs one
+                with app.app_context():
+                    summarize_and_store_graph(app, name, changes)
+
+            _summary_worker = SummaryWorker(summarize, interval=SUMMARY_INTERVAL, debounce=SUMMARY_DEBOUNCE)
+    _summary_worker.mark_dirty(database_name, changes)
+
 
 def print_graph_summaries(app):
     try:
@@ -67,11 +356,21 @@ def print_graph_summaries(app):
         print(f"Database: {db_name}\nSummary: {summary}\n")
 
 def load_graph_summaries(app):
+    # Reread the summaries (and rebuild the index) only when the file has changed since the last load
     try:
-        with open('graph_summaries.json', 'r') as f:
+        mtime = os.stat(GRAPH_SUMMARIES_FILE).st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+    if "GRAPH_SUMMARY_INDEX" in app.config and app.config.get("GRAPH_SUMMARIES_MTIME") == mtime:
+        return
+
+    try:
+        with open(GRAPH_SUMMARIES_FILE, 'r') as f:
             app.config["GRAPH_SUMMARIES"] = json.load(f)
     except FileNotFoundError:
         app.config["GRAPH_SUMMARIES"] = {}
+    build_summary_index(app)
+    app.config["GRAPH_SUMMARIES_MTIME"] = mtime
 
 # if __name__ == "__main__":
 #     from flask import Flask
@@ -213,12 +213,14 @@ $(document).ready(function () {
   cy.on("tap", "node", function (evt) {
     var node = evt.target;
     var deleteButtonHtml = "<button id='deleteBtn'>Delete</button>";
+    var expandButtonHtml = "<button id='expandBtn'>Expand</button>";
     $("#sidebar").html(
       "<h2>" +
         node.data("name") +
         "</h2><p>Details about " +
         node.data("name") +
         "</p>" +
+        expandButtonHtml +
         deleteButtonHtml
     );
 
@@ -226,6 +228,14 @@ $(document).ready(function () {
     $("#deleteBtn").on("click", function () {
       deleteNode(node.id());
     });
+
+    // Load the node's neighbours into the graph
+    $("#expandBtn").on("click", function () {
+      fetch("/graph/subgraph?id=" + encodeURIComponent(node.id()))
+        .then((response) => response.json())
+        .then((data) => mergeGraph(data))
+        .catch((error) => console.error("Error expanding node:", error));
+    });
   });
 
   function transformDataToCytoscapeFormat(data) {
@@ -264,6 +274,7 @@ $(document).ready(function () {
 
     // Clear the current graph
     cy.elements().remove();
+    pendingEdges = {};
 
     // Transform and add the new nodes and edges to the graph
     const cytoscapeData = transformDataToCytoscapeFormat(data);
@@ -280,27 +291,151 @@ $(document).ready(function () {
     cy.fit();
   }
 
+  // Edges whose far node has not been loaded yet, by edge id; mergeGraph adds them once it has
+  var pendingEdges = {};
+
+  // Add the nodes and edges of a scoped graph (/graph/page, /graph/subgraph) that are not shown yet.
+  // Edges are only added once both of their nodes are in the graph; until then they wait in pendingEdges.
+  function mergeGraph(data) {
+    const cytoscapeData = transformDataToCytoscapeFormat(data);
+    const nodes = cytoscapeData.nodes.filter((node) => cy.$id(node.data.id).empty());
+    cy.add(nodes);
+    cytoscapeData.edges.forEach((edge) => {
+      pendingEdges[edge.data.id] = edge;
+    });
+    const edges = Object.values(pendingEdges).filter(
+      (edge) => cy.$id(edge.data.source).nonempty() && cy.$id(edge.data.target).nonempty()
+    );
+    edges.forEach((edge) => {
+      delete pendingEdges[edge.data.id];
+    });
+    cy.add(edges.filter((edge) => cy.$id(edge.data.id).empty()));
+
+    cy.layout({
+      name: "cose",
+    }).run();
+  }
+
+  // Start from the best-connected entities rather than the whole graph; "Load more" and "Expand" add the rest
+  var nextCursor = null;
+
   function fetchAndUpdateGraph() {
-    fetch("/get-graph-data")
-      .then((response) => response.json())
+    nextCursor = null;
+    fetch("/graph/top")
+      .then((response) => {
+        followGraphChanges(response.headers.get("X-Graph-Version"));
+        return response.json();
+      })
       .then((data) => {
-        // Assuming you have a function to update the graph with new data
-        console.log('sending data')
-        console.log(data);
         updateGraphVisualization(data);
+        $("#load-more-btn").show();
       })
       .catch((error) => {
         console.error("Error fetching graph data:", error);
       });
   }
-  // Call fetchAndUpdateGraph every 5 seconds
-  // setInterval(fetchAndUpdateGraph, 10000);
+
+  function loadMoreGraph() {
+    var url = "/graph/page" + (nextCursor ? "?cursor=" + encodeURIComponent(nextCursor) : "");
+    fetch(url)
+      .then((response) => response.json())
+      .then((data) => {
+        mergeGraph(data);
+        nextCursor = data.next_cursor;
+        if (!nextCursor) {
+          $("#load-more-btn").hide(); // every entity has been loaded
+        }
+      })
+      .catch((error) => {
+        console.error("Error fetching graph page:", error);
+      });
+  }
+
+  $("#load-more-btn").click(function () {
+    loadMoreGraph();
+  });
+
+  // Keep the graph up to date from /graph/events instead of polling: the server pushes only what changed after the
+  // version the graph was loaded at, and asks for a reload ("reset") when it cannot.
+  var graphEvents = null;
+
+  function followGraphChanges(version) {
+    if (graphEvents) {
+      graphEvents.close();
+    }
+    graphEvents = new EventSource("/graph/events" + (version ? "?since=" + version : ""));
+    graphEvents.addEventListener("changes", function (event) {
+      var data = JSON.parse(event.data);
+      if (data.reset) {
+        fetchAndUpdateGraph();
+      } else {
+        applyGraphChanges(data.changes);
+      }
+    });
+  }
+
+  function applyGraphChanges(changes) {
+    var added = { entities: {}, relationships: [] };
+    changes.forEach(function (change) {
+      var entityId = String(change.entity_id);
+      if (change.entity_type === "relationship") {
+        if (change.event === "created" && change.data) {
+          added.relationships.push({ ...change.data, relationship_type: change.data.relationship });
+        }
+      } else if (change.event === "created" && change.data) {
+        added.entities[change.entity_type] = added.entities[change.entity_type] || {};
+        added.entities[change.entity_type][entityId] = { data: change.data.data || {} };
+      } else if (change.event === "updated" && change.data) {
+        var entityData = change.data.data || {};
+        cy.$id(entityId).data("name", entityData.name || entityData.term || "Unnamed");
+      } else if (change.event === "deleted") {
+        cy.$id(entityId).remove();
+      }
+    });
+    if (Object.keys(added.entities).length || added.relationships.length) {
+      mergeGraph(added);
+    }
+  }
 
   // Call fetchAndUpdateGraph to initially populate or refresh the graph
   $("#refresh-btn").click(function () {
     fetchAndUpdateGraph();
   });
 
+  // Run a long integration as a background job, showing its stages in the sidebar until it finishes
+  function runJob(integrationName, body) {
+    return fetch(`/jobs/${integrationName}`, {
+      method: "POST",
+      headers: {
+        "Content-Type": "application/json",
+      },
+      body: JSON.stringify(body),
+    })
+      .then((response) => response.json().then((data) => {
+        if (!response.ok) {
+          throw new Error(data.error);
+        }
+        return data;
+      }))
+      .then((data) => new Promise((resolve, reject) => {
+        function poll() {
+          fetch(data.status_url)
+            .then((response) => response.json())
+            .then((job) => {
+              const stages = job.stages.map((stage) => stage.stage + ": " + stage.status).join("<br>");
+              $("#sidebar").html("<p>" + integrationName + " " + job.status + "</p><small>" + stages + "</small>");
+              if (job.status === "succeeded" || job.status === "failed") {
+                fetch(data.status_url + "/result").then((response) => response.json()).then(resolve, reject);
+              } else {
+                setTimeout(poll, 2000);
+              }
+            })
+            .catch(reject);
+        }
+        poll();
+      }));
+  }
+
   $("#add-data-btn").click(function () {
     $("#add-data-form").show(); // Show the Add Data form
   });
@@ -312,38 +447,29 @@ $(document).ready(function () {
     console.log(inputType);
     const data = $("#data-box").val(); // Get the data from the textbox
 
-    // Determine the endpoint and body based on the selected input type
-    let endpoint = "";
+    // Determine the integration and body based on the selected input type
+    let integrationName = "";
     let body = {};
 
     if (inputType === "url_input") {
       const escapedData = encodeURIComponent(data);
-      endpoint = "/trigger-integration/url_input";
+      integrationName = "url_input";
       body = { natural_input: escapedData };
     } else if (inputType === "natural_input") {
       // For Natural Input
-      endpoint = `/trigger-integration/natural_input`;
+      integrationName = "natural_input";
       body = { natural_input: data };
       console.log(body);
     } else {
       // For Latent Input, use raw data
-      endpoint = `/trigger-integration/${inputType}`; // Dynamically set endpoint
+      integrationName = inputType; // Dynamically set integration
       body = { natural_input: data }; // Use non-escaped data
     }
 
-    // Convert the body object to a JSON string
-    const jsonBody = JSON.stringify(body);
-    console.log(jsonBody);
+    console.log(JSON.stringify(body));
 
-    // Perform the AJAX request to the dynamic endpoint
-    fetch(endpoint, {
-      method: "POST",
-      headers: {
-        "Content-Type": "application/json",
-      },
-      body: jsonBody,
-    })
-      .then((response) => response.json())
+    // Run the integration as a background job; the graph is refreshed when it is done
+    runJob(integrationName, body)
       .then((data) => {
         console.log("Success:", data);
         $("#add-data-form").hide();
@@ -376,17 +502,10 @@ $(document).ready(function () {
           });
         console.log(JSON.stringify({ urls: urls }));
         // Send the array of URLs to the backend
-        fetch("/trigger-integration/url_array_processor", {
-          method: "POST",
-          headers: {
-            "Content-Type": "application/json",
-          },
-          body: JSON.stringify({ urls: urls }), // Send the URLs array
-        })
-          .then((response) => response.json())
+        runJob("url_array_processor", { urls: urls }) // Send the URLs array
           .then((data) => {
             console.log("URL processing success:", data);
-            // Optionally refresh the graph or update the UI here based on 'data'
+            fetchAndUpdateGraph();
           })
           .catch((error) => {
             console.error("Error processing URLs:", error);
@@ -0,0 +1,1151 @@
+import contextlib
+import ctypes
+import io
+import os
+import random
+import tempfile
+import threading
+import json
+import subprocess
+import sys
+import unittest
+from unittest import mock
+from app.graph_changes import ChangeFeed
+from app.jobs import FAILED, SUCCEEDED, JobQueue, JobQueueFull, tracked
+from app.schema_registry import SchemaError, SchemaRegistry
+from app.import_timing import import_costs
+from app.integration_manager import IntegrationManager
+from app.graph_stream import iter_graph_dict, stream_graph_json
+from app.llm_cache import LLMCache, cache_key
+import kg_selection
+from kg_selection import SummaryIndex, SummaryWorker
+from app.integrations.natural_input import merge_graphs, split_text
+from app.integrations.entity_matchers import MATCH, NEW, matcher_stats, normalize_name, prefilter
+from app.integrations.database import memory
+from app.integrations.database.memory import InMemoryDatabase
+from app.integrations.database.murmur import murmur64, murmur64_many
+from app.integrations.database import neo4j_drivers
+from app.integrations.database.neo4j import Neo4jDBIntegration
+
+
+class InMemoryDatabaseSearchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.db = InMemoryDatabase()
+        self.alice_id = self.db.add_entity('Person', {'entity_type': 'Person', 'data': {'name': 'Alice Smith'}})
+        self.bob_id = self.db.add_entity('Person', {'entity_type': 'Person', 'data': {'name': 'Bob Smithers'}})
+        self.acme_id = self.db.add_entity('Organization', {'entity_type': 'Organization', 'data': {'name': 'ACME'}})
+
+    def search_ids(self, entity_type, search_params):
+        return [result['id'] for result in self.db.search_entities_with_type(entity_type, search_params)]
+
+    def test_substring_search_is_case_insensitive(self):
+        self.assertEqual(self.search_ids('Person', {'name': 'SMITH'}), [self.alice_id, self.bob_id])
+        self.assertEqual(self.search_ids('Person', {'name': 'th'}), [self.alice_id, self.bob_id])
+        self.assertEqual(self.search_ids('Person', {'name': 'smithers'}), [self.bob_id])
+        self.assertEqual(self.search_ids('Organization', {'name': 'smith'}), [])
+
+    def test_search_follows_updates_and_deletes(self):
+        self.db.update_entity('Person', self.alice_id, {'data': {'name': 'Alice Jones'}})
+        self.assertEqual(self.search_ids('Person', {'name': 'smith'}), [self.bob_id])
+        self.assertEqual(self.search_ids('Person', {'name': 'jones'}), [self.alice_id])
+        self.db.delete_entity('Person', self.bob_id)
+        self.assertEqual(self.search_ids('Person', {'name': 'smith'}), [])
+
+    def test_search_entities_spans_types(self):
+        results = self.db.search_entities({'name': 'a'})
+        self.assertEqual({result['id'] for result in results}, {self.alice_id, self.acme_id})
+
+
+
+class InMemoryDatabaseRelationshipTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.db = InMemoryDatabase()
+        self.a = self.db.add_entity('Person', {'entity_type': 'Person', 'data': {'name': 'A'}})
+        self.b = self.db.add_entity('Person', {'entity_type': 'Person', 'data': {'name': 'B'}})
+        self.c = self.db.add_entity('Person', {'entity_type': 'Person', 'data': {'name': 'C'}})
+        self.ab = self.db.add_relationship({'from_id': self.a, 'to_id': self.b, 'relationship': 'knows'})
+        self.bc = self.db.add_relationship({'from_id': self.b, 'to_id': self.c, 'relationship': 'works with'})
+
+    def test_relationship_ids_are_stable(self):
+        self.db.delete_entity('Person', self.a)
+        ca = self.db.add_relationship({'from_id': self.c, 'to_id': self.b, 'relationship': 'knows'})
+        self.assertNotIn(ca, (self.ab, self.bc))
+        self.assertIsNone(self.db.get_relationship(self.ab))
+        self.assertEqual(self.db.get_relationship(self.bc)['relationship'], 'works with')
+
+    def test_delete_entity_drops_its_relationships(self):
+        self.db.delete_entity('Person', self.b)
+        self.assertEqual(self.db.get_full_graph()['relationships'], [])
+        self.assertEqual(self.db.get_entity_relationships(self.a), [])
+
+    def test_neighbour_and_endpoint_lookups(self):
+        self.assertEqual(len(self.db.get_entity_relationships(self.b)), 2)
+        self.assertEqual(self.db.get_entity_relationships(self.b, 'out'), [self.db.get_relationship(self.bc)])
+        self.assertEqual(self.db.search_relationships({'from_id': str(self.a), 'to_id': self.b}),
+                         [self.db.get_relationship(self.ab)])
+        self.assertEqual(self.db.search_relationships({'relationship': 'WORKS'}), [self.db.get_relationship(self.bc)])
+
+
+    def test_merge_relationship_adds_each_key_once(self):
+        self.assertEqual(self.db.find_relationship({'from_id': str(self.a), 'to_id': self.b, 'relationship': 'knows '})['id'],
+                         self.ab)
+        self.assertIsNone(self.db.find_relationship({'from_id': self.b, 'to_id': self.a, 'relationship': 'knows'}))
+        self.assertEqual(self.db.merge_relationship({'from_id': self.a, 'to_id': self.b, 'relationship': 'knows'}),
+                         (self.ab, False))
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.db.merge_relationship(
+            {'from_id': self.c, 'to_id': self.a, 'relationship': 'knows'}))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sum(created for _, created in results), 1)
+        self.assertEqual(len({relationship_id for relationship_id, _ in results}), 1)
+        self.assertEqual(len(self.db.get_entity_relationships(self.c, 'out')), 1)
+
+
+class Neo4jDriverRegistryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(neo4j_drivers, 'GraphDatabase')
+        self.graph_database = patcher.start()
+        self.graph_database.driver.side_effect = lambda *args, **kwargs: mock.Mock()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(neo4j_drivers.close_drivers)
+
+    def test_one_driver_per_credentials(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            first = neo4j_drivers.get_driver('bolt://db:7687', 'neo4j', 'secret')
+            again = neo4j_drivers.get_driver('bolt://db:7687', 'neo4j', 'secret', database='other')
+            other_user = neo4j_drivers.get_driver('bolt://db:7687', 'reader', 'secret')
+            other_server = neo4j_drivers.get_driver('bolt://replica:7687', 'neo4j', 'secret')
+        self.assertIs(first, again)
+        self.assertEqual(len({id(first), id(other_user), id(other_server)}), 3)
+        self.assertEqual(self.graph_database.driver.call_count, 3)
+
+        neo4j_drivers.close_drivers()
+        for driver in (first, other_user, other_server):
+            driver.close.assert_called_once_with()
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertIsNot(neo4j_drivers.get_driver('bolt://db:7687', 'neo4j', 'secret'), first)
+
+    def test_drivers_are_closed_at_exit(self):
+        script = (
+            "from unittest import mock\n"
+            "from app.integrations.database import neo4j_drivers\n"
+            "driver = mock.Mock()\n"
+            "driver.close.side_effect = lambda: print('closed')\n"
+            "neo4j_drivers.GraphDatabase = mock.Mock(**{'driver.return_value': driver})\n"
+            "neo4j_drivers.get_driver('bolt://db:7687', 'neo4j', 'secret')\n"
+            "print('exiting')\n"
+        )
+        output = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+        self.assertEqual(output.splitlines()[-2:], ['exiting', 'closed'])
+
+
+class InMemoryDatabaseBulkWriteTestCase(unittest.TestCase):
+
+    def test_add_entities_and_relationships(self):
+        db = InMemoryDatabase()
+        with contextlib.redirect_stdout(io.StringIO()):
+            ids = db.add_entities('Person', [
+                {'entity_type': 'Person', 'data': {'name': 'Ann'}},
+                {'entity_type': 'Person', 'data': {'name': 'Ben'}},
+            ])
+        self.assertEqual([db.get_entity('Person', entity_id)['data']['name'] for entity_id in ids], ['Ann', 'Ben'])
+        relationship_ids = db.add_relationships([{'from_id': ids[0], 'to_id': ids[1], 'relationship': 'knows'}])
+        self.assertEqual(db.get_entity_relationships(ids[1], 'in'), [db.get_relationship(relationship_ids[0])])
+
+
+class InMemoryDatabaseScopedReadTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.db = InMemoryDatabase()
+        self.ids = [self.db.add_entity('Person', {'entity_type': 'Person', 'data': {'name': name}})
+                    for name in ('A', 'B', 'C', 'D', 'E')]
+        self.topic = self.db.add_entity('Topic', {'entity_type': 'Topic', 'data': {'name': 'T'}})
+        a, b, c, d, e = self.ids
+        for from_id, to_id in ((a, b), (b, c), (c, d), (d, e), (b, self.topic), (c, self.topic)):
+            self.db.add_relationship({'from_id': from_id, 'to_id': to_id, 'relationship': 'knows'})
+
+    def test_pages_cover_the_graph_once(self):
+        cursor, entities, relationships = None, [], []
+        while True:
+            page = self.db.get_graph_page(cursor, limit=2)
+            entities.extend(entity_id for group in page['entities'].values() for entity_id in group)
+            relationships.extend(page['relationships'])
+            cursor = page['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(entities, self.ids + [self.topic])
+        self.assertCountEqual(relationships, self.db.get_full_graph()['relationships'])
+        self.assertEqual(list(self.db.get_graph_page(entity_type='Topic')['entities']), ['Topic'])
+        with self.assertRaises(ValueError):
+            self.db.get_graph_page('not a cursor')
+
+    def test_subgraph_and_top_entities(self):
+        a, b, c, d, e = self.ids
+        subgraph = self.db.get_subgraph(str(b), hops=1)
+        self.assertEqual(set(subgraph['entities']['Person']), {a, b, c})
+        self.assertEqual(set(subgraph['entities']['Topic']), {self.topic})
+        self.assertEqual(len(subgraph['relationships']), 4)
+        self.assertEqual(len(self.db.get_subgraph(a, hops=3, max_nodes=3)['entities']['Person']), 3)
+
+        top = self.db.get_top_entities(limit=2)
+        self.assertEqual(set(top['entities']['Person']), {b, c})
+        self.assertEqual(len(top['relationships']), 1)
+
+    def test_neo4j_quotes_the_entity_type_label(self):
+        db = Neo4jDBIntegration.__new__(Neo4jDBIntegration)
+        db._query = mock.Mock(return_value=[])
+        db.get_graph_page(entity_type='Person) DETACH DELETE (m')
+        db.get_top_entities(entity_type='A`B')
+        queries = [call.args[0] for call in db._query.call_args_list]
+        self.assertIn('MATCH (n:`Person) DETACH DELETE (m`)', queries[0])
+        self.assertIn('MATCH (n:`A``B`)', queries[2])
+
+
+class GraphStreamTestCase(unittest.TestCase):
+
+    def test_streamed_json_matches_full_graph(self):
+        db = InMemoryDatabase()
+        with contextlib.redirect_stdout(io.StringIO()):
+            a = db.add_entity('Person', {'entity_type': 'Person', 'data': {'name': 'Ann "A"'}})
+            b = db.add_entity('Organization', {'entity_type': 'Organization', 'data': {'name': 'ACME'}})
+            db.add_entity('Person', {'entity_type': 'Person', 'data': {'name': 'Ben'}})
+        db.add_relationship({'from_id': a, 'to_id': b, 'relationship': 'Works for'})
+        graph = db.get_full_graph()
+        for chunk_bytes in (1, 1 << 16):
+            chunks = list(stream_graph_json(iter_graph_dict(graph), chunk_bytes=chunk_bytes))
+            self.assertEqual(json.loads(''.join(chunks)), json.loads(json.dumps(graph)))
+        self.assertGreater(len(list(stream_graph_json(iter_graph_dict(graph), chunk_bytes=1))), 1)
+
+    def test_empty_graph(self):
+        graph = {'entities': {}, 'relationships': []}
+        self.assertEqual(json.loads(''.join(stream_graph_json(iter_graph_dict(graph)))), graph)
+        graph = {'entities': {'Person': {1: {'data': {}}}}, 'relationships': []}
+        self.assertEqual(''.join(stream_graph_json(iter_graph_dict(graph))), json.dumps(graph))
+
+    def test_neo4j_streams_nodes_one_label_at_a_time(self):
+        nodes = {'Person': [('4:p:1', {'name': 'Ann'})], 'Organization': [('4:o:2', {'name': 'ACME'})], None: []}
+        queries = []
+
+        def run(query, params=None):
+            queries.append(query)
+            if query.startswith('CALL db.labels()'):
+                return [{'label': 'Person'}, {'label': 'Organization'}]
+            if query.startswith('MATCH (src)'):
+                return [{'src_id': '4:p:1', 'from_type': 'Person', 'relationship': 'Works_for', 'dest_id': '4:o:2',
+                         'to_type': 'Organization', 'edge_props': {'snippet': 'Ann works at ACME'}}]
+            return [{'n': props, 'id': node_id} for node_id, props in nodes[params['label']]]
+
+        session = mock.MagicMock()
+        session.__enter__.return_value.run.side_effect = run
+        db = Neo4jDBIntegration.__new__(Neo4jDBIntegration)
+        db._database = 'neo4j'
+        db._driver = mock.Mock(**{'session.return_value': session})
+
+        graph = json.loads(''.join(stream_graph_json(db.iter_full_graph())))
+        self.assertEqual(graph['entities'], {
+            'Person': {'4:p:1': {'entity_type': 'Person', 'data': {'name': 'Ann'}}},
+            'Organization': {'4:o:2': {'entity_type': 'Organization', 'data': {'name': 'ACME'}}},
+        })
+        self.assertEqual(graph['relationships'][0]['snippet'], 'Ann works at ACME')
+        self.assertTrue(queries[1].startswith('MATCH (n:`Person`)'))
+        self.assertFalse(any('ORDER BY' in query for query in queries))
+        self.assertFalse(any('size(labels(n))' in query for query in queries))
+
+
+class ChangeFeedTestCase(unittest.TestCase):
+
+    def test_changes_since_a_version(self):
+        feed = ChangeFeed(retain=2)
+        start = feed.version
+        first = feed.record('created', 'Person', 1, {'data': {'name': 'Ann'}})
+        self.assertEqual(feed.changes_since(start)['changes'][0]['entity_id'], 1)
+        self.assertEqual(feed.changes_since(first), {'version': first, 'changes': [], 'reset': False})
+        self.assertEqual(feed.wait(first, timeout=0), first)
+
+        feed.record('updated', 'Person', 1)
+        last = feed.record('deleted', 'Person', 1)
+        self.assertEqual([change['event'] for change in feed.changes_since(first)['changes']], ['updated', 'deleted'])
+        # Older changes have been dropped, and versions from the future are unknown: both mean reload
+        self.assertTrue(feed.changes_since(start)['reset'])
+        self.assertTrue(feed.changes_since(last + 1)['reset'])
+        feed.reset()
+        self.assertTrue(feed.changes_since(last)['reset'])
+
+    def test_etags_differ_between_feeds_at_the_same_version(self):
+        first, second = ChangeFeed(), ChangeFeed()
+        second.version = first.version
+        self.assertNotEqual(first.etag(), second.etag())
+        self.assertEqual(first.etag(), first.etag(first.version))
+
+
+class EntityMatcherTestCase(unittest.TestCase):
+
+    def payload(self, name):
+        return {'entity_type': 'Company', 'data': {'name': name}}
+
+    def test_obvious_cases_are_settled_locally(self):
+        candidates = [{'type': 'Company', 'id': 7, 'name': 'Electronic Arts, Inc.'},
+                      {'type': 'Company', 'id': 8, 'name': 'Arts Council'}]
+        before = matcher_stats.snapshot()
+        self.assertEqual(normalize_name('  Électronic-Arts, INC. '), 'electronic arts inc')
+        self.assertEqual(prefilter(self.payload('EA'), []), (NEW, None))
+        self.assertEqual(prefilter(self.payload('electronic arts inc'), candidates), (MATCH, 7))
+        self.assertEqual(prefilter(self.payload('Inc Arts Electronic'), candidates), (MATCH, 7))
+        # Partial names are for the model to judge
+        self.assertIsNone(prefilter(self.payload('Electronic Arts'), candidates))
+        after = matcher_stats.snapshot()
+        self.assertEqual(after['settled_locally'] - before['settled_locally'], 3)
+        self.assertEqual(after['sent_to_model'] - before['sent_to_model'], 1)
+
+    def test_unknown_matchers_are_rejected(self):
+        with self.assertRaises(ValueError):
+            prefilter(self.payload('EA'), [], matchers=['exact_name', 'exact_nmae'])
+        result = subprocess.run([sys.executable, '-c', 'import app.integrations.entity_matchers'],
+                                capture_output=True, text=True, env={**os.environ, 'ENTITY_MATCHERS': 'exact_nmae'},
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertNotEqual(result.returncode, 0)
+        self.assertIn("Unknown entity matchers ['exact_nmae']", result.stderr)
+
+
+class ContextDatabase(InMemoryDatabase):
+    # Reads current_app.config on every search, like the Neo4j backend, so it fails outside an app context
+
+    def search_entities_with_type(self, entity_type, search_params):
+        from flask import current_app
+        self.searched_databases.append(current_app.config['SELECTED_DB'])
+        return super().search_entities_with_type(entity_type, search_params)
+
+
+def fake_completion(content):
+    message = type('Message', (), {'content': content})
+    return type('Completion', (), {'choices': [type('Choice', (), {'message': message})]})
+
+
+class BatchedEntityMatchingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        os.environ.setdefault('OPENAI_API_KEY', 'test')
+        from flask import Flask
+        from app import models
+        from app.integrations import conditional_entity_addition
+        self.matching = conditional_entity_addition
+        self.app = Flask(__name__)
+        self.app.config['SELECTED_DB'] = 'graph'
+
+        self.db = ContextDatabase()
+        self.db.searched_databases = []
+        self.ids = {}
+        with contextlib.redirect_stdout(io.StringIO()):
+            for name in ['Alice Smith', 'Alice Jones', 'Bob Stone', 'Bob Marsh', 'Carol King', 'Carol Lee']:
+                self.ids[name] = self.db.add_entity('Person', {'entity_type': 'Person', 'data': {'name': name}})
+        previous = models.current_db_integration
+        models.set_database_integration(self.db)
+        self.addCleanup(models.set_database_integration, previous)
+
+        self.requests = []
+        self.batch_answer = None
+        self.single_answers = {}
+        patcher = mock.patch.object(conditional_entity_addition, 'chat_completion', side_effect=self.complete)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def complete(self, **kwargs):
+        from flask import current_app
+        self.assertEqual(current_app.config['SELECTED_DB'], 'graph')
+        prompt = kwargs['messages'][1]['content']
+        if 'response_format' in kwargs:
+            self.requests.append('batch')
+            if isinstance(self.batch_answer, Exception):
+                raise self.batch_answer
+            return fake_completion(json.dumps(self.batch_answer))
+        self.requests.append('single')
+        for name, answer in self.single_answers.items():
+            if f"'name': '{name}'" in prompt.split('input data:')[1]:
+                if isinstance(answer, Exception):
+                    raise answer
+                return fake_completion(answer)
+        return fake_completion('No Matches')
+
+    def find(self, *names):
+        payloads = [{'entity_type': 'Person', 'data': {'name': name}} for name in names]
+        with self.app.app_context(), contextlib.redirect_stdout(io.StringIO()):
+            return self.matching.find_entity_matches(payloads)
+
+    def test_ambiguous_entities_share_one_batched_request(self):
+        self.batch_answer = {'matches': [{'index': 0, 'match_id': self.ids['Alice Smith']},
+                                         {'index': 1, 'match_id': None}]}
+        self.single_answers = {'Carol': str(self.ids['Carol Lee'])}
+        results = self.find('Alice', 'Bob', 'Carol', 'Dave')
+
+        # Dave has no candidates and never reaches the model; Carol is missing from the batch answer and is asked alone
+        self.assertEqual(results, [self.ids['Alice Smith'], None, str(self.ids['Carol Lee']), None])
+        self.assertEqual(sorted(self.requests), ['batch', 'single'])
+        self.assertEqual(self.db.searched_databases, ['graph'] * 4)
+
+    def test_failed_requests_fall_back_or_are_reported_per_entity(self):
+        self.batch_answer = RuntimeError('batch request failed')
+        self.single_answers = {'Alice': RuntimeError('rate limited'), 'Bob': str(self.ids['Bob Marsh'])}
+        results = self.find('Alice', 'Bob', 'Carol')
+
+        self.assertIsInstance(results[0], RuntimeError)
+        self.assertEqual(results[1:], [str(self.ids['Bob Marsh']), None])
+        self.assertEqual(sorted(self.requests), ['batch', 'single', 'single', 'single'])
+
+    def test_failed_searches_are_reported_per_entity(self):
+        search = self.db.search_entities_with_type
+
+        def failing_search(entity_type, search_params):
+            if search_params.get('name') == 'Bob':
+                raise ConnectionError('database unavailable')
+            return search(entity_type, search_params)
+
+        self.db.search_entities_with_type = failing_search
+        self.batch_answer = {'matches': [{'index': 0, 'match_id': None}]}
+        results = self.find('Alice', 'Bob')
+
+        self.assertIsNone(results[0])
+        self.assertIsInstance(results[1], ConnectionError)
+        self.assertEqual(self.requests, ['batch'])
+
+
+class LLMCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'cache.sqlite3')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_keys_hits_and_expiry(self):
+        key = cache_key('chat', model='m', messages=[{'role': 'user', 'content': 'hi'}])
+        self.assertEqual(key, cache_key('chat', messages=[{'role': 'user', 'content': 'hi'}], model='m'))
+        self.assertNotEqual(key, cache_key('chat', model='m', messages=[{'role': 'user', 'content': 'hi!'}]))
+
+        cache = LLMCache(self.path, ttl=0)
+        self.assertIsNone(cache.get(key))
+        cache.put(key, b'answer')
+        cache.close()
+        cache = LLMCache(self.path, ttl=0)  # persisted
+        self.assertEqual(cache.get(key), b'answer')
+        self.assertEqual((cache.hits, cache.misses), (1, 0))
+        cache.ttl = 1e-9
+        self.assertIsNone(cache.get(key))
+        cache.close()
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = LLMCache(self.path, ttl=0, max_bytes=30)
+        # One clock tick per call, so the access order does not depend on the clock's resolution
+        with mock.patch('app.llm_cache.time') as clock, contextlib.redirect_stdout(io.StringIO()):
+            clock.time.side_effect = iter(range(1000, 1100)).__next__
+            for key in ('a', 'b', 'c'):
+                cache.put(key, b'x' * 10)
+            cache.get('a')
+            cache.put('d', b'x' * 10)
+            cache.evict()
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual([cache.get(key) is not None for key in ('a', 'c', 'd')], [True, True, True])
+        self.assertEqual(cache.stats()['bytes'], 30)
+        cache.close()
+
+
+class SummaryIndexTestCase(unittest.TestCase):
+
+    def test_best_match_is_the_most_similar_summary(self):
+        index = SummaryIndex(['people', 'companies'], [[1.0, 0.0], [3.0, 3.0]])
+        self.assertEqual(index.best_match([0.1, 2.0])[0], 'companies')
+        name, similarity = index.best_match([5.0, 0.0])
+        self.assertEqual(name, 'people')
+        self.assertAlmostEqual(similarity, 1.0, places=5)
+        self.assertEqual(SummaryIndex([], []).best_match([1.0, 0.0]), (None, -1))
+
+
+class SummaryWorkerTestCase(unittest.TestCase):
+
+    def test_writes_are_coalesced_into_one_summary_per_database(self):
+        summarized = []
+        worker = SummaryWorker(lambda name, changes: summarized.append(name), interval=60, debounce=0.05)
+        self.addCleanup(worker.stop)
+        for _ in range(50):
+            worker.mark_dirty('neo4j')
+        worker.mark_dirty('other')
+        self.assertTrue(worker.wait_idle(timeout=5))
+        self.assertEqual(sorted(summarized), ['neo4j', 'other'])
+
+        # Within the interval a new write waits for the next slot instead of summarizing again
+        worker.mark_dirty('neo4j')
+        self.assertFalse(worker.wait_idle(timeout=0.2))
+        self.assertEqual(len(summarized), 2)
+
+    def test_changes_are_accumulated_until_unknown(self):
+        runs = []
+        worker = SummaryWorker(lambda name, changes: runs.append((name, changes)), interval=0, debounce=0.05)
+        self.addCleanup(worker.stop)
+        worker.mark_dirty('neo4j', ['Person {name: Ada}'])
+        worker.mark_dirty('neo4j', ['Ada -[KNOWS]-> Alan'])
+        self.assertTrue(worker.wait_idle(timeout=5))
+        worker.mark_dirty('neo4j', ['Person {name: Alan}'])
+        worker.mark_dirty('neo4j')
+        self.assertTrue(worker.wait_idle(timeout=5))
+        self.assertEqual(runs, [('neo4j', ['Person {name: Ada}', 'Ada -[KNOWS]-> Alan']), ('neo4j', None)])
+
+    def test_failed_runs_keep_their_changes(self):
+        runs = []
+
+        def summarize(name, changes):
+            runs.append(changes)
+            if len(runs) == 1:
+                raise RuntimeError('model unavailable')
+
+        worker = SummaryWorker(summarize, interval=0, debounce=0.05)
+        self.addCleanup(worker.stop)
+        with contextlib.redirect_stdout(io.StringIO()):
+            worker.mark_dirty('neo4j', ['Person {name: Ada}'])
+            self.assertTrue(worker.wait_idle(timeout=5))
+        self.assertEqual(runs, [['Person {name: Ada}'], ['Person {name: Ada}']])
+
+    def test_reduce_rounds_end_when_no_two_partials_fit_together(self):
+        prompts = []
+
+        def ask_summary(prompt, max_tokens=100):
+            prompts.append(prompt)
+            return 'a partial summary longer than the partition limit'
+
+        partition_lines = kg_selection.partition_lines
+        with mock.patch.object(kg_selection, 'partition_lines', lambda lines: partition_lines(lines, max_chars=10)), \
+                mock.patch.object(kg_selection, 'ask_summary', ask_summary), \
+                contextlib.redirect_stdout(io.StringIO()):
+            summary = kg_selection.map_reduce_summary([f'Person {{name: P{i}}}' for i in range(8)])
+        self.assertEqual(summary, 'a partial summary longer than the partition limit')
+        # 8 partitions, then 4 and 2 pairwise combinations and the final one
+        self.assertEqual(len(prompts), 8 + 4 + 2 + 1)
+
+    def test_scheduled_summary_runs_in_an_app_context(self):
+        from flask import Flask, current_app
+        app = Flask(__name__)
+        app.config['SELECTED_DB'] = 'graph'
+        read_databases = []
+
+        def get_database_summary(database_name):
+            # Like the Neo4j backend, reading the graph needs the app context
+            read_databases.append((database_name, current_app.config['SELECTED_DB']))
+            return {'nodes': [], 'relationships': []}
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        patches = {
+            'GRAPH_SUMMARIES_FILE': os.path.join(directory.name, 'graph_summaries.json'),
+            'SUMMARY_DEBOUNCE': 0.01,
+            'SUMMARY_INTERVAL': 0,
+            '_summary_worker': None,
+            'get_database_summary': get_database_summary,
+            'ask_summary': lambda prompt, max_tokens=100: 'A graph of people.',
+            'build_summary_index': lambda app: None,
+        }
+        for name, value in patches.items():
+            patcher = mock.patch.object(kg_selection, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            kg_selection.schedule_summary(app, 'graph')
+            worker = kg_selection._summary_worker
+            self.addCleanup(worker.stop)
+            self.assertTrue(worker.wait_idle(timeout=5))
+        self.assertEqual(read_databases, [('graph', 'graph')])
+        self.assertEqual(app.config['GRAPH_SUMMARIES'], {'graph': 'A graph of people.'})
+
+
+class GraphSummaryTestCase(unittest.TestCase):
+
+    def test_graph_lines_from_neo4j_records(self):
+        from flask import Flask
+        from neo4j import Record
+        rows = {
+            'MATCH (n)': [
+                Record({'labels': ['Person'], 'properties': {'name': 'Ada'}}),
+                Record({'labels': ['Concept'], 'properties': {'term': 'Analytical Engine'}}),
+                Record({'labels': ['Person'], 'properties': {'name': 'Charles'}}),
+            ],
+            'MATCH (a)': [
+                Record({'from_name': 'Ada', 'type': 'Worked_on', 'to_name': 'Analytical Engine'}),
+                Record({'from_name': 'Ada', 'type': 'Knew', 'to_name': 'Charles'}),
+            ],
+        }
+        session = mock.MagicMock()
+        session.__enter__.return_value.run.side_effect = lambda cypher, params: rows[cypher[:9]]
+        driver = mock.Mock(**{'session.return_value': session})
+        app = Flask(__name__)
+        app.config['SELECTED_DB'] = 'graph'
+
+        with mock.patch('app.integrations.database.neo4j.get_driver', return_value=driver), app.app_context(), \
+                contextlib.redirect_stdout(io.StringIO()):
+            lines = kg_selection.graph_lines(kg_selection.get_database_summary('graph'))
+        self.assertEqual(lines, [
+            "Concept {'term': 'Analytical Engine'}",
+            "Person {'name': 'Ada'}",
+            "Person {'name': 'Charles'}",
+            'Ada -[Worked_on]-> Analytical Engine',
+            'Ada -[Knew]-> Charles',
+        ])
+        driver.session.assert_called_with(database='graph')
+
+
+class JobQueueTestCase(unittest.TestCase):
+
+    def setUp(self):
+        from flask import Flask
+        self.app = Flask(__name__)
+        # The queue logs every job it runs
+        self.enterContext(contextlib.redirect_stdout(io.StringIO()))
+
+    def wait_for(self, job):
+        for _ in range(500):
+            if job.finished is not None:
+                return job
+            threading.Event().wait(0.01)
+        self.fail("job did not finish")
+
+    def test_job_records_nested_integrations_as_stages(self):
+        from flask import jsonify
+
+        def inner(app, data):
+            return jsonify(count=data["count"] * 2), 200
+
+        def outer(app, data):
+            response, status_code = tracked("inner", inner)(app, data)
+            return jsonify(inner=response.get_json()), status_code
+
+        jobs = JobQueue(self.app, workers=1)
+        job = self.wait_for(jobs.submit("outer", outer, {"count": 21}))
+        self.assertEqual(job.status, SUCCEEDED)
+        self.assertEqual(job.result, {"inner": {"count": 42}})
+        self.assertEqual([stage["stage"] for stage in job.stages], ["outer", "inner"])
+        self.assertIs(jobs.get(job.id), job)
+
+        failing = self.wait_for(jobs.submit("broken", lambda app, data: 1 / 0, {}))
+        self.assertEqual((failing.status, failing.status_code), (FAILED, 500))
+
+    def test_submit_refuses_jobs_past_the_queue_size(self):
+        release = threading.Event()
+        jobs = JobQueue(self.app, workers=1, max_queued=1)
+        blocked = lambda app, data: release.wait(5) and ({}, 200)
+        first = jobs.submit("slow", blocked, {})
+        while first.started is None:
+            threading.Event().wait(0.01)
+        second = jobs.submit("slow", blocked, {})
+        with self.assertRaises(JobQueueFull):
+            jobs.submit("slow", blocked, {})
+        release.set()
+        self.wait_for(second)
+
+
+class UrlArrayProcessorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        from flask import Flask, jsonify
+        import requests
+        from app.integrations import url_array_processor, url_input
+        self.requests = requests
+        self.processor = url_array_processor
+        self.app = Flask(__name__)
+        self.app.integration_manager = IntegrationManager(self.app)
+        self.app.integration_manager.available.update({'url_input', 'url_array_processor'})
+        self.app.integration_manager.register(
+            'natural_input', lambda app, data: (jsonify(title=data['natural_input']['title']), 200))
+
+        self.all_downloading = threading.Barrier(3)
+        self.gets = []
+        session = mock.Mock(spec=requests.Session)
+        session.get.side_effect = self.get
+        for patcher in (mock.patch.object(url_input, 'session', session),
+                        mock.patch.object(url_array_processor, 'URL_ARRAY_WORKERS', 4)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def get(self, url, timeout):
+        self.gets.append((url, timeout))
+        if 'slow' in url:
+            raise self.requests.Timeout(f'read timed out after {timeout}s')
+        # Every other download waits until all three are in flight, which only happens if they run concurrently
+        self.all_downloading.wait(timeout=5)
+        page = f'<html><head><title>{url}</title></head><body>text</body></html>'
+        return mock.Mock(status_code=200, content=page.encode('utf8'))
+
+    def test_urls_are_processed_concurrently_through_url_input(self):
+        from app.integrations.url_input import URL_FETCH_TIMEOUT
+        urls = ['https://a.example/1', 'https://a.example/2', 'https://b.example/1', 'https://slow.example/',
+                'not a url']
+        jobs = JobQueue(self.app, workers=1)
+        with contextlib.redirect_stdout(io.StringIO()):
+            job = jobs.submit('url_array_processor', self.processor.url_array_processor, {'urls': urls})
+            for _ in range(500):
+                if job.finished is not None:
+                    break
+                threading.Event().wait(0.01)
+
+        self.assertEqual(job.status, SUCCEEDED)
+        self.assertEqual(sorted(job.result['errors']), [
+            'Failed to process URL https://slow.example/: Status Code 400',
+            'Invalid URL: not a url',
+        ])
+        self.assertEqual(sorted(url for url, _ in self.gets), sorted(urls[:4]))
+        self.assertTrue(all(timeout == URL_FETCH_TIMEOUT for _, timeout in self.gets))
+        timings = {timing['url']: timing for timing in job.result['timings']}
+        self.assertEqual(set(timings), set(urls[:4]))
+        self.assertEqual(timings['https://slow.example/']['status_code'], 400)
+        self.assertTrue(all(timing['seconds'] >= 0 for timing in timings.values()))
+        stages = [stage['stage'] for stage in job.stages]
+        self.assertEqual((stages[0], stages.count('url_input'), stages.count('natural_input')),
+                         ('url_array_processor', 4, 3))
+
+
+class ChunkedExtractionTestCase(unittest.TestCase):
+
+    def test_split_text_keeps_sentences_whole_and_overlaps(self):
+        text = " ".join(f"Sentence number {i} is here." for i in range(100))
+        chunks = split_text(text, max_chars=300, overlap=60)
+        self.assertGreater(len(chunks), 1)
+        for chunk in chunks:
+            self.assertLessEqual(len(chunk), 300)
+            self.assertTrue(chunk.startswith("Sentence") and chunk.endswith("."))
+        self.assertEqual(chunks[1].split(". ")[0], chunks[0].split(". ")[-2])
+
+    def test_merge_graphs_renumbers_temp_ids_and_merges_names(self):
+        works = {"relationship": "Works for"}
+        first = {"nodes": {"Person": [{"temp_id": 1, "name": "Ada Lovelace"}],
+                           "Organization": [{"temp_id": 2, "name": "Analytical Society"}]},
+                 "relationships": [{"from_type": "Person", "from_temp_id": 1,
+                                    "to_type": "Organization", "to_temp_id": 2, "data": works}]}
+        second = {"nodes": {"Organization": [{"temp_id": 1, "name": "analytical  society"}],
+                            "Person": [{"temp_id": 2, "name": "ADA LOVELACE"}, {"temp_id": 3, "name": "Charles"}]},
+                  "relationships": [{"from_type": "Person", "from_temp_id": 2,
+                                     "to_type": "Organization", "to_temp_id": 1, "data": works},
+                                    {"from_type": "Person", "from_temp_id": 3,
+                                     "to_type": "Organization", "to_temp_id": 1, "data": works}]}
+        merged = merge_graphs([first, second])
+        self.assertEqual([entity["name"] for entity in merged["nodes"]["Person"]], ["Ada Lovelace", "Charles"])
+        self.assertEqual(len(merged["nodes"]["Organization"]), 1)
+        self.assertEqual(
+            [(r["from_temp_id"], r["to_temp_id"]) for r in merged["relationships"]], [(1, 2), (3, 2)])
+
+
+class SchemaRegistryTestCase(unittest.TestCase):
+
+    def write(self, path, schema, mtime):
+        with open(path, "w") as file:
+            json.dump(schema, file)
+        os.utime(path, ns=(mtime, mtime))
+
+    def test_schema_is_compiled_once_and_reloaded_when_changed(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "schema.json")
+        person = {"node_type": "Person", "edge_types": {"name": "Name.", "Works for": "Employer."}}
+        self.write(path, {"Person": person}, 1_000_000_000)
+        registry = SchemaRegistry(path)
+        compiled = registry.get()
+        self.assertIs(registry.get(), compiled)
+        self.assertEqual(registry.loads, 1)
+        self.assertEqual(compiled.column_names, {"Person": ["name", "Works_for"]})
+        self.assertEqual(compiled.extraction_function["name"], "knowledge_graph")
+        self.assertIn("Works for", compiled.nebula_edge_queries)
+
+        self.write(path, {"Person": person, "Event": {"node_type": "Event", "edge_types": {}}}, 2_000_000_000)
+        self.assertEqual(registry.get().entity_types, ["Person", "Event"])
+
+        # An invalid file keeps the last good schema
+        self.write(path, {"Person": {"edge_types": {}}}, 3_000_000_000)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(registry.get().entity_types, ["Person", "Event"])
+        with self.assertRaises(SchemaError):
+            SchemaRegistry(path).get()
+
+
+class LazyIntegrationTestCase(unittest.TestCase):
+
+    def test_integration_module_is_imported_on_first_use(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        root = directory.name
+        package = os.path.join(root, "lazy_integrations")
+        os.mkdir(package)
+        open(os.path.join(package, "__init__.py"), "w").close()
+        with open(os.path.join(package, "sample.py"), "w") as file:
+            file.write("def sample(app, data):\n    return data\n\n"
+                       "def register(integration_manager):\n    integration_manager.register('sample', sample)\n")
+        sys.path.insert(0, root)
+        self.addCleanup(sys.path.remove, root)
+
+        manager = IntegrationManager(None, package="lazy_integrations")
+        manager.available.add("sample")
+        self.assertNotIn("lazy_integrations.sample", sys.modules)
+        self.assertIsNone(manager.load("missing"))
+
+        sample = manager.load("sample")
+        self.assertEqual(sample(None, {"a": 1}), {"a": 1})
+        self.assertIs(manager.load("sample"), sample)
+        self.assertIn("lazy_integrations.sample", import_costs)
+
+
+def reference_murmur64(string, seed=0xC70F6907):
+    # The byte-by-byte implementation nebulagraph.py used before murmur.py, kept to check against
+    data_as_bytes = bytearray(bytes(string, encoding="utf8"))
+    m = ctypes.c_uint64(0xC6A4A7935BD1E995).value
+    r = ctypes.c_uint32(47).value
+    MASK = ctypes.c_uint64(2**64 - 1).value
+    h = ctypes.c_uint64(seed).value ^ ((m * len(data_as_bytes)) & MASK)
+    off = int(len(data_as_bytes) / 8) * 8
+    for ll in range(0, off, 8):
+        k = sum((b << (i * 8) for i, b in enumerate(data_as_bytes[ll:ll + 8])))
+        k = (k * m) & MASK
+        k = k ^ ((k >> r) & MASK)
+        k = (k * m) & MASK
+        h = h ^ k
+        h = (h * m) & MASK
+    l = len(data_as_bytes) & 7
+    if l >= 7:
+        h = h ^ (data_as_bytes[off + 6] << 48)
+    if l >= 6:
+        h = h ^ (data_as_bytes[off + 5] << 40)
+    if l >= 5:
+        h = h ^ (data_as_bytes[off + 4] << 32)
+    if l >= 4:
+        h = h ^ (data_as_bytes[off + 3] << 24)
+    if l >= 3:
+        h = h ^ (data_as_bytes[off + 2] << 16)
+    if l >= 2:
+        h = h ^ (data_as_bytes[off + 1] << 8)
+    if l >= 1:
+        h = h ^ data_as_bytes[off]
+        h = (h * m) & MASK
+    h = h ^ ((h >> r) & MASK)
+    h = (h * m) & MASK
+    h = h ^ ((h >> r) & MASK)
+    return ctypes.c_longlong(h).value
+
+
+class Murmur64TestCase(unittest.TestCase):
+
+    def random_strings(self, rng, count):
+        alphabet = "abcXYZ 019-_/é漢😀"
+        return [
+            "".join(rng.choice(alphabet) for _ in range(rng.randrange(0, 70)))
+            for _ in range(count)
+        ]
+
+    def test_scalar_and_batched_match_the_reference(self):
+        rng = random.Random(2024)
+        strings = ["", "a", "foobar", "12345678", "123456789", "Ada Lovelace"] + self.random_strings(rng, 500)
+        expected = [reference_murmur64(string) for string in strings]
+        self.assertEqual([murmur64(string) for string in strings], expected)
+        self.assertEqual(murmur64_many(strings), expected)
+
+    def test_seeds_and_empty_batches(self):
+        rng = random.Random(7)
+        for _ in range(20):
+            seed = rng.getrandbits(64)
+            strings = self.random_strings(rng, 10)
+            expected = [reference_murmur64(string, seed) for string in strings]
+            self.assertEqual(murmur64_many(strings, seed), expected)
+            self.assertEqual([murmur64(string, seed) for string in strings], expected)
+        self.assertEqual(murmur64_many([]), [])
+
+
+class FakeNebulaValue:
+
+    def __init__(self, value):
+        self.value = value
+
+    def cast(self):
+        return self.value
+
+
+class FakeNebulaResult:
+
+    def __init__(self, keys=(), rows=()):
+        self._keys = list(keys)
+        self._rows = [[FakeNebulaValue(value) for value in row] for row in rows]
+
+    def is_succeeded(self):
+        return True
+
+    def keys(self):
+        return self._keys
+
+    def row_size(self):
+        return len(self._rows)
+
+    def row_values(self, row):
+        return self._rows[row]
+
+
+class NebulaSearchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        from app.integrations.database.nebulagraph import NebulaGraphIntegration
+        from app.schema_registry import CompiledSchema
+        self.queries = []
+        self.db = NebulaGraphIntegration.__new__(NebulaGraphIntegration)
+        self.db.client = self
+        self.db.compiled_schema = CompiledSchema({
+            "Person": {"node_type": "Person", "edge_types": {"Works for": "Employer."}},
+        })
+
+    def execute(self, query):
+        self.queries.append(query)
+        if query.startswith("MATCH (v:`Person`)"):
+            return FakeNebulaResult(["id", "props"], [[7, {"name": FakeNebulaValue("Ada")}]])
+        return FakeNebulaResult(["from_id", "to_id", "props", "from_entity", "to_entity"],
+                                [[7, 8, {"snippet": FakeNebulaValue("s")}, "Ada", "ACME"]])
+
+    def test_entity_search_is_a_server_side_match(self):
+        results = self.db.search_entities({"name": 'ADA "L'})
+        self.assertEqual(results, [{"type": "Person", "id": 7, "name": "Ada"}])
+        self.assertEqual(self.queries, [
+            'MATCH (v:`Person`) WHERE lower(toString(v.`Person`.`name`)) CONTAINS "ada \\"l" '
+            'RETURN id(v) AS id, properties(v) AS props;'
+        ])
+
+    def test_relationship_search_matches_endpoints_exactly(self):
+        results = self.db.search_relationships({"relationship": "works", "from_id": "7"})
+        self.assertEqual(results, [{"snippet": "s", "relationship": "Works for", "from_id": 7, "to_id": 8,
+                                    "from_entity": "Ada", "to_entity": "ACME"}])
+        self.assertIn("MATCH (a)-[e:`Works for`]->(b) WHERE id(a) == 7 ", self.queries[0])
+        self.assertEqual(self.db.search_relationships({"relationship": "founded"}), [])
+
+    def test_relationship_search_with_a_non_numeric_endpoint_matches_nothing(self):
+        self.assertEqual(self.db.search_relationships({"from_id": "ada"}), [])
+        self.assertEqual(self.db.search_relationships({"to_id": None}), [])
+        self.assertEqual(self.queries, [])
+
+    def test_inserted_names_and_descriptions_are_escaped(self):
+        self.db.graph = {"entities": {}, "relationships": []}
+        names = ["O'Brien", 'Back\\slash "quoted"', "x'), 1:('injected"]
+        ids = self.db.add_entities("Person", [{"data": {"name": name, "description": "it's"}} for name in names])
+        self.assertEqual(ids, [str(vertex_id) for vertex_id in murmur64_many(names)])
+        self.assertEqual(self.queries, [
+            'INSERT VERTEX `Person`(name, description) VALUES '
+            f'{ids[0]}:("O\'Brien", "it\'s"), '
+            f'{ids[1]}:("Back\\\\slash \\"quoted\\"", "it\'s"), '
+            f'{ids[2]}:("x\'), 1:(\'injected", "it\'s");'
+        ])
+
+        vertex_id = self.db.add_entity("Person", {"data": {"name": "D'Arcy"}})
+        self.assertEqual(self.queries[1], f'INSERT VERTEX `Person`(name, description) VALUES {vertex_id}:("D\'Arcy", "");')
+
+
+class InMemoryDatabaseCompactRecordsTestCase(unittest.TestCase):
+
+    def run_script(self, db):
+        a = db.add_entity('Person', {'entity_type': 'Person', 'data': {'name': 'Alice', 'tags': ['x']}})
+        b = db.add_entity('Organization', {'entity_type': 'Organization', 'data': {'name': 'ACME'}})
+        c = db.add_entity('Person', {'entity_type': 'Person', 'data': {'name': 'Carol'}})
+        db.add_relationship({'from_id': a, 'to_id': b, 'relationship': 'Works for', 'snippet': ''})
+        db.add_relationship({'from_id': c, 'to_id': b, 'relationship': 'Works for', 'snippet': ''})
+        db.update_entity('Person', c, {'data': {'name': 'Carol Jones'}})
+        db.delete_entity('Person', a)
+        return [
+            db.get_full_graph(),
+            db.get_entity('Person', c),
+            db.get_all_entities('Person'),
+            db.search_entities({'name': 'jones'}),
+            db.get_entity_relationships(b),
+            db.search_relationships({'relationship': 'works'}),
+        ]
+
+    def test_compact_mode_matches_dict_mode(self):
+        compact = InMemoryDatabase(compact=True)
+        self.assertEqual(self.run_script(compact), self.run_script(InMemoryDatabase(compact=False)))
+        entity = compact.get_entity('Person', 3)
+        entity['data']['name'] = 'changed'
+        self.assertEqual(compact.get_entity('Person', 3)['data']['name'], 'Carol Jones')
+
+
+class InMemoryDatabaseConcurrencyTestCase(unittest.TestCase):
+
+    def test_concurrent_writers_and_readers(self):
+        db = InMemoryDatabase(thread_safe=True)
+        hub = db.add_entity('Organization', {'entity_type': 'Organization', 'data': {'name': 'Hub'}})
+        ids, errors = [], []
+
+        def writer(worker):
+            entity_type = ['Person', 'Event', 'Concept'][worker % 3]
+            for i in range(200):
+                entity_id = db.add_entity(entity_type, {'entity_type': entity_type, 'data': {'name': f'w{worker}-{i}'}})
+                ids.append(entity_id)
+                db.add_relationship({'from_id': entity_id, 'to_id': hub, 'relationship': 'member of'})
+                db.update_entity(entity_type, entity_id, {'data': {'name': f'w{worker}-{i} updated'}})
+
+        def reader():
+            try:
+                for _ in range(50):
+                    graph = db.get_full_graph()
+                    relationship_ids = {r['from_id'] for r in graph['relationships']}
+                    entity_ids = {entity_id for entities in graph['entities'].values() for entity_id in entities}
+                    self.assertLessEqual(relationship_ids, entity_ids)
+                    db.search_entities({'name': 'updated'})
+            except Exception as error:
+                errors.append(error)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            threads = [threading.Thread(target=writer, args=(worker,)) for worker in range(6)]
+            threads += [threading.Thread(target=reader) for _ in range(2)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(set(ids)), 1200)
+        self.assertEqual(len(db.get_entity_relationships(hub, 'in')), 1200)
+        self.assertEqual(len(db.search_entities({'name': 'updated'})), 1200)
+        sequences = [sequence for entries in db._index.indexed.values() for sequence, _ in entries.values()]
+        self.assertEqual(len(set(sequences)), len(sequences))
+
+    def read_during_write(self, db, write_seconds, **settings):
+        # Hold a write open in another thread while this thread reads
+        started, results = threading.Event(), []
+
+        def write():
+            with db._version:
+                started.set()
+                threading.Event().wait(write_seconds)
+
+        thread = threading.Thread(target=write)
+        patchers = [mock.patch.object(memory, name, value) for name, value in settings.items()]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        thread.start()
+        started.wait()
+        results.append(db.get_full_graph())
+        thread.join()
+        return results[0]
+
+    def test_reads_back_off_until_a_write_finishes(self):
+        db = InMemoryDatabase(thread_safe=True)
+        with contextlib.redirect_stdout(io.StringIO()):
+            db.add_entity('Person', {'data': {'name': 'Alice'}})
+        graph = self.read_during_write(db, 0.05, MEMORY_READ_RETRIES=8, MEMORY_READ_BACKOFF_MS=20,
+                                       MEMORY_READ_MAX_BACKOFF_MS=400)
+        self.assertEqual(len(graph['entities']['Person']), 1)
+        self.assertEqual(db.locked_reads, 0)
+
+    def test_reads_fall_back_to_locks_after_the_retries(self):
+        db = InMemoryDatabase(thread_safe=True)
+        with contextlib.redirect_stdout(io.StringIO()):
+            db.add_entity('Person', {'data': {'name': 'Alice'}})
+        graph = self.read_during_write(db, 0.2, MEMORY_READ_RETRIES=2, MEMORY_READ_BACKOFF_MS=1,
+                                       MEMORY_READ_MAX_BACKOFF_MS=1)
+        self.assertEqual(len(graph['entities']['Person']), 1)
+        self.assertEqual(db.locked_reads, 1)
+
+    def test_full_graph_results_are_independent_copies(self):
+        db = InMemoryDatabase(thread_safe=True)
+        with contextlib.redirect_stdout(io.StringIO()):
+            a = db.add_entity('Person', {'data': {'name': 'Alice'}})
+            b = db.add_entity('Person', {'data': {'name': 'Bob'}})
+            db.add_relationship({'from_id': a, 'to_id': b, 'relationship': 'knows'})
+
+        graph = db.get_full_graph()
+        graph['entities']['Person'].pop(a)
+        graph['entities']['Event'] = {}
+        graph['relationships'].clear()
+
+        again = db.get_full_graph()
+        self.assertEqual(set(again['entities']), {'Person'})
+        self.assertEqual(set(again['entities']['Person']), {a, b})
+        self.assertEqual(len(again['relationships']), 1)
+
+
+
+class InMemoryDatabasePersistenceTestCase(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.data_dir = directory.name
+
+    def test_recovers_from_snapshot_and_log_tail(self):
+        db = InMemoryDatabase(data_dir=self.data_dir)
+        a = db.add_entity('Person', {'entity_type': 'Person', 'data': {'name': 'Alice'}})
+        b = db.add_entity('Person', {'entity_type': 'Person', 'data': {'name': 'Bob'}})
+        db.snapshot()
+        relationship_id = db.add_relationship({'from_id': a, 'to_id': b, 'relationship': 'knows'})
+        db.update_entity('Person', a, {'data': {'name': 'Alicia'}})
+        db.close()
+
+        recovered = InMemoryDatabase(data_dir=self.data_dir)
+        self.assertEqual(recovered.get_entity('Person', a)['data']['name'], 'Alicia')
+        self.assertEqual(recovered.get_relationship(relationship_id)['to_id'], b)
+        self.assertEqual([r['id'] for r in recovered.search_entities({'name': 'bob'})], [b])
+        # ID counters survive the restart
+        self.assertGreater(recovered.add_entity('Person', {'data': {'name': 'Carol'}}), b)
+        self.assertGreater(recovered.add_relationship({'from_id': b, 'to_id': a}), relationship_id)
+        recovered.close()
+
+    def test_torn_log_tail_is_discarded(self):
+        db = InMemoryDatabase(data_dir=self.data_dir)
+        a = db.add_entity('Person', {'data': {'name': 'Alice'}})
+        db.close()
+        with open(os.path.join(self.data_dir, 'wal.jsonl'), 'ab') as wal:
+            wal.write(b'{"lsn": 2, "op": "add_ent')
+
+        recovered = InMemoryDatabase(data_dir=self.data_dir)
+        self.assertEqual(recovered.get_entity('Person', a), {'data': {'name': 'Alice'}})
+        recovered.close()
+
+    def test_rejected_writes_are_not_replayed(self):
+        db = InMemoryDatabase(data_dir=self.data_dir)
+        a = db.add_entity('Person', {'data': {'name': 'Alice'}})
+        with self.assertRaises(AttributeError):
+            db.add_relationship('not a relationship')
+        self.assertEqual(db.get_full_graph()['relationships'], [])
+        db.close()
+
+        recovered = InMemoryDatabase(data_dir=self.data_dir)
+        self.assertEqual(recovered.get_entity('Person', a), {'data': {'name': 'Alice'}})
+        self.assertEqual(recovered.get_full_graph()['relationships'], [])
+        recovered.close()
+
+    def test_writes_the_log_refuses_are_not_applied(self):
+        db = InMemoryDatabase(data_dir=self.data_dir)
+        with mock.patch.object(db._journal, 'append', side_effect=OSError('disk full')):
+            with self.assertRaises(OSError):
+                db.add_entity('Person', {'data': {'name': 'Alice'}})
+        self.assertEqual(db.get_full_graph(), {'entities': {}, 'relationships': []})
+        db.close()
+
+
+    def test_recovers_from_columnar_snapshot(self):
+        db = InMemoryDatabase(data_dir=self.data_dir)
+        db._journal.snapshot_format = 'columnar'
+        a = db.add_entity('Person', {'entity_type': 'Person', 'data': {'name': 'Alice'}})
+        b = db.add_entity('Organization', {'entity_type': 'Organization', 'data': {'name': 'ACME'}})
+        db.add_relationship({'from_id': a, 'to_id': b, 'relationship': 'Works for'})
+        db.snapshot()
+        db.close()
+
+        recovered = InMemoryDatabase(data_dir=self.data_dir)
+        self.assertEqual(recovered.get_entity('Organization', b)['data'], {'name': 'ACME'})
+        self.assertEqual([r['id'] for r in recovered.search_entities_with_type('Person', {'name': 'ali'})], [a])
+        self.assertEqual(recovered.get_entity_relationships(b, 'in')[0]['relationship'], 'Works for')
+        recovered.delete_entity('Person', a)
+        self.assertEqual(recovered.get_full_graph(), {
+            'entities': {'Person': {}, 'Organization': {b: {'entity_type': 'Organization', 'data': {'name': 'ACME'}}}},
+            'relationships': [],
+        })
+        recovered.close()
+
+
+if __name__ == '__main__':
+    unittest.main()